@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'amlservice.settings')
 
 application = get_asgi_application()
+
+# Load the production models before a preloading server forks its workers
+from core.registry import preload_models  # noqa: E402
+
+preload_models()
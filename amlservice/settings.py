@@ -80,8 +80,16 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.CursorPagination',
+    'DEFAULT_FILTER_BACKENDS': [
+        'api.filters.QueryParamFilterBackend',
+    ],
+    'PAGE_SIZE': 100,
 }
 
+# Upper bound for the ?page_size= query parameter on paginated API lists
+API_MAX_PAGE_SIZE = 1000
+
 # Authentication settings
 LOGIN_REDIRECT_URL = '/'
 LOGIN_URL = 'login'
@@ -102,9 +110,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock when a transaction starts, so concurrent writers
+        # (e.g. scoring workers) wait for each other instead of failing with
+        # "database is locked" when upgrading a read lock.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# File-based so that every worker process on a host shares one copy of the
+# dashboard metrics and sees the same invalidations.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
+# Upper bound on the age of cached dashboard metrics, in seconds. Writes to
+# transactions, documents and assessments mark them stale sooner.
+DASHBOARD_METRICS_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -151,6 +180,127 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Machine learning artifacts
+# Fitted models are written here by the training management commands and
+# memory-mapped read-only by each process, so workers serving the same version
+# share its pages. With MODEL_PRELOAD the WSGI/ASGI application loads the
+# production models on import, which a server started with --preload (e.g.
+# gunicorn) does once in the master before forking its workers.
+ML_ARTIFACTS_DIR = BASE_DIR / 'ml_artifacts'
+MODEL_PRELOAD = True
+
+# Anomaly scoring micro-batches. Concurrent scoring calls in a process are
+# coalesced into one model call of up to ANOMALY_BATCH_MAX_ROWS rows, holding
+# each call for at most ANOMALY_BATCH_MAX_WAIT_MS; 0 disables batching. A
+# process serving one request at a time (runserver, sync gunicorn workers)
+# never has company to wait for, so batching is off by default; set it to a
+# few milliseconds for threaded (gunicorn --threads) or ASGI servers.
+ANOMALY_BATCH_MAX_ROWS = 256
+ANOMALY_BATCH_MAX_WAIT_MS = 0
+
+# Model registry. Each process re-reads which model versions are in production
+# and shadow at most every MODEL_REGISTRY_POLL_SECONDS and hot-swaps newly
+# promoted ones. Shadow scoring runs in a background thread fed by a queue of
+# SHADOW_QUEUE_SIZE batches (further batches are dropped, never waited on);
+# statistics are written back every SHADOW_FLUSH_ROWS rows.
+MODEL_REGISTRY_POLL_SECONDS = 10
+SHADOW_QUEUE_SIZE = 1000
+SHADOW_FLUSH_ROWS = 500
+
+# Columnar exports (manage.py export_data and /api/exports/). Datasets are
+# written under EXPORT_DIR as 'parquet' or 'arrow' (uncompressed Arrow IPC,
+# read zero-copy when memory-mapped), EXPORT_CHUNK_ROWS rows per query.
+EXPORT_DIR = BASE_DIR / 'exports'
+EXPORT_FORMAT = 'parquet'
+EXPORT_CHUNK_ROWS = 100000
+
+# Sanctions and high-risk jurisdiction screening. Each process re-reads the
+# versioned lists file when it changes, checking at most every
+# SCREENING_LISTS_POLL_SECONDS; `manage.py rescreen` applies a new version to
+# existing customers and transactions.
+SCREENING_LISTS_PATH = BASE_DIR / 'screening' / 'lists.json'
+SCREENING_LISTS_POLL_SECONDS = 30
+# Minimum trigram (Dice) similarity for a customer name to match a watchlist
+# entry; 1.0 only matches the same name up to case, accents and word order.
+SCREENING_NAME_THRESHOLD = 0.8
+
+# Maximum number of rows accepted by POST /api/transactions/bulk/
+TRANSACTION_BULK_MAX_ROWS = 50000
+
+# Rolling activity windows (in hours) used by structuring and velocity rules.
+# Hourly buckets are kept for AML_ACTIVITY_HORIZON_HOURS, which must cover the
+# longest window.
+AML_ACTIVITY_WINDOWS = {
+    '24h': 24,
+    '7d': 7 * 24,
+    '30d': 30 * 24,
+}
+AML_ACTIVITY_HORIZON_HOURS = 31 * 24
+
+# Compliance rules (see core/rules.py). A rule fires when all of its conditions
+# hold; conditions are `<column>__<op>` lookups on transaction fields or on the
+# customer's activity over an AML_ACTIVITY_WINDOWS window (`sum_7d`,
+# `count_24h`). Rules reading the same column share one computation.
+COMPLIANCE_RULES = [
+    {
+        'name': 'ctr_threshold',
+        'report': 'CTR',
+        'severity': 'HIGH',
+        'description': 'Transaction amount (£{amount}) exceeds CTR threshold',
+        'conditions': {'amount__gt': 10000},
+    },
+    {
+        'name': 'structuring',
+        'report': 'SAR',
+        'severity': 'MEDIUM',
+        'description': 'Multiple transactions potentially indicating structuring',
+        'conditions': {'sum_7d__gt': 5000},
+    },
+]
+
+# Transaction flow graph (see core/graph.py). Each transaction is checked for
+# cycles of up to TRANSACTION_GRAPH_MAX_CYCLE_LENGTH edges through foreign
+# countries (round-tripping), fan-out/fan-in to at least
+# TRANSACTION_GRAPH_FAN_LIMIT foreign countries and outflow matching inflow
+# (pass-through) over the window before it; the strongest pattern raises its
+# risk score. Cycles are only sought for transactions of at least
+# TRANSACTION_GRAPH_CYCLE_MIN_AMOUNT, through edges whose amounts are within
+# TRANSACTION_GRAPH_CYCLE_AMOUNT_RATIO of theirs. Processes read transactions
+# inserted by others at most every TRANSACTION_GRAPH_POLL_SECONDS. With
+# TRANSACTION_GRAPH_PRELOAD the WSGI/ASGI application reads the whole horizon
+# into the graph on import; enable it for servers started with --preload,
+# otherwise the first scoring request in each process loads it.
+TRANSACTION_GRAPH_WINDOW_HOURS = 72
+TRANSACTION_GRAPH_MAX_CYCLE_LENGTH = 4
+TRANSACTION_GRAPH_FAN_LIMIT = 5
+TRANSACTION_GRAPH_PASS_THROUGH_RATIO = 0.9
+TRANSACTION_GRAPH_PASS_THROUGH_MIN_AMOUNT = 1000
+TRANSACTION_GRAPH_CYCLE_MIN_AMOUNT = 1000
+TRANSACTION_GRAPH_CYCLE_AMOUNT_RATIO = 0.8
+TRANSACTION_GRAPH_DOMESTIC_COUNTRIES = ['GB']
+TRANSACTION_GRAPH_POLL_SECONDS = 30
+TRANSACTION_GRAPH_PRELOAD = False
+
+# Transaction scoring. In 'sync' mode the API scores each transaction before
+# responding; in 'async' mode it stores the transaction as pending, queues a
+# ScoringJob in the same database transaction and returns immediately, and
+# `manage.py run_scoring_worker` scores queued jobs in batches.
+TRANSACTION_SCORING_MODE = 'sync'
+SCORING_WORKERS = 2
+SCORING_BATCH_SIZE = 500
+SCORING_MAX_ATTEMPTS = 5
+SCORING_RETRY_BACKOFF_SECONDS = 30  # doubled after each failed attempt
+SCORING_JOB_LEASE_SECONDS = 300  # running jobs older than this are requeued
+
+# Periodic reviews (`manage.py run_periodic_reviews`). Days until the next
+# review by risk band, and where an interrupted run records its progress.
+PERIODIC_REVIEW_INTERVAL_DAYS = {
+    'high': 90,
+    'medium': 180,
+    'low': 365,
+}
+PERIODIC_REVIEW_CHECKPOINT = BASE_DIR / 'checkpoints' / 'periodic_reviews.json'
+
 # Security settings
 SECURE_CONTENT_TYPE_NOSNIFF = True
 SECURE_BROWSER_XSS_FILTER = True
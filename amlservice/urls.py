@@ -25,8 +25,12 @@ urlpatterns = [
     path('', login_required(core_views.dashboard), name='dashboard'),
     path('customers/', login_required(core_views.customer_list), name='customers'),
     path('transactions/', login_required(core_views.transaction_list), name='transactions'),
+    path('transactions/rows/', login_required(core_views.transaction_rows), name='transaction_rows'),
     path('documents/', login_required(core_views.document_list), name='documents'),
+    path('documents/rows/', login_required(core_views.document_rows), name='document_rows'),
     path('risk-assessments/', login_required(core_views.risk_assessment_list), name='risk_assessments'),
+    path('risk-assessments/rows/', login_required(core_views.risk_assessment_rows),
+         name='risk_assessment_rows'),
     
     # Authentication views
     path('login/', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
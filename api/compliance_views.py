@@ -8,9 +8,13 @@ from core.compliance import (
     ReportType, ComplianceAlert
 )
 from core.models import Customer, Transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from datetime import datetime, timedelta
 from typing import List, Dict
+import csv
+import io
 import json
 
 class ComplianceViewSet(viewsets.ViewSet):
@@ -20,6 +24,12 @@ class ComplianceViewSet(viewsets.ViewSet):
     regulatory_reporting = RegulatoryReporting()
     psr_compliance = PSRCompliance()
     
+    # Streaming export formats for generate_regulatory_reports
+    EXPORT_FORMATS = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+    
     @action(detail=False, methods=['post'])
     def evaluate_transaction(self, request):
         """Evaluate a transaction for regulatory reporting requirements."""
@@ -33,6 +43,11 @@ class ComplianceViewSet(viewsets.ViewSet):
             'timestamp': datetime.now().isoformat()
         })
     
+    @action(detail=False, methods=['get'])
+    def rule_timings(self, request):
+        """Time spent on each compliance rule and shared column in this process."""
+        return Response(self.regulatory_reporting.plan.timings())
+    
     @action(detail=True, methods=['get'])
     def customer_risk_assessment(self, request, pk=None):
         """Get comprehensive risk assessment for a customer."""
@@ -81,7 +96,12 @@ class ComplianceViewSet(viewsets.ViewSet):
     
     @action(detail=False, methods=['get'])
     def generate_regulatory_reports(self, request):
-        """Generate regulatory reports for specified time period."""
+        """Generate regulatory reports for specified time period.
+        
+        Pass ``export=ndjson`` or ``export=csv`` to stream the reports row by
+        row instead of returning a single JSON document; use this for long
+        periods such as quarter-end extracts.
+        """
         start_date = request.query_params.get(
             'start_date',
             (datetime.now() - timedelta(days=30)).isoformat()
@@ -90,6 +110,12 @@ class ComplianceViewSet(viewsets.ViewSet):
             'end_date',
             datetime.now().isoformat()
         )
+        export = request.query_params.get('export')
+        if export is not None and export not in self.EXPORT_FORMATS:
+            return Response(
+                {'error': f'export must be one of: {", ".join(self.EXPORT_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # Get all suspicious transactions in the period
         suspicious_transactions = Transaction.objects.filter(
@@ -97,18 +123,27 @@ class ComplianceViewSet(viewsets.ViewSet):
             timestamp__range=(start_date, end_date)
         )
         
-        reports = []
-        for transaction in suspicious_transactions:
-            alerts = self.regulatory_reporting.evaluate_transaction(transaction)
-            if alerts:
-                reports.append({
-                    'transaction_id': transaction.id,
-                    'customer_id': transaction.customer.id,
-                    'amount': str(transaction.amount),
-                    'alerts': [vars(alert) for alert in alerts],
-                    'timestamp': transaction.timestamp.isoformat()
-                })
+        # Window totals and rules are evaluated set-wise, not per transaction
+        reports = (
+            {
+                'transaction_id': row['id'],
+                'customer_id': row['customer_id'],
+                'amount': str(row['amount']),
+                'alerts': [vars(alert) for alert in alerts],
+                'timestamp': row['timestamp'].isoformat()
+            }
+            for row, alerts in self.regulatory_reporting.evaluate_transactions(suspicious_transactions)
+        )
+        
+        if export is not None:
+            render = getattr(self, f'_render_{export}')
+            response = StreamingHttpResponse(render(reports), content_type=self.EXPORT_FORMATS[export])
+            response['Content-Disposition'] = (
+                f'attachment; filename="regulatory_reports.{export}"'
+            )
+            return response
         
+        reports = list(reports)
         return Response({
             'period': {
                 'start_date': start_date,
@@ -117,3 +152,28 @@ class ComplianceViewSet(viewsets.ViewSet):
             'total_reports': len(reports),
             'reports': reports
         })
+    
+    @staticmethod
+    def _render_ndjson(reports):
+        for report in reports:
+            yield json.dumps(report, cls=DjangoJSONEncoder) + '\n'
+    
+    @staticmethod
+    def _render_csv(reports):
+        # One CSV row per alert, so each line is a single reportable event
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['transaction_id', 'customer_id', 'amount', 'transaction_timestamp',
+                         'alert_type', 'severity', 'description', 'action_required',
+                         'alert_timestamp'])
+        for report in reports:
+            for alert in report['alerts']:
+                writer.writerow([
+                    report['transaction_id'], report['customer_id'], report['amount'],
+                    report['timestamp'], alert['alert_type'], alert['severity'],
+                    alert['description'], alert['action_required'],
+                    alert['timestamp'].isoformat()
+                ])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
@@ -0,0 +1,79 @@
+"""API views streaming columnar exports for analytics and training."""
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from rest_framework import viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+from core.exports import DATASETS, EXPORT_FORMATS, read_watermark, stream_dataset
+from .filters import parse_end, parse_int, parse_start
+
+class ExportViewSet(viewsets.ViewSet):
+    """Stream whole datasets as Parquet files or Arrow IPC streams.
+
+    ``GET /api/exports/<dataset>/?export=parquet|arrow`` streams rows in
+    key order, a chunk at a time. The response's ``X-Export-Watermark`` header is the last key it
+    covers; pass it back as ``?after=`` to fetch only newer rows.
+    ``start_date``/``end_date`` restrict rows by the dataset's date field.
+    """
+    permission_classes = [IsAdminUser]
+
+    CONTENT_TYPES = {
+        'parquet': 'application/vnd.apache.parquet',
+        'arrow': 'application/vnd.apache.arrow.stream',
+    }
+
+    def list(self, request):
+        """List the exportable datasets and the state of their on-disk exports."""
+        return Response({
+            name: {
+                'key': dataset.key,
+                'date_field': dataset.date_field,
+                'incremental': dataset.incremental,
+                'columns': [column.name for column in dataset.columns],
+                'export': read_watermark(name),
+            } for name, dataset in DATASETS.items()
+        })
+
+    def retrieve(self, request, pk=None):
+        dataset = DATASETS.get(pk)
+        if dataset is None:
+            raise Http404(f'No dataset {pk!r}')
+        params = request.query_params
+        fmt = params.get('export', settings.EXPORT_FORMAT)
+        if fmt not in EXPORT_FORMATS:
+            raise ValidationError({'export': f'Expected one of: {", ".join(EXPORT_FORMATS)}'})
+
+        filters = {}
+        errors = {}
+        after = None
+        for name, parse, lookup in (
+            ('after', parse_int, None),
+            ('start_date', parse_start, f'{dataset.date_field}__gte'),
+            ('end_date', parse_end, f'{dataset.date_field}__lt'),
+        ):
+            if params.get(name) in (None, ''):
+                continue
+            try:
+                value = parse(params[name])
+            except ValueError as e:
+                errors[name] = str(e)
+                continue
+            if lookup is None:
+                after = value
+            else:
+                filters[lookup] = value
+        if errors:
+            raise ValidationError(errors)
+
+        # Fix the end of the stream now so the watermark header is exact;
+        # it never moves backwards, even while older rows are still pending
+        upper = max(dataset.upper_key() or 0, after or 0)
+        response = StreamingHttpResponse(
+            stream_dataset(pk, fmt, after, upper, filters),
+            content_type=self.CONTENT_TYPES[fmt],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{pk}.{fmt}"'
+        response['X-Export-Watermark'] = str(upper)
+        return response
@@ -0,0 +1,70 @@
+"""Query-parameter filtering for the AML service API."""
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+def parse_bool(value):
+    lowered = value.lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValueError('Expected true or false')
+
+def parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('Expected an integer')
+
+def parse_decimal(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError('Expected a number')
+
+def _parse_moment(value, end_of_day):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('Expected an ISO 8601 date or datetime')
+        # A bare end date covers the whole of that day
+        moment = datetime.combine(day + timedelta(days=1) if end_of_day else day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+def parse_start(value):
+    return _parse_moment(value, end_of_day=False)
+
+def parse_end(value):
+    return _parse_moment(value, end_of_day=True)
+
+class QueryParamFilterBackend(BaseFilterBackend):
+    """Filter list querysets from the view's ``filter_params``.
+
+    ``filter_params`` maps a query parameter to a ``(lookup, parse)`` pair,
+    e.g. ``{'min_amount': ('amount__gte', parse_decimal)}``. Every supplied
+    parameter becomes a single ``filter()`` call, so filtering happens in
+    SQL; unparseable values are rejected with a 400 naming the parameter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        filters = {}
+        errors = {}
+        for name, (lookup, parse) in getattr(view, 'filter_params', {}).items():
+            value = request.query_params.get(name)
+            if value in (None, ''):
+                continue
+            try:
+                filters[lookup] = parse(value)
+            except ValueError as e:
+                errors[name] = str(e)
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**filters)
@@ -0,0 +1,103 @@
+"""Cursor pagination for the AML service API."""
+from datetime import datetime
+
+from django.conf import settings
+from django.core import signing
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param
+
+from core.keyset import keyset_filter
+
+def _cursor_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class CursorPagination(pagination.CursorPagination):
+    """Opaque-cursor pagination over an indexed ordering.
+
+    Each page is a bounded query seeking past the row its cursor names on
+    every ordering field, so the cost of a page does not grow with how far
+    into the table it is, and rows sharing a sort key are neither skipped
+    nor repeated when rows are inserted while paging. Views choose their
+    ordering with ``cursor_ordering``; the first field should lead an
+    index, the last should be unique, and all must sort the same way.
+    Cursors are signed, so a client cannot seek on values of its choosing;
+    an invalid one is a 404.
+    """
+    ordering = ('-id',)
+    page_size_query_param = 'page_size'
+    cursor_salt = 'api.pagination.cursor'
+
+    @property
+    def max_page_size(self):
+        return settings.API_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        descending = self.ordering[0].startswith('-')
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        if reverse:
+            queryset = queryset.order_by(*pagination._reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if self.cursor is not None:
+            queryset = queryset.filter(
+                keyset_filter(self.fields, self.cursor.position, descending != reverse)
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_following
+        else:
+            self.has_next, self.has_previous = has_following, self.cursor is not None
+        # Links seek from the page's first and last rows
+        self.has_next = self.has_next and bool(self.page)
+        self.has_previous = self.has_previous and bool(self.page)
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(pagination.Cursor(0, False, self._position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(pagination.Cursor(0, True, self._position(self.page[0])))
+
+    def _position(self, instance):
+        return [_cursor_value(getattr(instance, field)) for field in self.fields]
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            reverse, position = signing.loads(encoded, salt=self.cursor_salt)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        return pagination.Cursor(0, bool(reverse), position)
+
+    def encode_cursor(self, cursor):
+        encoded = signing.dumps([cursor.reverse, cursor.position], salt=self.cursor_salt)
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
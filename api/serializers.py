@@ -20,8 +20,8 @@ class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = ('id', 'customer', 'amount', 'timestamp', 'transaction_type',
-                 'risk_score', 'is_suspicious')
-        read_only_fields = ('risk_score', 'is_suspicious')
+                 'risk_score', 'is_suspicious', 'screening_status')
+        read_only_fields = ('risk_score', 'is_suspicious', 'screening_status')
 
 class RiskAssessmentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -1,3 +1,131 @@
-from django.test import TestCase
+import tempfile
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.aggregates import activity_windows
+from core.models import Customer, CustomerTransactionStats, ScoringJob, Transaction, TransactionFeatures
+
+
+class TransactionAPITests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('officer', password='secret')
+        self.customer = Customer.objects.create(user=User.objects.create(username='alice'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post_transaction(self, amount='250.00'):
+        return self.client.post('/api/transactions/', {
+            'customer': self.customer.id, 'amount': amount, 'transaction_type': 'deposit',
+        }, format='json')
+
+    @override_settings(TRANSACTION_SCORING_MODE='async')
+    def test_async_create_queues_a_scoring_job(self):
+        response = self.post_transaction()
+        self.assertEqual(response.status_code, 202)
+        transaction = Transaction.objects.get()
+        self.assertEqual(transaction.screening_status, 'pending')
+        self.assertEqual(ScoringJob.objects.get().transaction, transaction)
+
+        status = self.client.get(f'/api/transactions/{transaction.id}/status/').json()
+        self.assertEqual(status['job']['status'], ScoringJob.QUEUED)
+        self.assertEqual(status['job']['attempts'], 0)
+
+    @override_settings(TRANSACTION_SCORING_MODE='async')
+    def test_update_and_delete_replay_the_customer_aggregates(self):
+        exports = tempfile.TemporaryDirectory()
+        self.addCleanup(exports.cleanup)
+        settings_override = override_settings(EXPORT_DIR=exports.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        other = Customer.objects.create(user=User.objects.create(username='bob'))
+        first = self.post_transaction('100.00').json()['id']
+        second = self.post_transaction('200.00').json()['id']
+
+        response = self.client.patch(f'/api/transactions/{first}/', {'amount': '150.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        stats = CustomerTransactionStats.objects.get(customer=self.customer)
+        self.assertEqual((stats.transaction_count, stats.total_amount), (2, 350))
+        self.assertEqual(activity_windows.totals(self.customer.id)['24h'].amount, 350)
+        self.assertEqual(TransactionFeatures.objects.get(transaction_id=second).total_amount, 350)
+
+        # Moving a transaction to another customer replays both
+        response = self.client.patch(f'/api/transactions/{second}/', {'customer': other.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(CustomerTransactionStats.objects.get(customer=self.customer).total_amount, 150)
+        self.assertEqual(CustomerTransactionStats.objects.get(customer=other).total_amount, 200)
+        self.assertEqual(TransactionFeatures.objects.get(transaction_id=second).customer_id, other.id)
+        self.assertEqual(TransactionFeatures.objects.get(transaction_id=second).history_length, 1)
+
+        self.assertEqual(self.client.delete(f'/api/transactions/{first}/').status_code, 204)
+        self.assertFalse(CustomerTransactionStats.objects.filter(customer=self.customer).exists())
+        self.assertEqual(activity_windows.totals(self.customer.id)['24h'].count, 0)
+        self.assertFalse(TransactionFeatures.objects.filter(customer=self.customer).exists())
+
+    def create_transactions(self, timestamps):
+        return [
+            Transaction.objects.create(customer=self.customer, amount=100, transaction_type='deposit',
+                                       timestamp=timestamp)
+            for timestamp in timestamps
+        ]
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.json()['results']]
+            url = response.json()['next']
+        return ids
+
+    def test_cursor_pages_are_stable_across_duplicate_timestamps(self):
+        now = timezone.now()
+        # Runs of rows sharing a timestamp, longer than a page and split across pages
+        timestamps = [now - timedelta(minutes=minute) for minute in (1, 1, 1, 1, 1, 2, 3, 3, 3, 4, 5, 5)]
+        transactions = self.create_transactions(timestamps)
+        expected = [t.id for t in sorted(transactions, key=lambda t: (t.timestamp, t.id), reverse=True)]
+        for page_size in (1, 2, 3, 4, 5):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(f'/api/transactions/?page_size={page_size}'), expected)
+
+        # Walking back from the last page gives the same pages in reverse
+        url, pages = '/api/transactions/?page_size=5', []
+        while url:
+            pages.append(self.client.get(url).json())
+            url = pages[-1]['next']
+        url, previous = pages[-1]['previous'], []
+        while url:
+            page = self.client.get(url).json()
+            previous.insert(0, [row['id'] for row in page['results']])
+            url = page['previous']
+        self.assertEqual(previous, [[row['id'] for row in page['results']] for page in pages[:-1]])
+
+        # Rows inserted while paging do not shift the remaining pages
+        first = self.client.get('/api/transactions/?page_size=4').json()
+        self.create_transactions([now, now])
+        self.assertEqual([row['id'] for row in first['results']] + self.walk(first['next']), expected)
+
+    def test_filters_apply_to_every_page(self):
+        now = timezone.now()
+        transactions = self.create_transactions([now - timedelta(minutes=i % 3) for i in range(9)])
+        Transaction.objects.filter(id__in=[t.id for t in transactions[::2]]).update(is_suspicious=True)
+        expected = [t.id for t in sorted(transactions[::2], key=lambda t: (t.timestamp, t.id), reverse=True)]
+        self.assertEqual(self.walk('/api/transactions/?is_suspicious=true&page_size=2'), expected)
+
+        response = self.client.get('/api/transactions/?min_amount=lots&customer=x')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'min_amount', 'customer'})
+
+    def test_tampered_cursor_is_rejected(self):
+        self.create_transactions([timezone.now()] * 3)
+        next_url = self.client.get('/api/transactions/?page_size=1').json()['next']
+        cursor = parse_qs(urlparse(next_url).query)['cursor'][0]
+        self.assertEqual(self.client.get('/api/transactions/', {'cursor': cursor}).status_code, 200)
+        for tampered in ('not-a-cursor', cursor[:-2], cursor + 'x', 'cD0-MQ=='):
+            with self.subTest(cursor=tampered):
+                response = self.client.get('/api/transactions/', {'cursor': tampered})
+                self.assertEqual(response.status_code, 404)
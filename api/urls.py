@@ -2,12 +2,14 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import CustomerViewSet, TransactionViewSet, DocumentVerificationViewSet
 from .compliance_views import ComplianceViewSet
+from .export_views import ExportViewSet
 
 router = DefaultRouter()
 router.register(r'customers', CustomerViewSet)
 router.register(r'transactions', TransactionViewSet)
 router.register(r'documents', DocumentVerificationViewSet)
 router.register(r'compliance', ComplianceViewSet, basename='compliance')
+router.register(r'exports', ExportViewSet, basename='export')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -3,11 +3,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
-from core.models import Customer, Transaction, RiskAssessment, VerificationDocument
-from core.ml_models import TransactionAnomalyDetector, RiskScorer
-from core.validators import TransactionData, DocumentVerification, RiskAssessmentRules
+from core.models import Customer, Transaction, RiskAssessment, VerificationDocument, ScoringJob
+from core.aggregates import rebuild_customer_aggregates, record_transactions
+from core.dashboard import invalidate_dashboard_metrics
+from core.inference import get_anomaly_scorer
+from core.registry import get_risk_scorer
+from core.scoring import enqueue_scoring, score_transactions
+from core.validators import DocumentVerification, RiskAssessmentRules, validate_transactions
+from .filters import parse_bool, parse_decimal, parse_end, parse_int, parse_start
 from .serializers import (CustomerSerializer, TransactionSerializer,
                          RiskAssessmentSerializer, VerificationDocumentSerializer)
+from django.conf import settings
+from django.db import transaction as db_transaction
 from django.shortcuts import get_object_or_404
 from datetime import datetime, timedelta
 import numpy as np
@@ -19,10 +26,23 @@ class CustomerViewSet(viewsets.ModelViewSet):
     Provides endpoints for customer management, identity verification,
     and risk profiling as part of AML compliance.
     """
-    queryset = Customer.objects.all()
+    queryset = Customer.objects.select_related('user')
     serializer_class = CustomerSerializer
     permission_classes = [IsAuthenticated]
-    risk_scorer = RiskScorer()
+    cursor_ordering = ('id',)
+    filter_params = {
+        'customer_type': ('customer_type', str),
+        'compliance_status': ('compliance_status', str),
+        'country_code': ('country_code', str.upper),
+        'is_verified': ('is_verified', parse_bool),
+        'min_risk_score': ('risk_score__gte', float),
+        'max_risk_score': ('risk_score__lte', float),
+    }
+
+    @property
+    def risk_scorer(self):
+        # Production version from the model registry, hot-swapped on promotion
+        return get_risk_scorer()
     
     @action(detail=True, methods=['post'])
     def verify_identity(self, request, pk=None):
@@ -66,19 +86,13 @@ class CustomerViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def risk_profile(self, request, pk=None):
         customer = self.get_object()
-        transactions = Transaction.objects.filter(customer=customer)
-        
-        # Convert transactions to format needed by risk assessment
-        transaction_data = [
-            {
-                'amount': float(t.amount),
-                'timestamp': t.timestamp,
-                'is_suspicious': t.is_suspicious
-            } for t in transactions
-        ]
-        
-        # Get risk assessment
-        risk_factors = RiskAssessmentRules.evaluate_transaction_patterns(transaction_data)
+        rows = Transaction.objects.filter(customer=customer).order_by(
+            'timestamp', 'id'
+        ).values_list('amount', 'timestamp')
+        amounts, timestamps = zip(*rows) if rows else ((), ())
+
+        # Get risk assessment from the columns directly
+        risk_factors = RiskAssessmentRules.evaluate_pattern_arrays(amounts, timestamps)
         
         # Update customer risk score
         customer.risk_score = risk_factors['overall_risk']
@@ -89,22 +103,10 @@ class CustomerViewSet(viewsets.ModelViewSet):
             customer=customer,
             risk_factors=risk_factors,
             overall_score=risk_factors['overall_risk'],
-            recommendations=self._generate_recommendations(risk_factors)
+            recommendations=RiskAssessmentRules.generate_recommendations(risk_factors)
         )
         
         return Response(risk_factors)
-    
-    def _generate_recommendations(self, risk_factors):
-        recommendations = []
-        
-        if risk_factors['velocity'] > 0.7:
-            recommendations.append('High transaction velocity detected. Consider implementing cooling-off periods.')
-        if risk_factors['amount_variance'] > 0.7:
-            recommendations.append('Unusual transaction amount patterns detected. Review for potential structuring.')
-        if risk_factors['frequency'] > 0.7:
-            recommendations.append('High-frequency trading patterns detected. Enhanced due diligence recommended.')
-            
-        return '\n'.join(recommendations) if recommendations else 'No specific recommendations at this time.'
 
 class TransactionViewSet(viewsets.ModelViewSet):
     """ViewSet for monitoring and analyzing financial transactions.
@@ -115,45 +117,157 @@ class TransactionViewSet(viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
-    anomaly_detector = TransactionAnomalyDetector()
+    # Newest first; served by the (timestamp, id) index, or by
+    # (customer, timestamp) and (screening_status, timestamp) when filtered
+    cursor_ordering = ('-timestamp', '-id')
+    filter_params = {
+        'customer': ('customer_id', parse_int),
+        'start_date': ('timestamp__gte', parse_start),
+        'end_date': ('timestamp__lt', parse_end),
+        'is_suspicious': ('is_suspicious', parse_bool),
+        'screening_status': ('screening_status', str),
+        'transaction_type': ('transaction_type', str),
+        'min_amount': ('amount__gte', parse_decimal),
+        'max_amount': ('amount__lte', parse_decimal),
+    }
+    
+    @property
+    def anomaly_detector(self):
+        # Production version from the model registry, shared by concurrent
+        # requests through the micro-batcher
+        return get_anomaly_scorer()
+    
+    @property
+    def scoring_is_async(self):
+        return settings.TRANSACTION_SCORING_MODE == 'async'
+    
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if self.scoring_is_async:
+            # Stored and queued; poll the status endpoint for the outcome
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
     
     def perform_create(self, serializer):
         # Validate transaction data
-        try:
-            transaction_data = TransactionData(
-                amount=serializer.validated_data['amount'],
-                transaction_type=serializer.validated_data['transaction_type'],
-                customer_id=serializer.validated_data['customer'].id,
-                description=serializer.validated_data.get('description')
-            )
-        except ValueError as e:
-            raise ValidationError(detail=str(e))
-        
-        # Save transaction
-        transaction = serializer.save()
+        _, errors = validate_transactions([{
+            'amount': serializer.validated_data['amount'],
+            'transaction_type': serializer.validated_data['transaction_type'],
+            'customer_id': serializer.validated_data['customer'].id,
+            'description': serializer.validated_data.get('description')
+        }])
+        if errors:
+            raise ValidationError(detail=errors[0])
         
-        # Analyze for suspicious activity
-        self._analyze_transaction(transaction)
+        # Save transaction and fold it into the customer's running aggregates
+        with db_transaction.atomic():
+            transaction = serializer.save()
+            record_transactions([transaction])
+            if self.scoring_is_async:
+                enqueue_scoring([transaction])
+                return
         
-        # Update customer risk score
-        customer = transaction.customer
-        risk_scorer = RiskScorer()
-        customer.risk_score = risk_scorer.calculate_risk_score(customer)
-        customer.save()
+        # Analyze for suspicious activity and update customer risk score
+        score_transactions([transaction], detector=self.anomaly_detector)
     
-    def _analyze_transaction(self, transaction):
-        # Check for suspicious activity using ML model
-        if self.anomaly_detector.is_suspicious(transaction):
-            transaction.is_suspicious = True
-            transaction.save()
-            
-            # Create risk assessment for suspicious transaction
-            RiskAssessment.objects.create(
-                customer=transaction.customer,
-                risk_factors={'suspicious_transaction': True},
-                overall_score=min(1.0, transaction.customer.risk_score + 0.2),
-                recommendations='Suspicious transaction detected. Enhanced due diligence recommended.'
+    def perform_update(self, serializer):
+        # The customer may change, so both customers' aggregates are replayed
+        previous_customer_id = serializer.instance.customer_id
+        with db_transaction.atomic():
+            transaction = serializer.save()
+            rebuild_customer_aggregates({previous_customer_id, transaction.customer_id})
+    
+    def perform_destroy(self, instance):
+        with db_transaction.atomic():
+            instance.delete()
+            rebuild_customer_aggregates([instance.customer_id])
+    
+    @action(detail=True, methods=['get'], url_path='status')
+    def screening_status(self, request, pk=None):
+        """Report the screening outcome of a transaction and its scoring job, if any."""
+        transaction = self.get_object()
+        job = ScoringJob.objects.filter(transaction=transaction).first()
+        return Response({
+            'id': transaction.id,
+            'screening_status': transaction.screening_status,
+            'is_suspicious': transaction.is_suspicious,
+            'risk_score': transaction.risk_score,
+            'job': {
+                'status': job.status,
+                'attempts': job.attempts,
+                'last_error': job.last_error or None,
+                'finished_at': job.finished_at
+            } if job else None
+        })
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Validate, store and score a batch of transactions in one request.
+        
+        Accepts a JSON list of transactions (or ``{"transactions": [...]}``).
+        Valid rows are written with a single ``bulk_create``, scored with one
+        vectorised model call, and each affected customer's risk score is
+        recomputed once; in async scoring mode the rows are queued for the
+        scoring workers instead. Returns a result per input row, in input order.
+        """
+        rows = request.data.get('transactions') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list):
+            return Response({'error': 'Expected a list of transactions'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.TRANSACTION_BULK_MAX_ROWS:
+            return Response(
+                {'error': f'At most {settings.TRANSACTION_BULK_MAX_ROWS} transactions per request'},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        
+        # One compiled validation call for the whole batch
+        results = [None] * len(rows)
+        validated, errors = validate_transactions(rows)
+        for index, row_errors in errors.items():
+            results[index] = {'index': index, 'status': 'rejected', 'errors': row_errors}
+        
+        # Resolve every referenced customer with a single query
+        customers = Customer.objects.in_bulk({data.customer_id for _, data in validated})
+        pending = []
+        for index, transaction_data in validated:
+            customer = customers.get(transaction_data.customer_id)
+            if customer is None:
+                results[index] = {'index': index, 'status': 'rejected',
+                                  'errors': f'Customer {transaction_data.customer_id} does not exist'}
+                continue
+            pending.append((index, Transaction(
+                customer=customer,
+                amount=transaction_data.amount,
+                transaction_type=transaction_data.transaction_type
+            )))
+        
+        if pending:
+            with db_transaction.atomic():
+                transactions = Transaction.objects.bulk_create(
+                    [transaction for _, transaction in pending], batch_size=1000
+                )
+                record_transactions(transactions)
+                if self.scoring_is_async:
+                    enqueue_scoring(transactions)
+                else:
+                    score_transactions(transactions, detector=self.anomaly_detector)
+            # Bulk writes bypass the model signals that normally do this
+            invalidate_dashboard_metrics()
+        
+        for index, transaction in pending:
+            results[index] = {
+                'index': index,
+                'status': 'created',
+                'id': transaction.id,
+                'is_suspicious': transaction.is_suspicious,
+                'screening_status': transaction.screening_status
+            }
+        
+        return Response({
+            'created': len(pending),
+            'rejected': len(rows) - len(pending),
+            'results': results
+        }, status=status.HTTP_201_CREATED if pending else status.HTTP_400_BAD_REQUEST)
 
 class DocumentVerificationViewSet(viewsets.ModelViewSet):
     """ViewSet for handling document verification in KYC process.
@@ -164,6 +278,13 @@ class DocumentVerificationViewSet(viewsets.ModelViewSet):
     queryset = VerificationDocument.objects.all()
     serializer_class = VerificationDocumentSerializer
     permission_classes = [IsAuthenticated]
+    filter_params = {
+        'customer': ('customer_id', parse_int),
+        'document_type': ('document_type', str),
+        'verification_status': ('verification_status', str),
+        'start_date': ('upload_date__gte', parse_start),
+        'end_date': ('upload_date__lt', parse_end),
+    }
     
     @action(detail=True, methods=['post'])
     def verify(self, request, pk=None):
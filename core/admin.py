@@ -1,7 +1,9 @@
 from django.contrib import admin
+from django.db import transaction as db_transaction
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
+from .aggregates import rebuild_customer_aggregates, record_transactions
 from .models import Customer, Transaction, RiskAssessment, VerificationDocument
 
 @admin.register(Customer)
@@ -44,6 +46,30 @@ class TransactionAdmin(admin.ModelAdmin):
             'fields': ('source_country', 'destination_country')
         }),
     )
+    
+    # Keep the maintained aggregates in step with admin edits
+    def save_model(self, request, obj, form, change):
+        with db_transaction.atomic():
+            if not change:
+                super().save_model(request, obj, form, change)
+                record_transactions([obj])
+                return
+            previous_customer_id = Transaction.objects.values_list(
+                'customer_id', flat=True
+            ).get(pk=obj.pk)
+            super().save_model(request, obj, form, change)
+            rebuild_customer_aggregates({previous_customer_id, obj.customer_id})
+    
+    def delete_model(self, request, obj):
+        with db_transaction.atomic():
+            super().delete_model(request, obj)
+            rebuild_customer_aggregates([obj.customer_id])
+    
+    def delete_queryset(self, request, queryset):
+        with db_transaction.atomic():
+            customer_ids = set(queryset.values_list('customer_id', flat=True))
+            super().delete_queryset(request, queryset)
+            rebuild_customer_aggregates(customer_ids)
 
 @admin.register(RiskAssessment)
 class RiskAssessmentAdmin(admin.ModelAdmin):
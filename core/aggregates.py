@@ -0,0 +1,157 @@
+"""Incrementally maintained transaction aggregates.
+
+Ingestion paths call :func:`record_transactions` once for every batch of newly
+inserted transactions, and updates and deletes call
+:func:`rebuild_customer_aggregates` for the customers they touch. Rules and
+scorers then read the maintained totals instead of scanning raw transaction
+rows.
+"""
+from collections import namedtuple
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction as db_transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .exports import invalidate_export
+from .features import feature_store
+from .models import CustomerActivityBucket, CustomerTransactionStats, Transaction
+
+WindowTotal = namedtuple('WindowTotal', ['count', 'amount'])
+
+def bucket_start(timestamp):
+    """Truncate a timestamp to the start of its hourly bucket (UTC)."""
+    return timestamp.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+class ActivityWindows:
+    """Sliding-window sums over hourly per-customer activity buckets.
+
+    A window of N hours covers every bucket starting at or after the hour
+    containing ``now - N hours``. Sums are therefore exact to the hour and
+    err on the side of including slightly older activity, never less.
+    """
+
+    def __init__(self, windows=None, horizon_hours=None):
+        self.windows = dict(windows or settings.AML_ACTIVITY_WINDOWS)
+        self.horizon = timedelta(hours=horizon_hours or settings.AML_ACTIVITY_HORIZON_HOURS)
+        if timedelta(hours=max(self.windows.values())) > self.horizon:
+            raise ImproperlyConfigured('Activity bucket horizon is shorter than the longest window')
+
+    def record(self, transactions):
+        """Add transactions to their customers' hourly buckets."""
+        cutoff = bucket_start(timezone.now() - self.horizon)
+        deltas = {}
+        for transaction in transactions:
+            key = (transaction.customer_id, bucket_start(transaction.timestamp))
+            if key[1] < cutoff:
+                # Historical rows would only be pruned again below
+                continue
+            count, total = deltas.get(key, (0, Decimal('0')))
+            deltas[key] = (count + 1, total + Decimal(transaction.amount))
+        if not deltas:
+            return
+
+        with db_transaction.atomic():
+            CustomerActivityBucket.objects.bulk_create([
+                CustomerActivityBucket(customer_id=customer_id, bucket_start=start)
+                for customer_id, start in deltas
+            ], ignore_conflicts=True)
+            for (customer_id, start), (count, total) in deltas.items():
+                CustomerActivityBucket.objects.filter(
+                    customer_id=customer_id, bucket_start=start
+                ).update(
+                    transaction_count=F('transaction_count') + count,
+                    total_amount=F('total_amount') + total,
+                )
+            # Keep each active customer's buckets bounded by the horizon
+            CustomerActivityBucket.objects.filter(
+                customer_id__in={customer_id for customer_id, _ in deltas},
+                bucket_start__lt=cutoff
+            ).delete()
+
+    def rebuild(self, customer_ids):
+        """Recompute the customers' buckets within the horizon from the raw transaction table."""
+        cutoff = bucket_start(timezone.now() - self.horizon)
+        rows = Transaction.objects.filter(
+            customer_id__in=customer_ids, timestamp__gte=cutoff
+        ).annotate(
+            bucket=TruncHour('timestamp', tzinfo=dt_timezone.utc)
+        ).values('customer_id', 'bucket').annotate(count=Count('id'), total=Sum('amount'))
+        with db_transaction.atomic():
+            CustomerActivityBucket.objects.filter(customer_id__in=customer_ids).delete()
+            CustomerActivityBucket.objects.bulk_create([
+                CustomerActivityBucket(
+                    customer_id=row['customer_id'],
+                    bucket_start=row['bucket'],
+                    transaction_count=row['count'],
+                    total_amount=row['total'],
+                ) for row in rows
+            ])
+
+    def window_starts(self, windows=None, now=None):
+        """Return the first bucket included in each named window."""
+        now = now or timezone.now()
+        return {
+            name: bucket_start(now - timedelta(hours=self.windows[name]))
+            for name in (windows or self.windows)
+        }
+
+    def totals_for_customers(self, customer_ids, windows=None, now=None):
+        """Return ``{customer_id: {window: WindowTotal}}`` using one grouped query."""
+        customer_ids = list(customer_ids)
+        starts = self.window_starts(windows, now)
+        aggregates = {}
+        for name, start in starts.items():
+            aggregates[f'count_{name}'] = Sum('transaction_count', filter=Q(bucket_start__gte=start))
+            aggregates[f'amount_{name}'] = Sum('total_amount', filter=Q(bucket_start__gte=start))
+        rows = CustomerActivityBucket.objects.filter(
+            customer_id__in=customer_ids,
+            bucket_start__gte=min(starts.values())
+        ).values('customer_id').annotate(**aggregates)
+
+        empty = {name: WindowTotal(0, Decimal('0')) for name in starts}
+        totals = {customer_id: dict(empty) for customer_id in customer_ids}
+        for row in rows:
+            totals[row['customer_id']] = {
+                name: WindowTotal(row[f'count_{name}'] or 0, row[f'amount_{name}'] or Decimal('0'))
+                for name in starts
+            }
+        return totals
+
+    def totals(self, customer_id, windows=None, now=None):
+        """Return ``{window: WindowTotal}`` for a single customer."""
+        return self.totals_for_customers([customer_id], windows, now)[customer_id]
+
+    def prune(self, now=None):
+        """Delete buckets that have fallen out of the horizon for every customer."""
+        cutoff = bucket_start((now or timezone.now()) - self.horizon)
+        deleted, _ = CustomerActivityBucket.objects.filter(bucket_start__lt=cutoff).delete()
+        return deleted
+
+activity_windows = ActivityWindows()
+
+def record_transactions(transactions):
+    """Fold newly inserted transactions into every maintained aggregate."""
+    transactions = list(transactions)
+    CustomerTransactionStats.objects.record(transactions)
+    activity_windows.record(transactions)
+    feature_store.record(transactions)
+
+def rebuild_customer_aggregates(customer_ids):
+    """Recompute every maintained aggregate of customers whose transactions were updated or deleted.
+
+    Changes cannot be folded in as deltas like inserts, so the customers'
+    running totals, activity buckets and feature rows are replayed from
+    their remaining transactions; call it in the same database transaction
+    as the change. Exports of the rewritten rows are invalidated.
+    """
+    customer_ids = sorted(set(customer_ids))
+    CustomerTransactionStats.objects.rebuild(customer_ids)
+    activity_windows.rebuild(customer_ids)
+    feature_store.rebuild(customer_ids)
+    for dataset in ('transactions', 'features'):
+        invalidate_export(dataset)
@@ -1,9 +1,18 @@
 """Regulatory compliance and reporting functionality for AML service."""
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import json
 from dataclasses import dataclass
 from enum import Enum
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .keyset import iter_keyset
+from .models import CustomerTransactionStats
+from .rules import ROW_FIELDS, RulePlan
+from .screening import screening_lists
 
 class ReportType(Enum):
     """Types of regulatory reports."""
@@ -22,62 +31,71 @@ class ComplianceAlert:
     action_required: bool
 
 class RegulatoryReporting:
-    """Handles generation and management of regulatory reports."""
+    """Evaluates transactions against the declarative rules in ``COMPLIANCE_RULES``.
+
+    The rules are compiled once into a :class:`~core.rules.RulePlan`; its
+    ``timings()`` report what each rule has cost in this process.
+    """
     
-    def __init__(self):
-        self.threshold_ctr = 10000  # Currency Transaction Report threshold
-        self.threshold_sar = 5000   # Suspicious Activity Report threshold
+    def __init__(self, rules=None):
+        self.plan = RulePlan.compile(settings.COMPLIANCE_RULES if rules is None else rules)
+        for rule in self.plan.rules:
+            if rule.report not in ReportType.__members__:
+                raise ImproperlyConfigured(f'Rule {rule.name}: unknown report type {rule.report!r}')
     
     def evaluate_transaction(self, transaction) -> List[ComplianceAlert]:
         """Evaluate a transaction for regulatory reporting requirements."""
-        alerts = []
-        
-        # Check for CTR requirement
-        if float(transaction.amount) > self.threshold_ctr:
-            alerts.append(ComplianceAlert(
-                alert_type=ReportType.CTR.value,
-                severity="HIGH",
-                description=f"Transaction amount (£{transaction.amount}) exceeds CTR threshold",
-                timestamp=datetime.now(),
-                related_entities=[str(transaction.customer.id)],
-                action_required=True
-            ))
+        row = {field: getattr(transaction, field) for field in ROW_FIELDS}
+        return [
+            self._alert(rule, description, row['customer_id'])
+            for _, fired in self.plan.fired([row]) for rule, description in fired
+        ]
+    
+    def evaluate_transactions(self, transactions, chunk_size=2000) -> Iterator[Tuple[Dict, List[ComplianceAlert]]]:
+        """Evaluate a queryset of transactions a chunk at a time.
         
-        # Check for structured transactions
-        recent_transactions = transaction.customer.transaction_set.filter(
-            timestamp__gte=datetime.now() - timedelta(days=7)
+        Each chunk costs one query for its rows and one grouped query for the
+        window totals of its customers, and every rule is applied to the
+        whole chunk at once. Yields ``(row, alerts)`` for each transaction
+        that raises at least one alert, in ``(timestamp, id)`` order; the
+        alerts are the same as :meth:`evaluate_transaction` would produce
+        for that row. Window totals come from the hourly activity buckets,
+        so they may include up to an hour of activity older than the window
+        and a threshold can fire slightly earlier than on exact sums, never
+        later.
+        """
+        rows = iter_keyset(
+            transactions.values(*ROW_FIELDS), fields=('timestamp', 'id'), chunk_size=chunk_size
+        )
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            for row, fired in self.plan.fired(chunk):
+                yield row, [
+                    self._alert(rule, description, row['customer_id']) for rule, description in fired
+                ]
+    
+    def _alert(self, rule, description, customer_id) -> ComplianceAlert:
+        return ComplianceAlert(
+            alert_type=ReportType[rule.report].value,
+            severity=rule.severity,
+            description=description,
+            timestamp=datetime.now(),
+            related_entities=[str(customer_id)],
+            action_required=True
         )
-        total_amount = sum(float(t.amount) for t in recent_transactions)
-        
-        if total_amount > self.threshold_sar:
-            alerts.append(ComplianceAlert(
-                alert_type=ReportType.SAR.value,
-                severity="MEDIUM",
-                description="Multiple transactions potentially indicating structuring",
-                timestamp=datetime.now(),
-                related_entities=[str(transaction.customer.id)],
-                action_required=True
-            ))
-        
-        return alerts
 
 class ComplianceRules:
     """Rules engine for regulatory compliance."""
     
     @staticmethod
     def check_high_risk_countries(customer_data: Dict) -> List[str]:
-        """Check for transactions involving high-risk countries."""
-        high_risk_countries = {
-            'XX': 'High-risk jurisdiction',
-            'YY': 'Sanctioned country',
-            'ZZ': 'Non-cooperative jurisdiction'
-        }
-        
-        warnings = []
-        country_code = customer_data.get('country_code')
-        if country_code in high_risk_countries:
-            warnings.append(f"Customer associated with {high_risk_countries[country_code]}")
-        return warnings
+        """Check a customer's country against the current screening lists."""
+        jurisdiction = screening_lists.current().jurisdiction(customer_data.get('country_code'))
+        if jurisdiction is None:
+            return []
+        return [f"Customer associated with {jurisdiction.reason}"]
     
     @staticmethod
     def evaluate_customer_risk(customer) -> Dict:
@@ -96,10 +114,8 @@ class ComplianceRules:
             risk_factors['identity_verification'] = 0.5
             
         # Transaction pattern risk
-        suspicious_transactions = customer.transaction_set.filter(is_suspicious=True)
-        total_transactions = customer.transaction_set.count()
-        if total_transactions > 0:
-            risk_factors['transaction_pattern'] = len(suspicious_transactions) / total_transactions
+        stats = CustomerTransactionStats.for_customer(customer)
+        risk_factors['transaction_pattern'] = stats.suspicious_ratio
             
         return risk_factors
 
@@ -134,16 +150,15 @@ class PSRCompliance:
     
     def generate_compliance_report(self, customer) -> Dict:
         """Generate a compliance report for PSR license application."""
+        stats = CustomerTransactionStats.for_customer(customer)
         return {
             'customer_id': customer.id,
             'verification_status': customer.is_verified,
             'risk_assessment': ComplianceRules.evaluate_customer_risk(customer),
             'transaction_monitoring': {
-                'suspicious_transactions': customer.transaction_set.filter(
-                    is_suspicious=True).count(),
-                'total_transactions': customer.transaction_set.count(),
-                'average_transaction_amount': customer.transaction_set.aggregate(
-                    avg_amount=models.Avg('amount'))['avg_amount']
+                'suspicious_transactions': stats.suspicious_count,
+                'total_transactions': stats.transaction_count,
+                'average_transaction_amount': stats.mean_amount if stats.transaction_count else None
             },
             'compliance_status': 'compliant' if customer.is_verified else 'non_compliant',
             'timestamp': datetime.now().isoformat()
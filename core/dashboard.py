@@ -0,0 +1,115 @@
+"""Cached, precomputed metrics for the compliance dashboard.
+
+Metrics are computed with a handful of aggregated queries and kept in
+Django's cache. Writes to the underlying models only mark the cached copy
+stale (see ``core.signals``); the next reader recomputes it while any
+concurrent readers keep being served the previous copy, so a burst of
+dashboard refreshes triggers at most one recomputation.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Customer, RiskAssessment, Transaction, VerificationDocument
+
+METRICS_CACHE_KEY = 'dashboard:metrics'
+STALE_CACHE_KEY = 'dashboard:metrics:stale'
+REFRESH_LOCK_KEY = 'dashboard:metrics:refreshing'
+
+def compute_dashboard_metrics():
+    """Compute every dashboard metric directly from the database."""
+    now = timezone.now()
+    thirty_days_ago = now - timedelta(days=30)
+
+    # Risk distribution as a single conditional aggregate
+    risk_counts = Customer.objects.aggregate(
+        total=Count('id'),
+        low=Count('id', filter=Q(risk_score__lt=0.3)),
+        medium=Count('id', filter=Q(risk_score__gte=0.3, risk_score__lt=0.7)),
+        high=Count('id', filter=Q(risk_score__gte=0.7)),
+    )
+    suspicious_transactions = Transaction.objects.filter(
+        timestamp__gte=thirty_days_ago,
+        is_suspicious=True
+    ).count()
+    pending_verifications = VerificationDocument.objects.filter(
+        verification_status='pending'
+    ).count()
+
+    # Transaction trend data (last 7 days)
+    transaction_data = Transaction.objects.filter(
+        timestamp__gte=now - timedelta(days=7)
+    ).values('timestamp__date').annotate(
+        volume=Count('id')
+    ).order_by('timestamp__date')
+
+    recent_activities = []
+    for trans in Transaction.objects.filter(
+        timestamp__gte=thirty_days_ago
+    ).order_by('-timestamp')[:5]:
+        recent_activities.append({
+            'timestamp': trans.timestamp,
+            'type': 'Transaction',
+            'details': f'{trans.transaction_type} of £{trans.amount}',
+            'status': 'flagged' if trans.is_suspicious else 'cleared'
+        })
+    for doc in VerificationDocument.objects.filter(
+        upload_date__gte=thirty_days_ago
+    ).select_related('customer__user').order_by('-upload_date')[:5]:
+        recent_activities.append({
+            'timestamp': doc.upload_date,
+            'type': 'Document Verification',
+            'details': f'{doc.document_type} for {doc.customer.user.username}',
+            'status': doc.verification_status
+        })
+    for assessment in RiskAssessment.objects.filter(
+        assessment_date__gte=thirty_days_ago
+    ).order_by('-assessment_date')[:5]:
+        score = assessment.overall_score
+        recent_activities.append({
+            'timestamp': assessment.assessment_date,
+            'type': 'Risk Assessment',
+            'details': f'Score: {score:.2f}',
+            'status': 'high' if score >= 0.7 else 'medium' if score >= 0.3 else 'low'
+        })
+    recent_activities.sort(key=lambda x: x['timestamp'], reverse=True)
+
+    return {
+        'high_risk_count': risk_counts['high'],
+        'total_customers': risk_counts['total'],
+        'suspicious_transactions_count': suspicious_transactions,
+        'pending_verifications_count': pending_verifications,
+        'risk_distribution': {
+            'low': risk_counts['low'],
+            'medium': risk_counts['medium'],
+            'high': risk_counts['high']
+        },
+        'transaction_dates': [str(data['timestamp__date']) for data in transaction_data],
+        'transaction_volumes': [data['volume'] for data in transaction_data],
+        'recent_activities': recent_activities[:10],
+        'last_update': now
+    }
+
+def get_dashboard_metrics():
+    """Return cached dashboard metrics, recomputing them if missing or stale."""
+    metrics = cache.get(METRICS_CACHE_KEY)
+    if metrics is not None and not cache.get(STALE_CACHE_KEY):
+        return metrics
+
+    # Only one reader refreshes; others keep serving the previous copy
+    if metrics is not None and not cache.add(REFRESH_LOCK_KEY, True, timeout=30):
+        return metrics
+    try:
+        cache.delete(STALE_CACHE_KEY)
+        metrics = compute_dashboard_metrics()
+        cache.set(METRICS_CACHE_KEY, metrics, timeout=settings.DASHBOARD_METRICS_TIMEOUT)
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+    return metrics
+
+def invalidate_dashboard_metrics():
+    """Mark the cached dashboard metrics stale after a write."""
+    cache.set(STALE_CACHE_KEY, True, timeout=None)
@@ -0,0 +1,314 @@
+"""Columnar exports for analytics and model training.
+
+Each dataset is written to ``EXPORT_DIR/<dataset>/`` as Parquet or Arrow
+IPC files in hive-style ``date=YYYY-MM-DD`` partitions. Rows are read
+from the database in keyset chunks of ``EXPORT_CHUNK_ROWS`` and each
+chunk is written as its own part files, so memory use does not grow with
+the size of the table.
+
+Append-only datasets are exported incrementally: ``_watermark.json`` in
+the dataset directory records the last exported key, it is advanced
+after every chunk, and the next run (or a run resumed after a crash)
+starts from it. Part files are named after the first key of their
+chunk, so re-exporting a chunk overwrites rather than duplicates it.
+Transactions and their features are only exported up to the first
+transaction still queued for scoring, so exported labels are final.
+Customers change in place and are re-exported in full on every run.
+"""
+import json
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+from pyarrow import fs
+
+from .features import FEATURE_COLUMNS, select_features
+from .models import Customer, RiskAssessment, ScoringJob, Transaction, TransactionFeatures
+
+EXPORT_FORMATS = ('parquet', 'arrow')
+
+WATERMARK_FILE = '_watermark.json'
+
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive')
+
+Column = namedtuple('Column', ['name', 'type', 'lookup', 'convert'], defaults=[None, None])
+
+TIMESTAMP = pa.timestamp('us', tz='UTC')
+
+class ExportDataset:
+    """A table exported as one columnar dataset.
+
+    ``key`` orders the chunks and is the incremental watermark;
+    ``date_field`` chooses the date partition of each row.
+    """
+
+    def __init__(self, name, model, key, date_field, columns, incremental=True, settled=False):
+        self.name = name
+        self.model = model
+        self.key = key
+        self.date_field = date_field
+        self.columns = columns
+        self.incremental = incremental
+        self.settled = settled
+        self.schema = pa.schema([(column.name, column.type) for column in columns])
+
+    @property
+    def lookups(self):
+        return [column.lookup or column.name for column in self.columns]
+
+    def upper_key(self):
+        """Return the last key a run started now may export, or None if there is none."""
+        upper = self.model.objects.aggregate(last=Max(self.key))['last']
+        if self.settled and upper is not None:
+            # Stop before the first transaction still queued for scoring
+            pending = ScoringJob.objects.filter(
+                status__in=[ScoringJob.QUEUED, ScoringJob.RUNNING]
+            ).aggregate(first=Min('transaction_id'))['first']
+            if pending is not None:
+                upper = min(upper, pending - 1)
+        return upper
+
+    def chunks(self, after=None, upper=None, filters=None, chunk_rows=None):
+        """Yield ``(last_key, table)`` for successive keyset chunks of rows."""
+        chunk_rows = chunk_rows or settings.EXPORT_CHUNK_ROWS
+        queryset = self.model.objects.filter(**(filters or {})).order_by(self.key)
+        if upper is not None:
+            queryset = queryset.filter(**{f'{self.key}__lte': upper})
+        key_index = self.lookups.index(self.key)
+        while True:
+            page = queryset
+            if after is not None:
+                page = page.filter(**{f'{self.key}__gt': after})
+            rows = list(page.values_list(*self.lookups)[:chunk_rows])
+            if not rows:
+                return
+            after = rows[-1][key_index]
+            yield after, self.table(rows)
+            if len(rows) < chunk_rows:
+                return
+
+    def table(self, rows):
+        """Build an Arrow table from ``values_list`` rows of :attr:`lookups`."""
+        arrays = []
+        for column, values in zip(self.columns, zip(*rows)):
+            if column.convert is not None:
+                values = [None if value is None else column.convert(value) for value in values]
+            arrays.append(pa.array(values, type=column.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def partition_dates(self, table):
+        return pc.strftime(table[self.date_field], format='%Y-%m-%d')
+
+def _feature_column(name):
+    field_type = TransactionFeatures._meta.get_field(name).get_internal_type()
+    return Column(name, {'BooleanField': pa.bool_(), 'PositiveIntegerField': pa.int64()}.get(
+        field_type, pa.float64()
+    ))
+
+DATASETS = {dataset.name: dataset for dataset in (
+    ExportDataset('transactions', Transaction, 'id', 'timestamp', [
+        Column('id', pa.int64()),
+        Column('customer_id', pa.int64()),
+        Column('amount', pa.decimal128(15, 2)),
+        Column('timestamp', TIMESTAMP),
+        Column('transaction_type', pa.string()),
+        Column('risk_score', pa.float64()),
+        Column('is_suspicious', pa.bool_()),
+        Column('source_country', pa.string()),
+        Column('destination_country', pa.string()),
+        Column('reference', pa.string()),
+        Column('screening_status', pa.string()),
+    ], settled=True),
+    ExportDataset('features', TransactionFeatures, 'transaction_id', 'as_of', [
+        Column('transaction_id', pa.int64()),
+        Column('customer_id', pa.int64()),
+        Column('as_of', TIMESTAMP),
+        *(_feature_column(name) for name in FEATURE_COLUMNS),
+        Column('is_suspicious', pa.bool_(), 'transaction__is_suspicious'),
+    ], settled=True),
+    ExportDataset('assessments', RiskAssessment, 'id', 'assessment_date', [
+        Column('id', pa.int64()),
+        Column('customer_id', pa.int64()),
+        Column('assessment_date', TIMESTAMP),
+        Column('assessment_type', pa.string()),
+        Column('overall_score', pa.float64()),
+        Column('risk_factors', pa.string(), convert=json.dumps),
+        Column('recommendations', pa.string()),
+        Column('next_review_date', TIMESTAMP),
+        Column('reviewed_by_id', pa.int64()),
+    ]),
+    # No names or contact details: analytics and training work on ids
+    ExportDataset('customers', Customer, 'id', 'created_at', [
+        Column('id', pa.int64()),
+        Column('customer_type', pa.string()),
+        Column('risk_score', pa.float64()),
+        Column('last_verification_date', TIMESTAMP),
+        Column('is_verified', pa.bool_()),
+        Column('country_code', pa.string()),
+        Column('business_type', pa.string()),
+        Column('annual_revenue', pa.decimal128(15, 2)),
+        Column('compliance_status', pa.string()),
+        Column('created_at', TIMESTAMP),
+    ], incremental=False),
+)}
+
+def dataset_directory(name, directory=None):
+    return Path(directory or settings.EXPORT_DIR) / name
+
+def read_watermark(name, directory=None):
+    """Return the watermark of an exported dataset, or None if it has not been exported."""
+    path = dataset_directory(name, directory) / WATERMARK_FILE
+    return json.loads(path.read_text()) if path.exists() else None
+
+def invalidate_export(name, directory=None):
+    """Discard the watermark of an exported dataset whose rows have been rewritten.
+
+    The stale files stay until the next ``export_data`` run, which exports
+    the dataset in full again; until then it reads as not exported.
+    Returns whether there was an export to invalidate.
+    """
+    path = dataset_directory(name, directory) / WATERMARK_FILE
+    existed = path.exists()
+    path.unlink(missing_ok=True)
+    return existed
+
+def _write_watermark(path, state):
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(state))
+    tmp.replace(path)
+
+def export_dataset(name, directory=None, fmt=None, full=False, chunk_rows=None):
+    """Export new rows of a dataset to its partitioned directory.
+
+    Returns ``(rows, watermark)``. With ``full`` (always, for datasets that
+    are not incremental) the dataset is rewritten from scratch in a staging
+    directory that replaces the previous export once complete.
+    """
+    dataset = DATASETS[name]
+    fmt = fmt or settings.EXPORT_FORMAT
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format {fmt!r}')
+    target = dataset_directory(name, directory)
+    state = None if full or not dataset.incremental else read_watermark(name, directory)
+    if state is not None and state['format'] != fmt:
+        raise ValueError(f'{name} was exported as {state["format"]}; re-export it in full '
+                         f'to switch to {fmt}')
+    if state is None:
+        state = {'dataset': name, 'format': fmt, 'key': dataset.key, 'last_key': None, 'rows': 0}
+        output = target.with_name(f'.{name}.staging')
+        shutil.rmtree(output, ignore_errors=True)
+    else:
+        output = target
+    output.mkdir(parents=True, exist_ok=True)
+
+    upper = dataset.upper_key()
+    rows = 0
+    for last_key, table in dataset.chunks(state['last_key'], upper, chunk_rows=chunk_rows):
+        first_key = table[dataset.key][0].as_py()
+        ds.write_dataset(
+            table.append_column('date', dataset.partition_dates(table)),
+            output,
+            format=fmt,
+            partitioning=PARTITIONING,
+            basename_template=f'part-{first_key}-{{i}}.{fmt}',
+            existing_data_behavior='overwrite_or_ignore',
+        )
+        rows += len(table)
+        state.update(last_key=last_key, rows=state['rows'] + len(table),
+                     exported_at=timezone.now().isoformat())
+        _write_watermark(output / WATERMARK_FILE, state)
+
+    if output != target:
+        state.setdefault('exported_at', timezone.now().isoformat())
+        _write_watermark(output / WATERMARK_FILE, state)
+        previous = target.with_name(f'.{name}.previous')
+        shutil.rmtree(previous, ignore_errors=True)
+        if target.exists():
+            target.replace(previous)
+        output.replace(target)
+        shutil.rmtree(previous, ignore_errors=True)
+    return rows, state
+
+def open_dataset(name, directory=None):
+    """Open an exported dataset for reading, memory-mapping its files.
+
+    Returns ``(dataset, watermark)``; raises FileNotFoundError if the
+    dataset has not been exported.
+    """
+    state = read_watermark(name, directory)
+    if state is None:
+        raise FileNotFoundError(f'{name} has not been exported to {dataset_directory(name, directory)}')
+    return ds.dataset(
+        str(dataset_directory(name, directory)),
+        format=state['format'],
+        schema=DATASETS[name].schema.append(pa.field('date', pa.string())),
+        partitioning=PARTITIONING,
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    ), state
+
+def read_training_frame(names, since=None, directory=None):
+    """Return exported point-in-time features and the ``is_suspicious`` label.
+
+    The counterpart of ``FeatureStore.training_frame`` reading the
+    ``features`` export instead of the database; Arrow exports are read
+    without copying. Returns ``(frame, watermark)``.
+    """
+    dataset, state = open_dataset('features', directory)
+    condition = None
+    if since is not None:
+        condition = ds.field('as_of') >= pa.scalar(since, type=TIMESTAMP)
+    table = dataset.to_table(
+        columns=['transaction_id', 'customer_id', 'as_of', *FEATURE_COLUMNS, 'is_suspicious'],
+        filter=condition,
+    ).sort_by([('as_of', 'ascending'), ('transaction_id', 'ascending')])
+    frame = table.to_pandas()
+    return frame[['transaction_id', 'customer_id', 'as_of']].join(
+        select_features(frame, names)
+    ).join(frame['is_suspicious']), state
+
+class _StreamSink:
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_dataset(name, fmt, after=None, upper=None, filters=None):
+    """Yield a dataset as one Parquet file or Arrow IPC stream, a chunk at a time.
+
+    Parquet is written one row group per chunk; the Arrow stream one
+    record batch per chunk. The date partitioning only applies on disk.
+    """
+    dataset = DATASETS[name]
+    sink = _StreamSink()
+    out = pa.PythonFile(sink, mode='w')
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(out, dataset.schema)
+    else:
+        writer = pa.ipc.new_stream(out, dataset.schema)
+    with out, writer:
+        for _, table in dataset.chunks(after, upper, filters):
+            writer.write_table(table)
+            yield sink.take()
+    yield sink.take()
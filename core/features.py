@@ -0,0 +1,358 @@
+"""Point-in-time feature store for the ML models.
+
+Every transaction gets one :class:`~core.models.TransactionFeatures` row,
+materialised when it is recorded and computed only from what was known at
+that moment: the customer's history up to and including the transaction,
+rolling activity windows ending at its timestamp, its counterpart countries,
+the customer's latest risk assessment before it and their verification age
+at the time. Rows are
+never rewritten as later transactions arrive, so the same rows serve
+online scoring and offline training sets without leaking future data.
+
+Ingestion calls :meth:`FeatureStore.record` (via
+``core.aggregates.record_transactions``); ``manage.py rebuild_features``
+replays history with :func:`compute_feature_frame` after backdated imports.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from itertools import chain
+
+import pandas as pd
+from django.db import connection, transaction as db_transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+
+from .models import Customer, RiskAssessment, Transaction, TransactionFeatures
+
+# Rolling windows materialised per transaction, as (name, span); each has
+# count_<name> and amount_<name> columns covering (timestamp - span, timestamp]
+ROLLING_WINDOWS = (
+    ('24h', timedelta(hours=24)),
+    ('7d', timedelta(days=7)),
+    ('30d', timedelta(days=30)),
+)
+
+FEATURE_COLUMNS = (
+    'amount', 'history_length', 'total_amount', 'cross_border', 'cross_border_count',
+    'customer_risk_score', 'verification_age_days',
+) + tuple(f'{kind}_{name}' for name, _ in ROLLING_WINDOWS for kind in ('count', 'amount'))
+
+# Features derived on read from the stored columns
+DERIVED_FEATURES = {
+    'mean_amount': lambda frame: frame['total_amount'] / frame['history_length'],
+    'cross_border_ratio': lambda frame: frame['cross_border_count'] / frame['history_length'],
+}
+
+def verification_age_days(verified_at, as_of):
+    """Days since verification at ``as_of``, or None if not verified by then."""
+    if verified_at is None or verified_at > as_of:
+        return None
+    return (as_of - verified_at).total_seconds() / 86400
+
+def latest_rows(model, customer_ids, ordering, **filters):
+    """Return a queryset of each customer's last ``model`` row by ``ordering``.
+
+    ``ordering`` sorts newest first; one correlated subquery per customer,
+    served by the model's ``(customer, ...)`` index.
+    """
+    pk = model._meta.pk.name
+    last = model.objects.filter(customer_id=OuterRef('pk'), **filters).order_by(*ordering).values(pk)[:1]
+    return model.objects.filter(**{
+        f'{pk}__in': Customer.objects.filter(id__in=customer_ids).values(last=Subquery(last))
+    })
+
+def compute_feature_frame(transactions, assessments, verifications):
+    """Replay history into point-in-time feature rows.
+
+    ``transactions`` has ``id, customer_id, amount, timestamp,
+    source_country, destination_country``; ``assessments`` has
+    ``customer_id, assessment_date, overall_score``; ``verifications`` maps
+    customer ids to their last verification date. Customer risk score at
+    each transaction is the latest assessment strictly before it (0.0 if
+    none), since the live score keeps no history. Returns a frame with
+    ``transaction_id, customer_id, as_of`` and :data:`FEATURE_COLUMNS`.
+    """
+    if transactions.empty:
+        return pd.DataFrame(columns=['transaction_id', 'customer_id', 'as_of', *FEATURE_COLUMNS])
+    frame = transactions.sort_values(['customer_id', 'timestamp', 'id'], kind='stable')
+    frame = frame.rename(columns={'id': 'transaction_id', 'timestamp': 'as_of'}).reset_index(drop=True)
+    frame['amount'] = frame['amount'].astype(float)
+    by_customer = frame.groupby('customer_id', sort=False)
+    frame['history_length'] = by_customer.cumcount() + 1
+    frame['total_amount'] = by_customer['amount'].cumsum()
+    frame['cross_border'] = frame['source_country'] != frame['destination_country']
+    frame['cross_border_count'] = frame.groupby('customer_id', sort=False)['cross_border'].cumsum()
+
+    for name, span in ROLLING_WINDOWS:
+        rolling = by_customer.rolling(span, on='as_of', closed='right')['amount']
+        frame[f'count_{name}'] = rolling.count().to_numpy().astype(int)
+        frame[f'amount_{name}'] = rolling.sum().to_numpy()
+
+    if len(assessments):
+        ordered = frame.reset_index().sort_values('as_of', kind='stable')
+        scored = pd.merge_asof(
+            ordered, assessments.sort_values('assessment_date'),
+            left_on='as_of', right_on='assessment_date', by='customer_id',
+            allow_exact_matches=False,
+        ).set_index('index').sort_index()
+        frame['customer_risk_score'] = scored['overall_score'].fillna(0.0).to_numpy()
+    else:
+        frame['customer_risk_score'] = 0.0
+
+    verified_at = pd.to_datetime(frame['customer_id'].map(verifications), utc=True)
+    age = (frame['as_of'] - verified_at).dt.total_seconds() / 86400
+    frame['verification_age_days'] = age.where(age >= 0)
+    return frame[['transaction_id', 'customer_id', 'as_of', *FEATURE_COLUMNS]]
+
+def select_features(frame, names):
+    """Return the named stored or derived features of a feature frame as floats."""
+    columns = {}
+    for name in names:
+        if name in DERIVED_FEATURES:
+            columns[name] = DERIVED_FEATURES[name](frame)
+        elif name in FEATURE_COLUMNS:
+            columns[name] = frame[name].astype(float)
+        else:
+            raise KeyError(f'Unknown feature {name!r}')
+    return pd.DataFrame(columns, index=frame.index)
+
+def load_feature_frame(transactions, assessments, customers):
+    """Run :func:`compute_feature_frame` over Transaction, RiskAssessment and Customer querysets."""
+    transaction_columns = ['id', 'customer_id', 'amount', 'timestamp',
+                           'source_country', 'destination_country']
+    assessment_columns = ['customer_id', 'assessment_date', 'overall_score']
+    return compute_feature_frame(
+        pd.DataFrame.from_records(
+            transactions.values_list(*transaction_columns).iterator(chunk_size=10000),
+            columns=transaction_columns,
+        ),
+        pd.DataFrame.from_records(
+            assessments.order_by('assessment_date', 'id').values_list(*assessment_columns).iterator(),
+            columns=assessment_columns,
+        ),
+        dict(customers.exclude(last_verification_date=None).values_list('id', 'last_verification_date')),
+    )
+
+def feature_frame_rows(frame):
+    """Yield TransactionFeatures keyword arguments from a computed frame."""
+    for row in frame.to_dict('records'):
+        if pd.isna(row['verification_age_days']):
+            row['verification_age_days'] = None
+        row['as_of'] = row['as_of'].to_pydatetime()
+        yield row
+
+FEATURE_ROW_FIELDS = ('transaction_id', 'customer_id', 'as_of', *FEATURE_COLUMNS)
+
+def insert_feature_rows(rows, batch_size=5000):
+    """Insert TransactionFeatures rows given as keyword dicts.
+
+    One prepared INSERT executed per row: ``bulk_create`` prepares every
+    value through its model field, which costs more than the insert itself
+    for a table this wide.
+    """
+    table = connection.ops.quote_name(TransactionFeatures._meta.db_table)
+    columns = ', '.join(
+        connection.ops.quote_name(TransactionFeatures._meta.get_field(name).column)
+        for name in FEATURE_ROW_FIELDS
+    )
+    sql = f'INSERT INTO {table} ({columns}) VALUES ({", ".join(["%s"] * len(FEATURE_ROW_FIELDS))})'
+    adapt = connection.ops.adapt_datetimefield_value
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            values = [row[name] for name in FEATURE_ROW_FIELDS]
+            values[2] = adapt(values[2])
+            batch.append(values)
+            if len(batch) == batch_size:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+class FeatureStore:
+    """Materialises and serves point-in-time transaction features."""
+
+    def __init__(self, windows=ROLLING_WINDOWS):
+        self.windows = windows
+        self.longest_window = max(span for _, span in windows)
+
+    def record(self, transactions):
+        """Materialise features for newly inserted transactions.
+
+        Each row sees the customer's previously recorded transactions plus
+        the earlier rows of the same batch, so a batch gets the same features
+        as inserting its transactions one at a time; the customer risk score
+        is the latest assessment strictly before each transaction, as
+        :func:`compute_feature_frame` replays it. Costs five queries per
+        batch however long the customers' histories are.
+        """
+        transactions = sorted(transactions, key=lambda t: (t.timestamp, t.id))
+        if not transactions:
+            return
+        customer_ids = {t.customer_id for t in transactions}
+        customers = Customer.objects.in_bulk(customer_ids)
+
+        # Running totals from each customer's latest row, which backdated
+        # imports can leave with a lower id than earlier-dated rows
+        latest = latest_rows(TransactionFeatures, customer_ids, ('-as_of', '-transaction_id'))
+        state = {
+            row.customer_id: [row.history_length, row.total_amount, row.cross_border_count]
+            for row in latest
+        }
+        # Timestamps and amounts inside the longest window, for the rolling sums
+        times = {customer_id: [] for customer_id in customer_ids}
+        amounts = {customer_id: [] for customer_id in customer_ids}
+        for customer_id, as_of, amount in TransactionFeatures.objects.filter(
+            customer_id__in=customer_ids,
+            as_of__gt=transactions[0].timestamp - self.longest_window
+        ).order_by('as_of', 'transaction_id').values_list('customer_id', 'as_of', 'amount'):
+            times[customer_id].append(as_of)
+            amounts[customer_id].append(amount)
+        # Assessments in effect during the batch: the latest before it, then those inside it
+        assessed = {customer_id: ([], []) for customer_id in customer_ids}
+        first, last = transactions[0].timestamp, transactions[-1].timestamp
+        for customer_id, assessment_date, score in chain(
+            latest_rows(RiskAssessment, customer_ids, ('-assessment_date', '-id'),
+                        assessment_date__lt=first)
+            .values_list('customer_id', 'assessment_date', 'overall_score'),
+            RiskAssessment.objects.filter(
+                customer_id__in=customer_ids, assessment_date__gte=first, assessment_date__lt=last
+            ).order_by('assessment_date', 'id').values_list('customer_id', 'assessment_date', 'overall_score'),
+        ):
+            assessed[customer_id][0].append(assessment_date)
+            assessed[customer_id][1].append(score)
+
+        rows = []
+        for t in transactions:
+            amount = float(t.amount)
+            cross_border = t.source_country != t.destination_country
+            count, total, cross_border_count = state.get(t.customer_id, (0, 0.0, 0))
+            state[t.customer_id] = running = [count + 1, total + amount, cross_border_count + cross_border]
+            times[t.customer_id].append(t.timestamp)
+            amounts[t.customer_id].append(amount)
+            customer = customers[t.customer_id]
+            assessment_dates, scores = assessed[t.customer_id]
+            scored = bisect_left(assessment_dates, t.timestamp)
+            rows.append(dict(
+                transaction_id=t.id,
+                customer_id=t.customer_id,
+                as_of=t.timestamp,
+                amount=amount,
+                history_length=running[0],
+                total_amount=running[1],
+                cross_border=cross_border,
+                cross_border_count=running[2],
+                customer_risk_score=scores[scored - 1] if scored else 0.0,
+                verification_age_days=verification_age_days(customer.last_verification_date, t.timestamp),
+                **self._window_totals(times[t.customer_id], amounts[t.customer_id], t.timestamp)
+            ))
+        insert_feature_rows(rows)
+
+    def _window_totals(self, times, amounts, as_of):
+        end = bisect_right(times, as_of)
+        totals = {}
+        for name, span in self.windows:
+            start = bisect_right(times, as_of - span)
+            totals[f'count_{name}'] = end - start
+            totals[f'amount_{name}'] = sum(amounts[start:end])
+        return totals
+
+    def vectors(self, transaction_ids, names):
+        """Return a float matrix of the named features, one row per transaction id.
+
+        Used by online scoring; every transaction must have been recorded.
+        """
+        transaction_ids = list(transaction_ids)
+        rows = dict(
+            (row[0], row[1:]) for row in TransactionFeatures.objects.filter(
+                transaction_id__in=transaction_ids
+            ).values_list('transaction_id', *FEATURE_COLUMNS)
+        )
+        missing = [pk for pk in transaction_ids if pk not in rows]
+        if missing:
+            raise LookupError(f'No features recorded for transactions {missing[:10]}')
+        frame = pd.DataFrame([rows[pk] for pk in transaction_ids], columns=FEATURE_COLUMNS, dtype=float)
+        return select_features(frame, names).to_numpy(dtype=float)
+
+    def training_frame(self, transactions=None, names=FEATURE_COLUMNS):
+        """Return point-in-time features and the ``is_suspicious`` label for training.
+
+        ``transactions`` is an optional Transaction queryset restricting the
+        rows; the frame is ordered by ``as_of``.
+        """
+        rows = TransactionFeatures.objects.all()
+        if transactions is not None:
+            rows = rows.filter(transaction__in=transactions.values('id'))
+        columns = ['transaction_id', 'customer_id', 'as_of', *FEATURE_COLUMNS, 'transaction__is_suspicious']
+        frame = pd.DataFrame.from_records(
+            rows.order_by('as_of', 'transaction_id').values_list(*columns).iterator(chunk_size=10000),
+            columns=columns,
+        ).rename(columns={'transaction__is_suspicious': 'is_suspicious'})
+        return pd.concat([
+            frame[['transaction_id', 'customer_id', 'as_of']],
+            select_features(frame, names),
+            frame['is_suspicious'],
+        ], axis=1)
+
+    def snapshot(self, customer_ids, as_of):
+        """Return customer-level features as they stood at ``as_of``.
+
+        ``{customer_id: {feature: value}}`` from the customer's latest row at
+        or before ``as_of`` and rolling windows ending at ``as_of``; customers
+        without transactions by then are omitted. Two queries.
+        """
+        customer_ids = list(customer_ids)
+        known = TransactionFeatures.objects.filter(customer_id__in=customer_ids, as_of__lte=as_of)
+        latest = latest_rows(
+            TransactionFeatures, customer_ids, ('-as_of', '-transaction_id'), as_of__lte=as_of
+        ).select_related('customer')
+        aggregates = {}
+        for name, span in self.windows:
+            window = Q(as_of__gt=as_of - span)
+            aggregates[f'count_{name}'] = Count('transaction_id', filter=window)
+            aggregates[f'amount_{name}'] = Sum('amount', filter=window)
+        windows = {
+            row['customer_id']: row for row in known.filter(
+                as_of__gt=as_of - self.longest_window
+            ).values('customer_id').annotate(**aggregates)
+        }
+
+        snapshots = {}
+        for row in latest:
+            recent = windows.get(row.customer_id, {})
+            snapshots[row.customer_id] = {
+                'history_length': row.history_length,
+                'total_amount': row.total_amount,
+                'mean_amount': row.total_amount / row.history_length,
+                'cross_border_count': row.cross_border_count,
+                'cross_border_ratio': row.cross_border_count / row.history_length,
+                'customer_risk_score': row.customer_risk_score,
+                'verification_age_days': verification_age_days(
+                    row.customer.last_verification_date, as_of
+                ),
+                'last_transaction_at': row.as_of,
+                **{
+                    key: recent.get(key) or 0
+                    for name, _ in self.windows for key in (f'count_{name}', f'amount_{name}')
+                },
+            }
+        return snapshots
+
+    def rebuild(self, customer_ids=None):
+        """Recompute feature rows from the raw transaction history."""
+        transactions = Transaction.objects.all()
+        assessments = RiskAssessment.objects.all()
+        customers = Customer.objects.all()
+        if customer_ids is not None:
+            transactions = transactions.filter(customer_id__in=customer_ids)
+            assessments = assessments.filter(customer_id__in=customer_ids)
+            customers = customers.filter(id__in=customer_ids)
+        frame = load_feature_frame(transactions, assessments, customers)
+        with db_transaction.atomic():
+            stale = TransactionFeatures.objects.all()
+            if customer_ids is not None:
+                stale = stale.filter(customer_id__in=customer_ids)
+            stale.delete()
+            insert_feature_rows(feature_frame_rows(frame))
+        return len(frame)
+
+feature_store = FeatureStore()
@@ -0,0 +1,403 @@
+"""Transaction flow graph for layering and round-tripping detection.
+
+Transactions have no counterparty account, so the graph connects
+customers with countries. A deposit is an edge from its source country to
+the customer; withdrawals, payments and transfers are edges from the
+customer to their destination country. Each edge carries its amount,
+timestamp and transaction id.
+
+Edges are held in :class:`Segment` arrays, sorted by ``(source, time)``
+for out-edges and by ``(target, time)`` for in-edges. These are CSR
+adjacency lists whose row pointers are found by binary search on a packed
+``node << 32 | seconds`` key, which bounds a time window inside a row in
+the same search. A :class:`TransactionGraph` keeps a large base segment
+and a small recent one. New transactions go into the recent segment,
+which is folded into the base once it reaches a fraction of its size, so
+an insert never re-sorts the whole graph. Edges older than
+``AML_ACTIVITY_HORIZON_HOURS`` are dropped at each fold.
+
+:meth:`FlowGraph.signals` reports, for each transaction over the
+``TRANSACTION_GRAPH_WINDOW_HOURS`` before it:
+
+- ``cycle_length``: the length of the shortest time-respecting cycle the
+  transaction closes through foreign countries, for example money sent to
+  a country and received back from it (round-tripping), or passed through
+  another customer on the way (0 if none). Only transactions of at least
+  ``TRANSACTION_GRAPH_CYCLE_MIN_AMOUNT`` are checked, and only over edges
+  whose amounts match theirs within ``TRANSACTION_GRAPH_CYCLE_AMOUNT_RATIO``,
+  so the same money has to come back rather than any two payments to and
+  from the same country;
+- ``fan_out`` / ``fan_in``: how many distinct foreign countries the
+  customer sent to or received from;
+- ``pass_through``: for outgoing transactions, how closely the customer's
+  outflow matches its inflow over the window (1.0 is everything that came
+  in went straight out).
+
+:func:`graph_risk` turns the signals into a score that feeds
+``Transaction.risk_score`` when transactions are scored.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Transaction
+
+COUNTRY_NODES = 26 * 26  # one node per two-letter code; customers come after
+INBOUND_TYPES = frozenset({'deposit'})
+EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+TIME_BITS = 32
+
+# Transaction fields an edge is built from, in this order
+EDGE_FIELDS = ('id', 'customer_id', 'amount', 'timestamp', 'transaction_type',
+               'source_country', 'destination_country')
+
+# Risk a transaction gets for the strongest pattern it takes part in
+PATTERN_RISK = {'cycle': 0.9, 'pass_through': 0.7, 'fan': 0.6}
+
+# Edges a single cycle search may visit before giving up
+CYCLE_SEARCH_BUDGET = 100_000
+
+# Recently added ids re-read on each refresh, for rows committed out of id order
+REFRESH_OVERLAP_IDS = 1000
+
+def country_nodes(codes):
+    """Node numbers of two-letter uppercase country codes."""
+    letters = np.asarray(codes, dtype='<U2').view(np.uint32).reshape(-1, 2).astype(np.int64) - 65
+    letters = np.clip(letters, 0, 25)
+    return letters[:, 0] * 26 + letters[:, 1]
+
+def customer_nodes(customer_ids):
+    return COUNTRY_NODES + np.asarray(customer_ids, dtype=np.int64)
+
+def to_seconds(timestamps):
+    """Seconds since :data:`EPOCH` of aware datetimes, as int64."""
+    base = EPOCH.timestamp()
+    return np.fromiter((t.timestamp() - base for t in timestamps), dtype=float,
+                       count=len(timestamps)).astype(np.int64).clip(0, 2 ** TIME_BITS - 1)
+
+def edge_columns(rows):
+    """``(src, dst, seconds, amount, ids)`` arrays for rows of :data:`EDGE_FIELDS` values."""
+    rows = list(rows)
+    if not rows:
+        return empty_columns()
+    ids, customers, amounts, timestamps, types, sources, destinations = zip(*rows)
+    inbound = np.fromiter((t in INBOUND_TYPES for t in types), dtype=bool, count=len(rows))
+    customer = customer_nodes(customers)
+    src = np.where(inbound, country_nodes(sources), customer)
+    dst = np.where(inbound, customer, country_nodes(destinations))
+    return (src, dst, to_seconds(timestamps), np.asarray(amounts, dtype=float),
+            np.asarray(ids, dtype=np.int64))
+
+def transaction_rows(transactions):
+    return [tuple(getattr(t, field) for field in EDGE_FIELDS) for t in transactions]
+
+def empty_columns():
+    return (np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.int64),
+            np.empty(0, float), np.empty(0, np.int64))
+
+def _keys(nodes, seconds):
+    return (np.asarray(nodes, dtype=np.int64) << TIME_BITS) | seconds
+
+def _prefix_sums(values):
+    return np.concatenate(([0.0], np.cumsum(values)))
+
+def _expand(lo, hi):
+    """Flatten the index ranges ``[lo, hi)``; returns ``(owner, index)`` per element."""
+    counts = hi - lo
+    owner = np.repeat(np.arange(len(lo)), counts)
+    index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    return owner, index
+
+def _earliest(nodes, times):
+    """Each distinct node once, sorted, with its earliest time."""
+    order = np.lexsort((times, nodes))
+    nodes, times = nodes[order], times[order]
+    first = np.ones(len(nodes), dtype=bool)
+    first[1:] = nodes[1:] != nodes[:-1]
+    return nodes[first], times[first]
+
+class Segment:
+    """Immutable edge arrays sorted for out- and in-adjacency lookups.
+
+    ``src``, ``dst``, ``seconds``, ``amount`` and ``ids`` are in
+    ``(src, seconds)`` order under ``out_key``; ``in_key``, ``in_src`` and
+    ``in_sums`` are the same edges in ``(dst, seconds)`` order. The prefix
+    sums of amounts give the value of any row slice without a scan.
+    """
+    __slots__ = ('src', 'dst', 'seconds', 'amount', 'ids', 'out_key', 'out_sums',
+                 'in_key', 'in_src', 'in_sums', 'sorted_ids')
+
+    def __init__(self, src, dst, seconds, amount, ids):
+        out_key = _keys(src, seconds)
+        order = np.argsort(out_key, kind='stable')
+        self.out_key = out_key[order]
+        self.src, self.dst, self.seconds, self.amount, self.ids = (
+            column[order] for column in (src, dst, seconds, amount, ids)
+        )
+        self.out_sums = _prefix_sums(self.amount)
+        in_key = _keys(self.dst, self.seconds)
+        order = np.argsort(in_key, kind='stable')
+        self.in_key = in_key[order]
+        self.in_src = self.src[order]
+        self.in_sums = _prefix_sums(self.amount[order])
+        self.sorted_ids = np.sort(self.ids)
+        for name in self.__slots__:
+            getattr(self, name).flags.writeable = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def columns(self):
+        return self.src, self.dst, self.seconds, self.amount, self.ids
+
+    def merge(self, columns, min_seconds=0):
+        """A new segment with this one's edges and ``columns``, dropping edges before ``min_seconds``."""
+        merged = [np.concatenate(pair) for pair in zip(self.columns(), columns)]
+        keep = merged[2] >= min_seconds
+        return Segment(*(column[keep] for column in merged))
+
+    def contains(self, ids):
+        """Mask of ``ids`` that are edges of this segment."""
+        if not len(self):
+            return np.zeros(len(ids), dtype=bool)
+        found = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self) - 1)
+        return self.sorted_ids[found] == ids
+
+    def out_ranges(self, nodes, start, end):
+        """Out-edge index ranges of ``nodes`` with seconds in ``[start, end]``."""
+        return (np.searchsorted(self.out_key, _keys(nodes, start), 'left'),
+                np.searchsorted(self.out_key, _keys(nodes, end), 'right'))
+
+    def in_ranges(self, nodes, start, end):
+        """In-edge index ranges (into the ``in_*`` arrays) of ``nodes`` in ``[start, end]``."""
+        return (np.searchsorted(self.in_key, _keys(nodes, start), 'left'),
+                np.searchsorted(self.in_key, _keys(nodes, end), 'right'))
+
+EMPTY_SEGMENT = Segment(*empty_columns())
+
+class FlowGraph:
+    """A consistent snapshot of the graph's segments, answering pattern queries."""
+
+    def __init__(self, segments, domestic_countries=None):
+        self.segments = tuple(segment for segment in segments if len(segment))
+        self.excluded = np.zeros(COUNTRY_NODES, dtype=bool)
+        domestic = (settings.TRANSACTION_GRAPH_DOMESTIC_COUNTRIES if domestic_countries is None
+                    else domestic_countries)
+        if domestic:
+            self.excluded[country_nodes(list(domestic))] = True
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def signals(self, rows, window_hours=None, max_cycle_length=None):
+        """Pattern signals of transactions given as :data:`EDGE_FIELDS` rows or instances.
+
+        Returns a dict of arrays (``cycle_length``, ``fan_out``, ``fan_in``,
+        ``pass_through``), one element per transaction. Each transaction is
+        judged on the window before its own timestamp.
+        """
+        rows = list(rows)
+        if rows and not isinstance(rows[0], tuple):
+            rows = transaction_rows(rows)
+        src, dst, seconds, amount, _ = edge_columns(rows)
+        window = int((window_hours or settings.TRANSACTION_GRAPH_WINDOW_HOURS) * 3600)
+        max_cycle_length = max_cycle_length or settings.TRANSACTION_GRAPH_MAX_CYCLE_LENGTH
+        start = np.maximum(seconds - window, 0)
+        outgoing = src >= COUNTRY_NODES
+        customer = np.where(outgoing, src, dst)
+
+        fan_out = self.distinct_countries(customer, start, seconds, outgoing=True)
+        fan_in = self.distinct_countries(customer, start, seconds, outgoing=False)
+        inflow = self.window_sums(customer, start, seconds, outgoing=False)
+        outflow = self.window_sums(customer, start, seconds, outgoing=True)
+        low, high = np.minimum(inflow, outflow), np.maximum(inflow, outflow)
+        floor = settings.TRANSACTION_GRAPH_PASS_THROUGH_MIN_AMOUNT
+        pass_through = np.where(outgoing & (low >= floor), low / np.where(high > 0, high, 1), 0.0)
+
+        cycle_length = np.zeros(len(rows), dtype=np.int64)
+        country = np.where(outgoing, dst, src)
+        ratio = settings.TRANSACTION_GRAPH_CYCLE_AMOUNT_RATIO
+        candidates = ~self.excluded[country] & (amount >= settings.TRANSACTION_GRAPH_CYCLE_MIN_AMOUNT)
+        for i in np.flatnonzero(candidates):
+            cycle_length[i] = self.cycle_length(src[i], dst[i], start[i], seconds[i] - 1,
+                                                max_cycle_length, amount[i] * ratio, amount[i] / ratio)
+        return {'cycle_length': cycle_length, 'fan_out': fan_out, 'fan_in': fan_in,
+                'pass_through': pass_through}
+
+    def distinct_countries(self, customers, start, end, outgoing):
+        """Distinct foreign countries each customer sent to (or received from) in its window."""
+        pairs = [np.empty(0, np.int64)]
+        for segment in self.segments:
+            if outgoing:
+                lo, hi = segment.out_ranges(customers, start, end)
+                owner, index = _expand(lo, hi)
+                peers = segment.dst[index]
+            else:
+                lo, hi = segment.in_ranges(customers, start, end)
+                owner, index = _expand(lo, hi)
+                peers = segment.in_src[index]
+            keep = ~self.excluded[peers]
+            pairs.append((owner[keep].astype(np.int64) << TIME_BITS) | peers[keep])
+        distinct = np.unique(np.concatenate(pairs))
+        return np.bincount(distinct >> TIME_BITS, minlength=len(customers))
+
+    def window_sums(self, nodes, start, end, outgoing):
+        """Total amount of each node's out- (or in-) edges in its window."""
+        total = np.zeros(len(nodes))
+        for segment in self.segments:
+            if outgoing:
+                lo, hi = segment.out_ranges(nodes, start, end)
+                total += segment.out_sums[hi] - segment.out_sums[lo]
+            else:
+                lo, hi = segment.in_ranges(nodes, start, end)
+                total += segment.in_sums[hi] - segment.in_sums[lo]
+        return total
+
+    def cycle_length(self, source, target, start, end, max_length, low=0.0, high=np.inf):
+        """Length of the shortest cycle the edge ``source -> target`` closes, or 0.
+
+        Searches for a time-respecting path from ``target`` back to
+        ``source`` over edges in ``[start, end]`` with amounts in
+        ``[low, high]``, each no earlier than the
+        one before, with earliest-arrival breadth-first search: each hop
+        expands every frontier node at once and keeps only the earliest
+        arrival at each node. The last hop is answered from the in-edges
+        of ``source`` instead, so the customers reached through a busy
+        country are never expanded. Domestic countries are not passed
+        through.
+        """
+        frontier = np.array([target], dtype=np.int64)
+        arrival = np.array([start], dtype=np.int64)
+        visited, visited_at = frontier, arrival
+        budget = CYCLE_SEARCH_BUDGET
+        for hops in range(1, max_length):
+            if hops == max_length - 1:
+                reached = self._reaches(frontier, arrival, source, start, end, low, high)
+                return hops + 1 if reached else 0
+            nodes, times = [], []
+            for segment in self.segments:
+                lo, hi = segment.out_ranges(frontier, arrival, np.full(len(frontier), end))
+                _, index = _expand(lo, hi)
+                budget -= len(index)
+                index = index[(segment.amount[index] >= low) & (segment.amount[index] <= high)]
+                nodes.append(segment.dst[index])
+                times.append(segment.seconds[index])
+            nodes, times = np.concatenate(nodes), np.concatenate(times)
+            if np.any(nodes == source):
+                return hops + 1
+            if budget <= 0:
+                return 0
+            domestic = (nodes < COUNTRY_NODES) & self.excluded[np.minimum(nodes, COUNTRY_NODES - 1)]
+            nodes, times = nodes[~domestic], times[~domestic]
+            # Earliest arrival per node, and only where it improves on an earlier hop
+            nodes, times = _earliest(nodes, times)
+            seen = np.minimum(np.searchsorted(visited, nodes), len(visited) - 1)
+            better = (visited[seen] != nodes) | (times < visited_at[seen])
+            frontier, arrival = nodes[better], times[better]
+            if not len(frontier):
+                return 0
+            visited, visited_at = _earliest(np.concatenate((visited, frontier)),
+                                            np.concatenate((visited_at, arrival)))
+        return 0
+
+    def _reaches(self, frontier, arrival, node, start, end, low, high):
+        """Whether any frontier node has an edge to ``node`` no earlier than its arrival.
+
+        Only edges with amounts in ``[low, high]`` count. ``frontier`` must
+        be sorted.
+        """
+        for segment in self.segments:
+            lo, hi = segment.in_ranges(np.array([node]), np.array([start]), np.array([end]))
+            senders = segment.in_src[lo[0]:hi[0]]
+            times = segment.in_key[lo[0]:hi[0]] & (2 ** TIME_BITS - 1)
+            amounts = np.diff(segment.in_sums[lo[0]:hi[0] + 1])
+            position = np.minimum(np.searchsorted(frontier, senders), len(frontier) - 1)
+            matched = (frontier[position] == senders) & (times >= arrival[position])
+            if np.any(matched & (amounts >= low) & (amounts <= high)):
+                return True
+        return False
+
+def graph_risk(signals, fan_limit=None, pass_through_ratio=None):
+    """Risk from the strongest pattern in each transaction's signals, per :data:`PATTERN_RISK`."""
+    fan_limit = fan_limit or settings.TRANSACTION_GRAPH_FAN_LIMIT
+    pass_through_ratio = pass_through_ratio or settings.TRANSACTION_GRAPH_PASS_THROUGH_RATIO
+    risk = np.where(signals['cycle_length'] > 0, PATTERN_RISK['cycle'], 0.0)
+    risk = np.maximum(risk, np.where(signals['pass_through'] >= pass_through_ratio,
+                                     PATTERN_RISK['pass_through'], 0.0))
+    fan = np.maximum(signals['fan_out'], signals['fan_in'])
+    return np.maximum(risk, np.where(fan >= fan_limit, PATTERN_RISK['fan'], 0.0))
+
+class TransactionGraph:
+    """Per-process flow graph, updated incrementally.
+
+    :meth:`add` folds in transactions as they are scored. At most every
+    ``poll_seconds`` :meth:`current` also reads rows other processes have
+    inserted since the last read, so every process converges on the same
+    graph; edges already present are skipped. The first call loads the
+    transactions within the horizon, which the scoring workers (and
+    ``preload_models`` with ``TRANSACTION_GRAPH_PRELOAD``) do at start-up
+    rather than in a request.
+    """
+
+    def __init__(self, horizon_hours=None, poll_seconds=None, fold_fraction=8, min_recent=4096):
+        self.horizon = timedelta(hours=horizon_hours or settings.AML_ACTIVITY_HORIZON_HOURS)
+        self.poll_seconds = (settings.TRANSACTION_GRAPH_POLL_SECONDS if poll_seconds is None
+                             else poll_seconds)
+        self.fold_fraction = fold_fraction
+        self.min_recent = min_recent
+        self._segments = (EMPTY_SEGMENT, EMPTY_SEGMENT)
+        self._watermark = None
+        self._checked_at = None
+        self._lock = threading.RLock()
+
+    def current(self):
+        """A snapshot of the graph, refreshed from the database if the poll is due."""
+        now = time.monotonic()
+        if self._watermark is None or now - self._checked_at >= self.poll_seconds:
+            with self._lock:
+                if self._watermark is None or now - self._checked_at >= self.poll_seconds:
+                    self.refresh()
+        return FlowGraph(self._segments)
+
+    def add(self, transactions):
+        """Fold saved transactions into the graph; returns a snapshot that includes them."""
+        self.current()
+        with self._lock:
+            self.add_columns(edge_columns(transaction_rows(transactions)))
+        return FlowGraph(self._segments)
+
+    def add_columns(self, columns):
+        """Fold ``(src, dst, seconds, amount, ids)`` arrays into the graph, skipping known ids."""
+        with self._lock:
+            base, recent = self._segments
+            known = base.contains(columns[4]) | recent.contains(columns[4])
+            if known.all():
+                return
+            columns = tuple(column[~known] for column in columns)
+            recent = recent.merge(columns)
+            if len(recent) >= max(self.min_recent, len(base) // self.fold_fraction):
+                cutoff = int((timezone.now() - self.horizon - EPOCH).total_seconds())
+                base, recent = base.merge(recent.columns(), min_seconds=cutoff), EMPTY_SEGMENT
+            self._segments = (base, recent)
+
+    def refresh(self, chunk_size=50000):
+        """Read transactions inserted since the last refresh (all within the horizon, at first)."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            rows = Transaction.objects.filter(timestamp__gte=timezone.now() - self.horizon)
+            last = max((self._watermark or 0) - REFRESH_OVERLAP_IDS, 0)
+            watermark = self._watermark or 0
+            while True:
+                chunk = list(rows.filter(id__gt=last).order_by('id').values_list(*EDGE_FIELDS)[:chunk_size])
+                if not chunk:
+                    break
+                self.add_columns(edge_columns(chunk))
+                last = chunk[-1][0]
+                watermark = max(watermark, last)
+            self._watermark = watermark
+
+transaction_graph = TransactionGraph()
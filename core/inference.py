@@ -0,0 +1,248 @@
+"""In-process micro-batching for anomaly scoring.
+
+Scoring one transaction at a time spends most of each model call on
+per-call overhead in scikit-learn. :class:`MicroBatcher` queues the feature
+rows of concurrent callers (request threads, scoring worker threads),
+scores up to ``max_batch_rows`` of them or whatever arrived within
+``max_wait_ms`` of the oldest with one vectorised model call, and hands
+each caller back its own slice of the result.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+
+from .registry import get_anomaly_detector
+
+logger = logging.getLogger(__name__)
+
+class _Request:
+    __slots__ = ('features', 'enqueued_at', 'done', 'result', 'error', 'abandoned')
+
+    def __init__(self, features):
+        self.features = features
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Set by a caller that timed out and scored its rows itself
+        self.abandoned = False
+
+class BatchMetrics:
+    """Running batch-size and queue-wait statistics for a micro-batcher.
+
+    Totals cover the batcher's lifetime; percentiles are over the most
+    recent ``window`` batches and requests.
+    """
+
+    def __init__(self, window=1024):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.rows = 0
+        self.max_batch_rows = 0
+        self.timeouts = 0
+        self._batch_rows = deque(maxlen=window)
+        self._waits_ms = deque(maxlen=window)
+        self._inference_ms = deque(maxlen=window)
+
+    def record(self, rows, waits_ms, inference_ms):
+        with self._lock:
+            self.batches += 1
+            self.requests += len(waits_ms)
+            self.rows += rows
+            self.max_batch_rows = max(self.max_batch_rows, rows)
+            self._batch_rows.append(rows)
+            self._waits_ms.extend(waits_ms)
+            self._inference_ms.append(inference_ms)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        """Return the current statistics as a plain dict."""
+        with self._lock:
+            batch_rows = np.array(self._batch_rows, dtype=float)
+            waits = np.array(self._waits_ms, dtype=float)
+            inference = np.array(self._inference_ms, dtype=float)
+            totals = {
+                'batches': self.batches,
+                'requests': self.requests,
+                'rows': self.rows,
+                'max_batch_rows': self.max_batch_rows,
+                'timeouts': self.timeouts,
+            }
+        if not self.batches:
+            return totals
+        return {
+            **totals,
+            'mean_batch_rows': float(batch_rows.mean()),
+            'mean_queue_wait_ms': float(waits.mean()),
+            'p95_queue_wait_ms': float(np.percentile(waits, 95)),
+            'max_queue_wait_ms': float(waits.max()),
+            'mean_inference_ms': float(inference.mean()),
+        }
+
+class MicroBatcher:
+    """Coalesce concurrent anomaly scoring calls into vectorised batches.
+
+    Exposes the scoring interface of ``TransactionAnomalyDetector``
+    (``score_batch``, ``anomaly_scores``, ``predict``, ``threshold``,
+    ``FEATURE_NAMES``), so it can be passed anywhere a detector is expected.
+    ``max_batch_rows`` bounds throughput-oriented batching; ``max_wait_ms``
+    bounds the latency a caller can be held for waiting for company. Calls
+    with at least ``max_batch_rows`` rows skip the queue. ``detector`` may
+    be swapped at any time; each batch is scored and thresholded by the
+    detector current when the batch starts. A caller whose batch has not
+    been scored within ``timeout`` seconds (by default ten batch windows,
+    and at least a second) scores its rows itself, so a stalled batcher
+    thread slows requests down but never hangs them; its request is
+    abandoned, and the batcher discards rather than delivers its result.
+    """
+
+    def __init__(self, detector, max_batch_rows=None, max_wait_ms=None, timeout=None):
+        self.detector = detector
+        self.max_batch_rows = max_batch_rows or settings.ANOMALY_BATCH_MAX_ROWS
+        self.max_wait = (settings.ANOMALY_BATCH_MAX_WAIT_MS if max_wait_ms is None
+                         else max_wait_ms) / 1000
+        self.timeout = max(self.max_wait * 10, 1.0) if timeout is None else timeout
+        self.metrics = BatchMetrics()
+        self._queue = queue.Queue()
+        # Request taken off the queue that did not fit in the last batch
+        self._carried = None
+        self._lock = threading.Lock()
+        # Makes delivering a result and abandoning its request exclusive
+        self._results_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def FEATURE_NAMES(self):
+        return self.detector.FEATURE_NAMES
+
+    @property
+    def threshold(self):
+        return self.detector.threshold
+
+    def score_batch(self, features):
+        """Return ``(scores, flags)`` per row, scored together with concurrent callers."""
+        features = np.asarray(features, dtype=float)
+        if len(features) >= self.max_batch_rows:
+            return self.detector.score_batch(features)
+        self._ensure_thread()
+        request = _Request(features)
+        self._queue.put(request)
+        if not request.done.wait(self.timeout):
+            with self._results_lock:
+                request.abandoned = not request.done.is_set()
+            if request.abandoned:
+                self.metrics.record_timeout()
+                logger.warning('Anomaly scoring batch not done after %.1fs; scoring %d rows inline',
+                               self.timeout, len(features))
+                return self.detector.score_batch(features)
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def anomaly_scores(self, features):
+        return self.score_batch(features)[0]
+
+    def predict(self, features):
+        return self.score_batch(features)[1]
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so a forked web worker starts its own
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._carried = None
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name='anomaly-microbatcher', daemon=True
+                )
+                self._thread.start()
+
+    def _next_batch(self):
+        first, self._carried = self._carried, None
+        while first is None or first.abandoned:
+            first = self._queue.get()
+        batch = [first]
+        rows = len(first.features)
+        deadline = first.enqueued_at + self.max_wait
+        while rows < self.max_batch_rows:
+            # Past the deadline, still take whatever is already queued
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    request = self._queue.get(timeout=timeout)
+                else:
+                    request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request.abandoned:
+                continue
+            if rows + len(request.features) > self.max_batch_rows:
+                # Queued calls are smaller than a batch, so it starts the next one
+                self._carried = request
+                break
+            batch.append(request)
+            rows += len(request.features)
+        return batch, rows
+
+    def _run(self):
+        while True:
+            batch, rows = self._next_batch()
+            started = time.perf_counter()
+            results, error = [], None
+            try:
+                scores, flags = self.detector.score_batch(np.vstack([r.features for r in batch]))
+                offset = 0
+                for request in batch:
+                    end = offset + len(request.features)
+                    results.append((scores[offset:end], flags[offset:end]))
+                    offset = end
+            except Exception as exc:
+                logger.exception('Anomaly scoring batch of %d rows failed', rows)
+                error = exc
+            finished = time.perf_counter()
+            with self._results_lock:
+                for i, request in enumerate(batch):
+                    if request.abandoned:
+                        continue
+                    if error is None:
+                        request.result = results[i]
+                    else:
+                        request.error = error
+                    request.done.set()
+            self.metrics.record(
+                rows,
+                [(started - request.enqueued_at) * 1000 for request in batch],
+                (finished - started) * 1000,
+            )
+
+_anomaly_scorer = None
+_anomaly_scorer_lock = threading.Lock()
+
+def get_anomaly_scorer():
+    """Return the process-wide anomaly scorer.
+
+    A :class:`MicroBatcher` around the production detector, or the detector
+    itself when ``ANOMALY_BATCH_MAX_WAIT_MS`` is 0. The batcher is pointed
+    at the registry's current production detector on every call, so a
+    promotion takes effect from the next batch.
+    """
+    global _anomaly_scorer
+    detector = get_anomaly_detector()
+    if not settings.ANOMALY_BATCH_MAX_WAIT_MS:
+        return detector
+    with _anomaly_scorer_lock:
+        if _anomaly_scorer is None:
+            _anomaly_scorer = MicroBatcher(detector)
+        _anomaly_scorer.detector = detector
+    return _anomaly_scorer
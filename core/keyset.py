@@ -0,0 +1,46 @@
+"""Keyset (seek) pagination helpers for iterating large querysets."""
+from django.db.models import Q
+
+def keyset_filter(fields, values, descending=False):
+    """Return a Q selecting rows strictly after ``values`` in ``fields`` order.
+
+    For fields ``(a, b)`` and ascending order this is
+    ``a >= x AND (a > x OR (a = x AND b > y))``, which databases can answer
+    with an index range scan on ``(a, b)`` instead of an ``OFFSET``. The
+    leading ``a >= x`` is implied by the rest, but without it SQLite does not
+    see the range when the values are bound parameters and falls back to
+    scanning and sorting.
+    """
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for position, field in enumerate(fields):
+        clause = Q(**{f'{field}__{lookup}': values[position]})
+        for previous, value in zip(fields[:position], values[:position]):
+            clause &= Q(**{previous: value})
+        condition |= clause
+    return Q(**{f'{fields[0]}__{lookup}e': values[0]}) & condition
+
+def iter_keyset(queryset, fields=('timestamp', 'id'), chunk_size=2000, descending=False):
+    """Yield every row of ``queryset`` ordered by ``fields``, one chunk per query.
+
+    Each chunk is a bounded query seeking past the last row of the previous
+    one, so memory stays flat and no database cursor is held open between
+    chunks. Works for model instances and ``values()`` dictionaries; the
+    last field must be unique (normally the primary key).
+    """
+    ordering = [f'-{field}' if descending else field for field in fields]
+    queryset = queryset.order_by(*ordering)
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(keyset_filter(fields, last, descending))
+        rows = list(page[:chunk_size])
+        if not rows:
+            return
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        final = rows[-1]
+        if isinstance(final, dict):
+            last = [final[field] for field in fields]
+        else:
+            last = [getattr(final, field) for field in fields]
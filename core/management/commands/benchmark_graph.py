@@ -0,0 +1,166 @@
+"""Benchmark the transaction flow graph at a million edges.
+
+Generates synthetic transactions between customers and countries over a
+month, with round trips, fan-outs and pass-throughs planted among them,
+builds the graph, folds in further transactions in small batches the way
+scoring does, and times each pattern query for single transactions and
+for batches. Nothing is read from or written to the database.
+"""
+import statistics
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core.graph import (COUNTRY_NODES, EPOCH, FlowGraph, Segment, TransactionGraph, country_nodes,
+                        customer_nodes, graph_risk)
+
+COUNTRIES = ['GB', 'US', 'FR', 'DE', 'IE', 'NL', 'ES', 'IT', 'CH', 'AE', 'HK', 'SG', 'CY', 'MT',
+             'KY', 'VG', 'PA', 'LU', 'JE', 'GI']
+
+
+class Command(BaseCommand):
+    help = 'Measure build, incremental update and pattern query latency of the transaction graph'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edges', type=int, default=1_000_000, help='Transactions in the graph')
+        parser.add_argument('--customers', type=int, default=100_000)
+        parser.add_argument('--days', type=int, default=30, help='Period the transactions span')
+        parser.add_argument('--queries', type=int, default=2000, help='Transactions queried one at a time')
+        parser.add_argument('--batch', type=int, default=500, help='Transactions per incremental update')
+        parser.add_argument('--batch-queries', type=int, default=10_000,
+                            help='Transactions queried together in one signals call')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(42)
+        self.span = options['days'] * 86400
+        self.start = 800_000_000  # seconds since the graph epoch, in 2025
+        columns = self._edges(rng, options['edges'], options['customers'])
+        planted = self._patterns(rng, options['customers'], options['edges'])
+        columns = tuple(np.concatenate(pair) for pair in zip(columns, planted))
+        total = len(columns[0])
+
+        started = time.perf_counter()
+        segment = Segment(*columns)
+        self.stdout.write(f'Built {total} edges in {time.perf_counter() - started:.2f}s '
+                          f'({self._size(segment) / 2 ** 20:.0f} MiB)')
+        graph = FlowGraph([segment])
+
+        # Incremental updates, as scoring folds in each batch
+        incremental = TransactionGraph(horizon_hours=10 ** 6, poll_seconds=10 ** 9)
+        incremental.add_columns(columns)
+        update_times = []
+        for batch in range(20):
+            fresh = self._edges(rng, options['batch'], options['customers'])
+            fresh = fresh[:4] + (fresh[4] + total + batch * options['batch'],)
+            started = time.perf_counter()
+            incremental.add_columns(fresh)
+            update_times.append(time.perf_counter() - started)
+        self._latency(f'add {options["batch"]:,}', update_times)
+
+        queries = self._queries(rng, columns, options['queries'])
+        timings = {name: [] for name in ('fan', 'pass_through', 'cycle')}
+        for src, dst, seconds in queries:
+            nodes, start, end = self._customer(src, dst), np.array([seconds - 72 * 3600]), np.array([seconds])
+            started = time.perf_counter()
+            graph.distinct_countries(nodes, start, end, outgoing=True)
+            graph.distinct_countries(nodes, start, end, outgoing=False)
+            timings['fan'].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            graph.window_sums(nodes, start, end, outgoing=True)
+            graph.window_sums(nodes, start, end, outgoing=False)
+            timings['pass_through'].append(time.perf_counter() - started)
+            if graph.excluded[min(src, dst)]:
+                continue  # domestic transactions close no cycle
+            started = time.perf_counter()
+            graph.cycle_length(src, dst, seconds - 72 * 3600, seconds - 1, 4)
+            timings['cycle'].append(time.perf_counter() - started)
+        for name in ('fan', 'pass_through', 'cycle'):
+            self._latency(name, timings[name])
+
+        picks = rng.integers(0, options['edges'], options['batch_queries'])
+        rows = self._rows(*(column[picks] for column in columns))
+        started = time.perf_counter()
+        graph.signals(rows)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'signals     {len(rows)} transactions in one call: {elapsed * 1000:.1f} ms '
+                          f'({elapsed * 1e6 / len(rows):.1f} us each)')
+
+        rows = self._rows(*(column[-len(planted[0]):] for column in columns))
+        signals = graph.signals(rows)
+        risk = graph_risk(signals)
+        self.stdout.write(
+            f'  of {len(rows)} planted transactions, {np.count_nonzero(signals["cycle_length"])} '
+            f'close cycles and {np.count_nonzero(risk)} raise the risk score'
+        )
+
+    def _edges(self, rng, count, customers):
+        customer = customer_nodes(rng.integers(1, customers + 1, count))
+        # Most money stays at home; the rest is spread unevenly abroad
+        weights = np.array([20.0] + [1 / (i + 1) for i in range(len(COUNTRIES) - 1)])
+        country = country_nodes(COUNTRIES)[rng.choice(len(COUNTRIES), count, p=weights / weights.sum())]
+        inbound = rng.random(count) < 0.4
+        seconds = self.start + rng.integers(0, self.span, count)
+        amount = np.round(rng.lognormal(5, 1.2, count), 2)
+        return (np.where(inbound, country, customer), np.where(inbound, customer, country),
+                seconds, amount, np.arange(count, dtype=np.int64))
+
+    def _patterns(self, rng, customers, first_id):
+        """Round trips, fan-outs and pass-throughs of fresh customers."""
+        src, dst, seconds, amount = [], [], [], []
+        abroad = country_nodes(COUNTRIES[1:])
+        for i in range(300):
+            customer = COUNTRY_NODES + customers + 1 + i
+            at = self.start + int(rng.integers(86400, self.span))
+            value = float(rng.uniform(5000, 50000))
+            kind = i % 3
+            if kind == 0:  # out to a country and straight back
+                country = int(rng.choice(abroad))
+                src += [customer, country]
+                dst += [country, customer]
+                seconds += [at, at + 3600]
+                amount += [value, value * 0.97]
+            elif kind == 1:  # the same day to many countries
+                for j, country in enumerate(rng.choice(abroad, 6, replace=False)):
+                    src.append(customer)
+                    dst.append(int(country))
+                    seconds.append(at + j * 600)
+                    amount.append(value / 6)
+            else:  # received and passed on
+                src += [int(rng.choice(abroad)), customer]
+                dst += [customer, int(country_nodes(['GB'])[0])]
+                seconds += [at, at + 7200]
+                amount += [value, value * 0.98]
+        count = len(src)
+        return (np.array(src), np.array(dst), np.array(seconds), np.array(amount),
+                first_id + np.arange(count, dtype=np.int64))
+
+    def _queries(self, rng, columns, count):
+        picks = rng.integers(0, len(columns[0]), count)
+        return [(int(columns[0][i]), int(columns[1][i]), int(columns[2][i])) for i in picks]
+
+    def _customer(self, src, dst):
+        return np.array([src if src >= COUNTRY_NODES else dst])
+
+    def _rows(self, src, dst, seconds, amount, ids):
+        """Edges back as transaction rows, for :meth:`FlowGraph.signals`."""
+        names = {int(node): code for code, node in zip(COUNTRIES, country_nodes(COUNTRIES))}
+        rows = []
+        for s, d, t, a, i in zip(src.tolist(), dst.tolist(), seconds.tolist(), amount.tolist(), ids.tolist()):
+            inbound = s < COUNTRY_NODES
+            customer, country = (d, s) if inbound else (s, d)
+            rows.append((i, customer - COUNTRY_NODES, a, EPOCH + timedelta(seconds=t),
+                         'deposit' if inbound else 'transfer',
+                         names[country] if inbound else 'GB', 'GB' if inbound else names[country]))
+        return rows
+
+    def _size(self, segment):
+        return sum(getattr(segment, name).nbytes for name in Segment.__slots__)
+
+    def _latency(self, label, timings):
+        timings = sorted(timings)
+        self.stdout.write(
+            f'{label:12} median {statistics.median(timings) * 1e6:8.1f} us, '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1e6:8.1f} us'
+        )
@@ -0,0 +1,182 @@
+"""Benchmark hot Transaction/RiskAssessment queries with and without indexes.
+
+Seeds a throwaway SQLite database with a synthetic dataset, then runs the
+queries issued by the dashboard, compliance and scoring paths twice: once
+with the composite/partial indexes from ``core.models`` dropped and once
+with them in place, printing the query plan and median timing of each.
+"""
+import random
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction as db_transaction
+from django.utils import timezone
+
+from core.models import Customer, RiskAssessment, Transaction
+
+ALIAS = 'benchmark'
+
+class Command(BaseCommand):
+    help = 'Show query plans and timings for hot queries before and after the indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2_000_000,
+                            help='Number of transactions to seed')
+        parser.add_argument('--customers', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per query; the median is reported')
+        parser.add_argument('--db-path', help='SQLite file to seed (defaults to a temporary file)')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded database file')
+
+    def handle(self, *args, **options):
+        db_path = Path(options['db_path'] or Path(tempfile.gettempdir()) / 'aml_benchmark.sqlite3')
+        if db_path.exists():
+            db_path.unlink()
+        databases = connections.configure_settings({
+            **settings.DATABASES,
+            ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(db_path)},
+        })
+        connections.settings[ALIAS] = databases[ALIAS]
+
+        try:
+            call_command('migrate', database=ALIAS, verbosity=0)
+            indexed = [(Transaction, index) for index in Transaction._meta.indexes]
+            indexed += [(RiskAssessment, index) for index in RiskAssessment._meta.indexes]
+
+            # Load without the indexes under test; they are built afterwards
+            with connections[ALIAS].schema_editor() as editor:
+                for model, index in indexed:
+                    editor.remove_index(model, index)
+            with connections[ALIAS].cursor() as cursor:
+                cursor.execute('PRAGMA synchronous = OFF')
+                cursor.execute('PRAGMA cache_size = -262144')
+
+            started = time.perf_counter()
+            with db_transaction.atomic(using=ALIAS):
+                self._seed(options['rows'], options['customers'])
+            self.stdout.write(f'Seeded {options["rows"]:,} transactions into {db_path} '
+                              f'in {time.perf_counter() - started:.1f}s\n')
+
+            queries = self._queries()
+            before = self._measure(queries, options['repeat'])
+
+            with connections[ALIAS].schema_editor() as editor:
+                for model, index in indexed:
+                    editor.add_index(model, index)
+            after = self._measure(queries, options['repeat'])
+
+            self._report(queries, before, after)
+        finally:
+            connections[ALIAS].close()
+            if not options['keep'] and db_path.exists():
+                db_path.unlink()
+
+    def _seed(self, rows, customer_count):
+        rng = random.Random(42)
+        now = timezone.now()
+        users = User.objects.using(ALIAS).bulk_create(
+            [User(username=f'bench{i}', password='!') for i in range(customer_count)],
+            batch_size=5000
+        )
+        customers = Customer.objects.using(ALIAS).bulk_create(
+            [Customer(user=user, risk_score=rng.random(), created_at=now) for user in users],
+            batch_size=5000
+        )
+        customer_ids = [customer.id for customer in customers]
+
+        connection = connections[ALIAS]
+        ops = connection.ops
+        types = ['deposit', 'withdrawal', 'transfer', 'payment']
+        statuses = ['cleared'] * 90 + ['pending'] * 7 + ['flagged'] * 3
+        table = Transaction._meta.db_table
+        insert = (
+            f'INSERT INTO {table} (customer_id, amount, timestamp, transaction_type, risk_score, '
+            f'is_suspicious, source_country, destination_country, reference, screening_status) '
+            f'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+        )
+        batch_size = 50_000
+        with connection.cursor() as cursor:
+            for offset in range(0, rows, batch_size):
+                batch = []
+                for _ in range(min(batch_size, rows - offset)):
+                    timestamp = now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+                    batch.append((
+                        rng.choice(customer_ids),
+                        f'{rng.lognormvariate(6, 1.5):.2f}',
+                        ops.adapt_datetimefield_value(timestamp),
+                        rng.choice(types),
+                        0.0,
+                        rng.random() < 0.02,
+                        'GB', 'GB', None,
+                        rng.choice(statuses),
+                    ))
+                cursor.executemany(insert, batch)
+
+        RiskAssessment.objects.using(ALIAS).bulk_create([
+            RiskAssessment(
+                customer_id=rng.choice(customer_ids),
+                risk_factors={},
+                overall_score=rng.random(),
+                recommendations='',
+                assessment_type='periodic',
+            ) for _ in range(rows // 10)
+        ], batch_size=5000)
+        # Spread assessment dates over the year (auto_now_add sets them all to now)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {RiskAssessment._meta.db_table} "
+                f"SET assessment_date = datetime(assessment_date, '-' || (abs(random()) % 365) || ' days')"
+            )
+
+    def _queries(self):
+        now = timezone.now()
+        transactions = Transaction.objects.using(ALIAS)
+        assessments = RiskAssessment.objects.using(ALIAS)
+        customer_id = Customer.objects.using(ALIAS).order_by('id').values_list('id', flat=True)[
+            Customer.objects.using(ALIAS).count() // 2]
+        return [
+            ('customer 7-day window',
+             transactions.filter(customer_id=customer_id, timestamp__gte=now - timedelta(days=7))
+             .values_list('amount', flat=True), list),
+            ('suspicious in last 30 days',
+             transactions.filter(is_suspicious=True, timestamp__gte=now - timedelta(days=30)),
+             lambda queryset: queryset.count()),
+            ('pending screening in last 30 days',
+             transactions.filter(screening_status='pending', timestamp__gte=now - timedelta(days=30)),
+             lambda queryset: queryset.count()),
+            ('latest 50 transactions',
+             transactions.order_by('-timestamp', '-id')[:50], list),
+            ('latest assessment for customer',
+             assessments.filter(customer_id=customer_id).order_by('-assessment_date')[:1], list),
+            ('recent assessments',
+             assessments.filter(assessment_date__gte=now - timedelta(days=30))
+             .order_by('-assessment_date')[:5], list),
+        ]
+
+    def _measure(self, queries, repeat):
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute('ANALYZE')
+        results = []
+        for _, queryset, run in queries:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            results.append((statistics.median(timings), queryset.explain()))
+        return results
+
+    def _report(self, queries, before, after):
+        for (name, _, _), (before_ms, before_plan), (after_ms, after_plan) in zip(queries, before, after):
+            speedup = before_ms / after_ms if after_ms else float('inf')
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f'  before: {before_ms:9.2f} ms  {" | ".join(before_plan.splitlines())}')
+            self.stdout.write(f'  after:  {after_ms:9.2f} ms  {" | ".join(after_plan.splitlines())}')
+            self.stdout.write(f'  speedup: {speedup:.1f}x\n')
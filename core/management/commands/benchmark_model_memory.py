@@ -0,0 +1,149 @@
+"""Report resident memory per worker process serving the anomaly detector.
+
+Forks ``--workers`` processes that each load the detector and score a
+batch, the way web or scoring workers do, and reads their memory from
+``/proc/<pid>/smaps_rollup`` while all of them hold the model. Three ways
+of serving the same forest are compared:
+
+- ``pickle``: the fitted ``IsolationForest`` unpickled in every worker,
+  as artifacts were served before forests were flattened;
+- ``mmap``: the flattened forest memory-mapped by every worker;
+- ``mmap, preloaded``: the flattened forest loaded once in the parent
+  before forking, as ``gunicorn --preload`` does with ``MODEL_PRELOAD``.
+
+``RSS`` counts shared pages in full, ``PSS`` divides them between the
+processes sharing them and ``private`` is memory only that worker holds.
+Only Linux exposes these figures.
+"""
+import multiprocessing
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core.ml_models import TransactionAnomalyDetector
+
+SMAPS_FIELDS = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'private', 'Private_Dirty': 'private'}
+
+
+def memory():
+    """This process's memory in MiB, from ``/proc/self/smaps_rollup``."""
+    usage = dict.fromkeys(SMAPS_FIELDS.values(), 0.0)
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            field, _, value = line.partition(':')
+            if field in SMAPS_FIELDS:
+                usage[SMAPS_FIELDS[field]] += int(value.split()[0]) / 1024
+    return usage
+
+
+def _legacy_scorer(path):
+    artifact = joblib.load(path)
+    forest, scaler = artifact['isolation_forest'], artifact['scaler']
+    return lambda features: -forest.score_samples(scaler.transform(features))
+
+
+def _mmap_scorer(path):
+    return TransactionAnomalyDetector.load(path).anomaly_scores
+
+
+def _serve(load, path, features, barrier, results):
+    """Worker: load the model (unless inherited), score, report memory once every worker has."""
+    before = memory()
+    started = time.perf_counter()
+    score = load(path) if load else _inherited
+    load_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    score(features)
+    score_seconds = time.perf_counter() - started
+    barrier.wait()
+    after = memory()
+    results.put({
+        'load_ms': load_seconds * 1000,
+        'score_ms': score_seconds * 1000,
+        'model_private': after['private'] - before['private'],
+        **after,
+    })
+    barrier.wait()
+
+
+_inherited = None
+
+
+class Command(BaseCommand):
+    help = 'Compare resident memory per worker of pickled and memory-mapped anomaly detectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--estimators', type=int, default=200, help='Trees in the synthetic forest')
+        parser.add_argument('--max-samples', type=int, default=8192,
+                            help='Rows each synthetic tree is grown on')
+        parser.add_argument('--batch', type=int, default=256, help='Rows each worker scores')
+
+    def handle(self, *args, **options):
+        global _inherited
+        if not Path('/proc/self/smaps_rollup').exists():
+            raise CommandError('Per-process memory figures need Linux (/proc/self/smaps_rollup)')
+        rng = np.random.default_rng(42)
+        rows = max(options['max_samples'] * 4, 10000)
+        features = np.column_stack([
+            rng.lognormal(5, 1.5, rows), rng.random(rows), rng.integers(0, 500, rows)
+        ])
+        detector = TransactionAnomalyDetector()
+        detector.isolation_forest.set_params(n_estimators=options['estimators'],
+                                             max_samples=options['max_samples'])
+        started = time.perf_counter()
+        detector.fit(features)
+        self.stdout.write(
+            f'Fitted {options["estimators"]} trees on {options["max_samples"]} rows each in '
+            f'{time.perf_counter() - started:.1f}s; flattened forest {detector.forest.nbytes / 2 ** 20:.1f} MiB'
+        )
+        batch = features[:options['batch']]
+
+        with tempfile.TemporaryDirectory() as directory:
+            legacy = Path(directory) / 'legacy.joblib'
+            joblib.dump({'scaler': detector.scaler, 'isolation_forest': detector.isolation_forest}, legacy)
+            flat = detector.save(directory)
+            del detector
+            for label, path in (('pickle', legacy), ('mmap', flat)):
+                self.stdout.write(f'  {label} artifact {path.stat().st_size / 2 ** 20:.1f} MiB')
+
+            self.stdout.write(f'{"serving":18} {"load ms":>8} {"score ms":>9} {"RSS MiB":>8} '
+                              f'{"PSS MiB":>8} {"private":>8} {"model private":>14}')
+            for label, load, path, preload in (
+                ('pickle', _legacy_scorer, legacy, False),
+                ('mmap', _mmap_scorer, flat, False),
+                ('mmap, preloaded', None, flat, True),
+            ):
+                _inherited = _mmap_scorer(flat) if preload else None
+                if preload:
+                    _inherited(batch)
+                results = self._run_workers(load, path, batch, options['workers'])
+                self.stdout.write(f'{label:18} ' + ' '.join(
+                    f'{statistics.mean(result[key] for result in results):{width}.1f}'
+                    for key, width in (('load_ms', 8), ('score_ms', 9), ('rss', 8), ('pss', 8),
+                                       ('private', 8), ('model_private', 14))
+                ))
+                _inherited = None
+
+    def _run_workers(self, load, path, features, workers):
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        processes = [
+            context.Process(target=_serve, args=(load, path, features, barrier, results))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        return collected
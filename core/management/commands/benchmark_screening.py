@@ -0,0 +1,117 @@
+"""Benchmark fuzzy name screening against a large synthetic watchlist.
+
+Builds a :class:`NameIndex` over generated names and queries it with
+misspelt, reordered and accented variants of listed names plus names that
+are not listed. Prints the build time, the latency of candidate
+generation and of a full ranked match, how many listed variants were
+found, and the cost of scoring every entry without the index.
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.screening import PEP, SANCTIONED, NameIndex, WatchlistEntry, name_grams
+
+ONSETS = ['', 'b', 'ch', 'd', 'f', 'g', 'h', 'j', 'k', 'kh', 'l', 'm', 'n', 'p', 'r', 's', 'sh',
+          't', 'v', 'w', 'y', 'z']
+VOWELS = ['a', 'e', 'i', 'o', 'u', 'ai', 'ei', 'ou']
+CODAS = ['', '', 'd', 'k', 'l', 'm', 'n', 'r', 's', 'v']
+ACCENTS = str.maketrans('aeiou', 'áéíóú')
+
+
+class Command(BaseCommand):
+    help = 'Measure candidate generation and ranking latency of fuzzy name screening'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=300_000, help='Watchlist size')
+        parser.add_argument('--queries', type=int, default=2000, help='Names screened')
+        parser.add_argument('--threshold', type=float, default=0.8,
+                            help='Minimum similarity of a match')
+        parser.add_argument('--baseline-queries', type=int, default=20,
+                            help='Names scored against every entry without the index')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        threshold = options['threshold']
+        # Names repeat the way real ones do: a few thousand common given
+        # names and a long tail of surnames
+        self.given = [self._word(rng) for _ in range(3000)]
+        self.surnames = [self._word(rng) for _ in range(max(options['entries'] // 5, 1000))]
+        entries = [
+            WatchlistEntry(f'WL-{i}', self._name(rng), rng.choice([SANCTIONED, PEP]), None)
+            for i in range(options['entries'])
+        ]
+        started = time.perf_counter()
+        index = NameIndex(entries)
+        self.stdout.write(f'Indexed {len(entries)} names in {time.perf_counter() - started:.2f}s')
+
+        queries = []
+        for i in range(options['queries']):
+            if i % 2:
+                queries.append((self._name(rng), None))
+            else:
+                entry = rng.choice(entries)
+                queries.append((self._variant(rng, entry.name), entry))
+
+        candidate_times, match_times, candidate_counts = [], [], []
+        found = listed = 0
+        for name, entry in queries:
+            grams = name_grams(name)
+            started = time.perf_counter()
+            candidates = index.candidates(grams, threshold)
+            candidate_times.append(time.perf_counter() - started)
+            candidate_counts.append(len(candidates))
+
+            started = time.perf_counter()
+            matches = index.match(name, threshold)
+            match_times.append(time.perf_counter() - started)
+            if entry is not None:
+                listed += 1
+                found += any(match.id == entry.id for match, _ in matches)
+
+        self._latency('candidates', candidate_times)
+        self._latency('match', match_times)
+        self.stdout.write(f'  {statistics.mean(candidate_counts):.0f} candidates per name on average; '
+                          f'{found}/{listed} listed variants matched at {threshold}')
+
+        sample = queries[:options['baseline_queries']]
+        if sample:
+            entry_grams = [name_grams(entry.name) for entry in entries]
+            started = time.perf_counter()
+            for name, _ in sample:
+                grams = name_grams(name)
+                [2 * len(grams & other) / (len(grams) + len(other)) for other in entry_grams]
+            per_query = (time.perf_counter() - started) / len(sample)
+            self.stdout.write(f'full scan   {per_query * 1000:8.2f} ms/name, '
+                              f'{per_query / statistics.median(match_times):.0f}x the indexed median')
+
+    def _latency(self, label, timings):
+        timings = sorted(timings)
+        self.stdout.write(
+            f'{label:11} median {statistics.median(timings) * 1e6:7.1f} us, '
+            f'p99 {timings[int(len(timings) * 0.99)] * 1e6:7.1f} us'
+        )
+
+    def _word(self, rng):
+        return ''.join(
+            rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(CODAS)
+            for _ in range(rng.randint(2, 3))
+        ).title()
+
+    def _name(self, rng):
+        given = [self.given[min(int(rng.paretovariate(1.2)) - 1, len(self.given) - 1)]
+                 for _ in range(rng.choice([1, 1, 2]))]
+        return ' '.join([*given, rng.choice(self.surnames)])
+
+    def _variant(self, rng, name):
+        """A misspelt, reordered or accented spelling of ``name``."""
+        kind = rng.choice(['typo', 'order', 'accents'])
+        if kind == 'order':
+            words = name.split()
+            return ', '.join([words[-1].upper(), *words[:-1]])
+        if kind == 'accents':
+            return name.translate(ACCENTS)
+        position = rng.randrange(1, len(name) - 1)
+        return name[:position] + rng.choice('aeiou') + name[position + 1:]
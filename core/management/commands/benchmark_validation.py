@@ -0,0 +1,93 @@
+"""Benchmark per-row and batch validation of transaction rows.
+
+Generates synthetic bulk-upload rows, a share of them invalid, and
+validates them three ways: a DRF serializer plus a ``TransactionData``
+per row (how the bulk endpoint used to validate), one ``TransactionData``
+call per row, and the compiled list adapter behind
+``validate_transactions``. Prints the median cost per row of each.
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from pydantic import ValidationError
+from rest_framework import serializers
+
+from core.validators import TRANSACTION_TYPES, TransactionData, validate_transactions
+
+class RowSerializer(serializers.Serializer):
+    customer = serializers.IntegerField(min_value=1)
+    amount = serializers.DecimalField(max_digits=15, decimal_places=2)
+    transaction_type = serializers.CharField(max_length=50)
+    description = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+
+class Command(BaseCommand):
+    help = 'Compare per-row and batch validation cost of transaction rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000, help='Rows per batch')
+        parser.add_argument('--invalid', type=float, default=0.05,
+                            help='Share of rows that break a rule')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per strategy; the median is reported')
+
+    def handle(self, *args, **options):
+        rows = self._rows(options['rows'], options['invalid'])
+        strategies = [
+            ('serializer', self._serializer),
+            ('per row', self._per_row),
+            ('batch', lambda rows: validate_transactions(rows)[0]),
+        ]
+        results = []
+        for name, validate in strategies:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                valid = validate(rows)
+                timings.append(time.perf_counter() - started)
+            results.append((name, statistics.median(timings), len(valid)))
+
+        baseline = results[0][1]
+        for name, seconds, valid in results:
+            self.stdout.write(
+                f'{name:10} {seconds * 1e6 / len(rows):8.2f} us/row  {seconds * 1000:9.2f} ms  '
+                f'{valid} valid  {baseline / seconds:.1f}x'
+            )
+
+    def _serializer(self, rows):
+        valid = []
+        for index, row in enumerate(rows):
+            serializer = RowSerializer(data=row)
+            if not serializer.is_valid():
+                continue
+            try:
+                valid.append((index, TransactionData.model_validate(serializer.validated_data)))
+            except ValidationError:
+                continue
+        return valid
+
+    def _per_row(self, rows):
+        valid = []
+        for index, row in enumerate(rows):
+            try:
+                valid.append((index, TransactionData.model_validate(row)))
+            except ValidationError:
+                continue
+        return valid
+
+    def _rows(self, count, invalid):
+        rng = random.Random(42)
+        types = sorted(TRANSACTION_TYPES)
+        rows = []
+        for _ in range(count):
+            row = {
+                'customer': rng.randrange(1, 10_000),
+                'amount': f'{rng.lognormvariate(6, 1.5):.2f}',
+                'transaction_type': rng.choice(types).title(),
+                'description': None,
+            }
+            if rng.random() < invalid:
+                row[rng.choice(['amount', 'transaction_type', 'customer'])] = rng.choice(['-1', 'swap', 0])
+            rows.append(row)
+        return rows
@@ -0,0 +1,265 @@
+"""Bulk import historical transactions from a CSV or JSON-lines file."""
+import csv
+import json
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.aggregates import record_transactions
+from core.dashboard import invalidate_dashboard_metrics
+from core.exports import invalidate_export
+from core.features import feature_store
+from core.models import Customer, Transaction, TransactionFeatures
+from core.scoring import enqueue_scoring, score_transactions
+from core.validators import validate_transaction_frame
+
+REQUIRED_COLUMNS = ('customer', 'amount', 'transaction_type')
+OPTIONAL_COLUMNS = ('timestamp', 'source_country', 'destination_country', 'reference')
+
+# Rows scored per model call; keeps id lists well inside SQLite's parameter limit
+SCORING_SLICE = 10000
+
+
+class Command(BaseCommand):
+    help = 'Stream transactions from a CSV or JSON-lines file into the database in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import (.csv, .jsonl or .ndjson)')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], dest='fmt',
+                            help='File format (defaults to the file extension)')
+        parser.add_argument('--customer-key', choices=['id', 'username'], default='id',
+                            help='What the customer column refers to')
+        parser.add_argument('--batch-size', type=int, default=20000,
+                            help='Rows validated and committed per database transaction')
+        parser.add_argument('--defer-scoring', action='store_true',
+                            help='Queue imported rows for the scoring workers instead of scoring inline')
+        parser.add_argument('--rejects', help='Write rejected rows and their errors to this file')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'{path} does not exist')
+        fmt = options['fmt'] or ('csv' if path.suffix.lower() == '.csv' else 'jsonl')
+        self.defer_scoring = options['defer_scoring']
+        self.customers = self._customer_map(options['customer_key'])
+        self.timings = dict.fromkeys(('validate', 'insert', 'record', 'score'), 0.0)
+        self.first_id = self.last_id = None
+        # Customers whose history this import has inserted rows into out of order
+        self.backdated = set()
+
+        if fmt == 'csv':
+            chunks = pd.read_csv(path, chunksize=options['batch_size'], dtype=str,
+                                 keep_default_na=False)
+        else:
+            chunks = pd.read_json(path, lines=True, chunksize=options['batch_size'], dtype=False)
+
+        started = time.perf_counter()
+        imported = rejected = 0
+        rejects = RejectsWriter(options['rejects'], fmt)
+        try:
+            with chunks:
+                for chunk in chunks:
+                    missing = [column for column in REQUIRED_COLUMNS if column not in chunk]
+                    if missing:
+                        raise CommandError(f'Missing columns: {", ".join(missing)}')
+                    valid, errors = self._validate(chunk)
+                    rejects.write(chunk, errors)
+                    rejected += len(errors)
+                    if len(valid):
+                        self._import(valid)
+                        imported += len(valid)
+                    if options['verbosity'] >= 2:
+                        self._report(imported, rejected, started)
+        finally:
+            rejects.close()
+        if self.backdated:
+            self._settle_backdated()
+        if imported:
+            invalidate_dashboard_metrics()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} transactions ({rejected} rejected) in {elapsed:.1f}s, '
+            f'{imported / max(elapsed, 1e-9):,.0f} rows/s'
+        ))
+        self.stdout.write('  ' + ', '.join(
+            f'{stage} {seconds:.1f}s' for stage, seconds in self.timings.items()
+        ))
+        if self.backdated:
+            self.stdout.write(f'  rebuilt features of {len(self.backdated)} customers '
+                              f'with backdated transactions')
+
+    def _customer_map(self, key):
+        # One query up front; rows are resolved against it with a vectorised lookup
+        if key == 'username':
+            return dict(Customer.objects.values_list('user__username', 'id'))
+        return {str(pk): pk for pk in Customer.objects.values_list('id', flat=True)}
+
+    def _validate(self, chunk):
+        started = time.perf_counter()
+        amounts, transaction_types, errors = validate_transaction_frame(chunk)
+        errors = errors.where(errors != '', np.where(
+            ((amounts * 100).round(6) % 1).fillna(0) != 0,
+            'Ensure that there are no more than 2 decimal places.', '',
+        ))
+
+        customer_keys = chunk['customer'].astype(str).str.strip()
+        customer_ids = customer_keys.map(self.customers)
+        errors = errors.where(
+            errors != '', np.where(customer_ids.isna(), 'Customer ' + customer_keys + ' does not exist', '')
+        )
+
+        if 'timestamp' in chunk:
+            timestamps = pd.to_datetime(chunk['timestamp'], utc=True, errors='coerce', format='ISO8601')
+            now = timezone.now()
+            errors = errors.where(errors != '', np.select(
+                [timestamps.isna(), timestamps > now],
+                ['Timestamp must be an ISO 8601 datetime', 'Timestamp is in the future'],
+                default='',
+            ))
+        else:
+            timestamps = pd.Series(timezone.now(), index=chunk.index)
+
+        countries = {}
+        for column in ('source_country', 'destination_country'):
+            if column in chunk:
+                codes = chunk[column].astype(str).str.strip().str.upper().replace('', 'GB')
+                errors = errors.where(errors != '', np.where(
+                    codes.str.fullmatch('[A-Z]{2}'), '', f'{column} must be a two-letter country code'
+                ))
+            else:
+                codes = pd.Series('GB', index=chunk.index)
+            countries[column] = codes
+        references = (chunk['reference'].astype(str).str.strip().replace('', None)
+                      if 'reference' in chunk else pd.Series(None, index=chunk.index, dtype=object))
+        errors = errors.where(errors != '', np.where(
+            references.fillna('').str.len() > 100, 'reference must be at most 100 characters', ''
+        ))
+
+        ok = (errors == '').to_numpy()
+        valid = pd.DataFrame({
+            'customer_id': customer_ids[ok].astype(int),
+            'amount': amounts[ok],
+            'transaction_type': transaction_types[ok],
+            'timestamp': timestamps[ok],
+            'source_country': countries['source_country'][ok],
+            'destination_country': countries['destination_country'][ok],
+            'reference': references[ok],
+        }).sort_values('timestamp', kind='stable')
+        self.timings['validate'] += time.perf_counter() - started
+        return valid, errors[~ok]
+
+    def _import(self, valid):
+        customer_ids = valid['customer_id'].unique().tolist()
+        # Features are materialised incrementally in timestamp order; rows older
+        # than what a customer already has need that customer's features replayed
+        latest = dict(
+            TransactionFeatures.objects.filter(customer_id__in=customer_ids)
+            .values('customer_id').annotate(last=Max('as_of')).values_list('customer_id', 'last')
+        )
+        firsts = valid.groupby('customer_id')['timestamp'].min()
+        self.backdated.update(
+            customer_id for customer_id, first in firsts.items()
+            if customer_id in latest and first < latest[customer_id]
+        )
+
+        started = time.perf_counter()
+        customers = Customer.objects.in_bulk(customer_ids)
+        rows = [
+            Transaction(
+                customer=customers[customer_id],
+                amount=Decimal(f'{amount:.2f}'),
+                transaction_type=transaction_type,
+                timestamp=timestamp.to_pydatetime(),
+                source_country=source_country,
+                destination_country=destination_country,
+                reference=reference,
+            )
+            for customer_id, amount, transaction_type, timestamp, source_country,
+                destination_country, reference in valid.itertuples(index=False)
+        ]
+        with db_transaction.atomic():
+            transactions = Transaction.objects.bulk_create(rows)
+            self.timings['insert'] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            record_transactions(transactions)
+            self.timings['record'] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            current = [t for t in transactions if t.customer_id not in self.backdated]
+            if self.defer_scoring:
+                enqueue_scoring(current)
+            else:
+                for i in range(0, len(current), SCORING_SLICE):
+                    score_transactions(current[i:i + SCORING_SLICE])
+            self.timings['score'] += time.perf_counter() - started
+
+        self.first_id = self.first_id or transactions[0].id
+        self.last_id = transactions[-1].id
+
+    def _settle_backdated(self):
+        """Replay the features of backdated customers, then score their imported rows."""
+        started = time.perf_counter()
+        feature_store.rebuild(sorted(self.backdated))
+        invalidate_export('features')
+        self.timings['record'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        imported = (
+            Transaction.objects.select_related('customer')
+            .filter(customer_id__in=self.backdated, id__range=(self.first_id, self.last_id))
+            .order_by('id')
+        )
+        last = 0
+        while True:
+            batch = list(imported.filter(id__gt=last)[:SCORING_SLICE])
+            if not batch:
+                break
+            with db_transaction.atomic():
+                if self.defer_scoring:
+                    enqueue_scoring(batch)
+                else:
+                    score_transactions(batch)
+            last = batch[-1].id
+        self.timings['score'] += time.perf_counter() - started
+
+    def _report(self, imported, rejected, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{imported} imported, {rejected} rejected, '
+                          f'{imported / max(elapsed, 1e-9):,.0f} rows/s')
+
+
+class RejectsWriter:
+    """Write rejected rows with their file row number and error, in the input format."""
+
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        self.file = open(path, 'w', newline='') if path else None
+        self.writer = None
+
+    def write(self, chunk, errors):
+        if self.file is None or errors.empty:
+            return
+        rows = chunk.loc[errors.index]
+        if self.fmt == 'jsonl':
+            for (index, row), error in zip(rows.iterrows(), errors):
+                record = {'row': index + 1, 'error': error, **row.to_dict()}
+                self.file.write(json.dumps(record, default=str) + '\n')
+            return
+        if self.writer is None:
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['row', 'error', *chunk.columns])
+        for (index, row), error in zip(rows.iterrows(), errors):
+            self.writer.writerow([index + 1, error, *row])
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
@@ -0,0 +1,85 @@
+"""Inspect and roll out registered model versions."""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ml_models import RiskScorer
+from core.models import ModelVersion
+from core.registry import MODEL_CLASSES, RISK_SCORER, promote, register, retire, start_shadow
+
+
+class Command(BaseCommand):
+    help = 'List, promote, shadow or retire model versions, or register new risk scorer weights'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action',
+                            choices=['list', 'promote', 'shadow', 'retire', 'register-risk-scorer'])
+        parser.add_argument('name', nargs='?', choices=sorted(MODEL_CLASSES),
+                            help='Model name (all models for list)')
+        parser.add_argument('version', nargs='?', help='Version to promote, shadow or retire')
+        parser.add_argument('--status', default=ModelVersion.CANDIDATE,
+                            choices=[ModelVersion.CANDIDATE, ModelVersion.SHADOW,
+                                     ModelVersion.PRODUCTION],
+                            help='Rollout status of newly registered risk scorer weights')
+        for weight in RiskScorer.DEFAULT_WEIGHTS:
+            parser.add_argument(f'--{weight.replace("_", "-")}-weight', type=float, dest=weight,
+                                help=f'Risk scorer weight of the {weight} factor')
+        parser.add_argument('--frequency-scale', type=float, default=10,
+                            help='Transactions a day at which the frequency factor saturates')
+        parser.add_argument('--amount-scale', type=float, default=10000,
+                            help='Mean amount at which the amount factor saturates')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'list':
+            self._list(options['name'])
+            return
+        if action == 'register-risk-scorer':
+            self._register_risk_scorer(options)
+            return
+
+        name, version = options['name'], options['version']
+        if not name or not version:
+            raise CommandError(f'{action} needs a model name and version')
+        try:
+            if action == 'promote':
+                promote(name, version)
+            elif action == 'shadow':
+                start_shadow(name, version)
+            else:
+                retire(name, version)
+        except ModelVersion.DoesNotExist:
+            raise CommandError(f'No registered version {version} of {name}')
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'{name} {version}: {action} done; workers pick it up within '
+            f'MODEL_REGISTRY_POLL_SECONDS'
+        ))
+
+    def _list(self, name):
+        versions = ModelVersion.objects.all()
+        if name:
+            versions = versions.filter(name=name)
+        for v in versions:
+            line = f'{v.name:<18} {v.version:<16} {v.status:<11} {v.artifact}'
+            if v.shadow_rows:
+                line += (f'  shadow: {v.shadow_rows} rows, '
+                         f'{v.disagreement_rate:.2%} disagree, '
+                         f'mean |diff| {v.mean_abs_diff:.4f}')
+            self.stdout.write(line)
+
+    def _register_risk_scorer(self, options):
+        weights = {
+            weight: options[weight] for weight in RiskScorer.DEFAULT_WEIGHTS
+            if options[weight] is not None
+        }
+        scorer = RiskScorer(weights=weights, frequency_scale=options['frequency_scale'],
+                            amount_scale=options['amount_scale'])
+        path = scorer.save()
+        model_version = register(RISK_SCORER, scorer, path, metrics={
+            'weights': scorer.weights,
+            'frequency_scale': scorer.frequency_scale,
+            'amount_scale': scorer.amount_scale,
+        }, status=options['status'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Registered {RISK_SCORER} {scorer.version} ({model_version.status}) -> {path}'
+        ))
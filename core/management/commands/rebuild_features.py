@@ -0,0 +1,26 @@
+"""Recompute point-in-time transaction features from the raw history."""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.exports import invalidate_export
+from core.features import feature_store
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the feature store from transaction history (e.g. after backdated imports)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer', type=int, action='append', dest='customers',
+                            help='Only rebuild this customer (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rows = feature_store.rebuild(options['customers'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt features for {rows} transactions in {time.perf_counter() - started:.2f}s'
+        ))
+        # Exported feature rows may no longer match the store
+        if invalidate_export('features'):
+            self.stdout.write('The features export is out of date; run "manage.py export_data features" '
+                              'before training from it')
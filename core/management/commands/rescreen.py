@@ -0,0 +1,41 @@
+"""Rescreen every customer and transaction against the screening lists."""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.screening import ScreeningIndex, rescreen_book, screening_lists
+
+
+class Command(BaseCommand):
+    help = 'Apply the current screening lists to every customer and transaction on the book'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lists', help='Screen against this lists file instead of SCREENING_LISTS_PATH')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Rows screened per query and database transaction')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes screening customer names (1 screens in-process)')
+
+    def handle(self, *args, **options):
+        try:
+            index = (ScreeningIndex.load(options['lists']) if options['lists']
+                     else screening_lists.reload())
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not load screening lists: {e}')
+
+        started = time.perf_counter()
+        counts = rescreen_book(index, chunk_size=options['chunk_size'], workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rescreened {counts["customers"]} customers and {counts["transactions"]} transactions '
+            f'touching {len(index.jurisdictions)} listed jurisdictions against lists {index.version} '
+            f'({len(index.watchlist)} watchlist entries) '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
+        self.stdout.write(
+            f'  {counts["customer_hits"]} customers with hits '
+            f'({counts["watchlist_reviews"]} new watchlist reviews), '
+            f'{counts["transaction_hits"]} transactions with hits, '
+            f'{counts["transactions_blocked"]} blocked, '
+            f'{counts["transactions_flagged"]} flagged'
+        )
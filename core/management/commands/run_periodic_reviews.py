@@ -0,0 +1,105 @@
+"""Run periodic risk reviews for every customer that is due one."""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from core.reviews import due_customer_ids, review_chunk, save_reviews
+
+
+class Command(BaseCommand):
+    help = 'Score every customer due for a periodic review and schedule their next review'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes scoring chunks (1 scores in-process)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Customers scored per bulk query')
+        parser.add_argument('--limit', type=int, help='Review at most this many customers')
+        parser.add_argument('--checkpoint',
+                            help='Checkpoint file (defaults to PERIODIC_REVIEW_CHECKPOINT)')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore an existing checkpoint and start a new run')
+
+    def handle(self, *args, **options):
+        checkpoint = Path(options['checkpoint'] or settings.PERIODIC_REVIEW_CHECKPOINT)
+        if checkpoint.exists() and not options['restart']:
+            state = json.loads(checkpoint.read_text())
+            self.stdout.write(
+                f'Resuming run as of {state["as_of"]} '
+                f'({state["reviewed"]} customers already reviewed)'
+            )
+        else:
+            state = {'as_of': timezone.now().isoformat(), 'reviewed': 0,
+                     'transactions': 0, 'elapsed': 0.0}
+        as_of = datetime.fromisoformat(state['as_of'])
+
+        # Customers reviewed before a crash are no longer due at the
+        # checkpointed as-of time, so resuming only picks up the rest
+        customer_ids = due_customer_ids(as_of)[:options['limit']]
+        if not customer_ids:
+            self.stdout.write('No customers are due for review')
+            checkpoint.unlink(missing_ok=True)
+            return
+        chunk_size = options['chunk_size']
+        chunks = [customer_ids[i:i + chunk_size] for i in range(0, len(customer_ids), chunk_size)]
+        self.stdout.write(f'Reviewing {len(customer_ids)} customers in {len(chunks)} chunks '
+                          f'with {options["workers"]} workers')
+        self._write_checkpoint(checkpoint, state)
+
+        started = time.perf_counter()
+        reviewed = 0
+        for results, transaction_count in self._score(chunks, as_of, options['workers']):
+            # Scoring runs in the workers; the parent is the only writer
+            save_reviews(results, as_of)
+            reviewed += len(results)
+            state['reviewed'] += len(results)
+            state['transactions'] += transaction_count
+            elapsed = time.perf_counter() - started
+            self._write_checkpoint(checkpoint, {**state, 'elapsed': state['elapsed'] + elapsed})
+            self.stdout.write(
+                f'  {reviewed}/{len(customer_ids)} customers '
+                f'({reviewed / elapsed:.0f} customers/s)'
+            )
+
+        state['elapsed'] += time.perf_counter() - started
+        checkpoint.unlink(missing_ok=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Reviewed {state["reviewed"]} customers ({state["transactions"]} transactions) '
+            f'in {state["elapsed"]:.2f}s: '
+            f'{state["reviewed"] / state["elapsed"]:.0f} customers/s, '
+            f'{state["transactions"] / state["elapsed"]:.0f} transactions/s'
+        ))
+
+    def _score(self, chunks, as_of, workers):
+        if workers <= 1:
+            for chunk in chunks:
+                yield review_chunk(chunk, as_of)
+            return
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = [executor.submit(review_chunk, chunk, as_of) for chunk in chunks]
+            for future in as_completed(futures):
+                yield future.result()
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise CommandError('Interrupted; run the command again to resume')
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def _write_checkpoint(self, path, state):
+        # Write-then-rename so a crash never leaves a truncated checkpoint
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(state))
+        os.replace(temporary, path)
@@ -0,0 +1,45 @@
+"""Score transactions queued by the API in async scoring mode."""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.inference import MicroBatcher, get_anomaly_scorer
+from core.scoring import ScoringWorkerPool, pending_job_count
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of workers that score queued transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Worker threads (defaults to SCORING_WORKERS)')
+        parser.add_argument('--batch-size', type=int,
+                            help='Jobs claimed per batch (defaults to SCORING_BATCH_SIZE)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue has been drained instead of polling')
+
+    def handle(self, *args, **options):
+        pool = ScoringWorkerPool(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        )
+        self.stdout.write(f'Starting {pool.workers} scoring workers '
+                          f'({pending_job_count()} jobs pending)')
+
+        started = time.perf_counter()
+        processed = pool.run(drain=options['once'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} jobs in {elapsed:.2f}s '
+            f'({processed / elapsed if elapsed else 0:.0f} jobs/s)'
+        ))
+        scorer = get_anomaly_scorer()
+        if isinstance(scorer, MicroBatcher) and scorer.metrics.batches:
+            metrics = scorer.metrics.snapshot()
+            self.stdout.write(
+                f'Model calls: {metrics["batches"]} batches, '
+                f'{metrics["mean_batch_rows"]:.1f} rows/batch on average, '
+                f'queue wait p95 {metrics["p95_queue_wait_ms"]:.2f}ms'
+            )
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.7 on 2026-10-16 20:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, Q, Sum
+
+
+def backfill_transaction_stats(apps, schema_editor):
+    Transaction = apps.get_model('core', 'Transaction')
+    CustomerTransactionStats = apps.get_model('core', 'CustomerTransactionStats')
+    rows = Transaction.objects.values('customer_id').annotate(
+        count=Count('id'),
+        total=Sum('amount'),
+        squares=Sum(F('amount') * F('amount'), output_field=models.FloatField()),
+        suspicious=Count('id', filter=Q(is_suspicious=True)),
+        first=Min('timestamp'),
+        last=Max('timestamp'),
+    )
+    CustomerTransactionStats.objects.bulk_create([
+        CustomerTransactionStats(
+            customer_id=row['customer_id'],
+            transaction_count=row['count'],
+            total_amount=row['total'],
+            sum_of_squares=row['squares'],
+            suspicious_count=row['suspicious'],
+            first_transaction_at=row['first'],
+            last_transaction_at=row['last'],
+        ) for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_alter_riskassessment_options_customer_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerTransactionStats',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='transaction_stats', serialize=False, to='core.customer')),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('sum_of_squares', models.FloatField(default=0.0)),
+                ('suspicious_count', models.PositiveIntegerField(default=0)),
+                ('first_transaction_at', models.DateTimeField(null=True)),
+                ('last_transaction_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_transaction_stats, migrations.RunPython.noop),
+    ]
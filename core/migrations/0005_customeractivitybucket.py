@@ -0,0 +1,57 @@
+# Generated by Django 5.1.7 on 2026-10-16 20:48
+
+import django.db.models.deletion
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+# AML_ACTIVITY_HORIZON_HOURS when this migration was written. Migrations must
+# not depend on settings that can change after they have run.
+ACTIVITY_HORIZON_HOURS = 31 * 24
+
+
+def backfill_activity_buckets(apps, schema_editor):
+    Transaction = apps.get_model('core', 'Transaction')
+    CustomerActivityBucket = apps.get_model('core', 'CustomerActivityBucket')
+    horizon_start = timezone.now() - timedelta(hours=ACTIVITY_HORIZON_HOURS)
+    rows = Transaction.objects.filter(timestamp__gte=horizon_start).annotate(
+        bucket_start=TruncHour('timestamp')
+    ).values('customer_id', 'bucket_start').annotate(
+        count=Count('id'),
+        total=Sum('amount'),
+    )
+    CustomerActivityBucket.objects.bulk_create([
+        CustomerActivityBucket(
+            customer_id=row['customer_id'],
+            bucket_start=row['bucket_start'],
+            transaction_count=row['count'],
+            total_amount=row['total'],
+        ) for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_customertransactionstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerActivityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.customer')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('customer', 'bucket_start'), name='unique_customer_activity_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_activity_buckets, migrations.RunPython.noop),
+    ]
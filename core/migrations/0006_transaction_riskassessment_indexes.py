@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-16 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_customeractivitybucket'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='riskassessment',
+            index=models.Index(fields=['customer', 'assessment_date'], name='assessment_customer_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='riskassessment',
+            index=models.Index(fields=['assessment_date'], name='assessment_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['customer', 'timestamp'], name='txn_customer_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['timestamp', 'id'], name='txn_ts_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('is_suspicious', True)), fields=['timestamp'], name='txn_suspicious_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['screening_status', 'timestamp'], name='txn_screening_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:43
+
+from datetime import timedelta
+
+import django.db.models.deletion
+import pandas as pd
+from django.db import migrations, models
+
+# Frozen copy of the feature definitions in core.features as of this
+# migration, so the backfill keeps producing these columns however the
+# live feature code changes later
+ROLLING_WINDOWS = (
+    ('24h', timedelta(hours=24)),
+    ('7d', timedelta(days=7)),
+    ('30d', timedelta(days=30)),
+)
+
+FEATURE_COLUMNS = (
+    'amount', 'history_length', 'total_amount', 'cross_border', 'cross_border_count',
+    'customer_risk_score', 'verification_age_days',
+) + tuple(f'{kind}_{name}' for name, _ in ROLLING_WINDOWS for kind in ('count', 'amount'))
+
+
+def compute_feature_frame(transactions, assessments, verifications):
+    if transactions.empty:
+        return pd.DataFrame(columns=['transaction_id', 'customer_id', 'as_of', *FEATURE_COLUMNS])
+    frame = transactions.sort_values(['customer_id', 'timestamp', 'id'], kind='stable')
+    frame = frame.rename(columns={'id': 'transaction_id', 'timestamp': 'as_of'}).reset_index(drop=True)
+    frame['amount'] = frame['amount'].astype(float)
+    by_customer = frame.groupby('customer_id', sort=False)
+    frame['history_length'] = by_customer.cumcount() + 1
+    frame['total_amount'] = by_customer['amount'].cumsum()
+    frame['cross_border'] = frame['source_country'] != frame['destination_country']
+    frame['cross_border_count'] = frame.groupby('customer_id', sort=False)['cross_border'].cumsum()
+
+    for name, span in ROLLING_WINDOWS:
+        rolling = by_customer.rolling(span, on='as_of', closed='right')['amount']
+        frame[f'count_{name}'] = rolling.count().to_numpy().astype(int)
+        frame[f'amount_{name}'] = rolling.sum().to_numpy()
+
+    if len(assessments):
+        ordered = frame.reset_index().sort_values('as_of', kind='stable')
+        scored = pd.merge_asof(
+            ordered, assessments.sort_values('assessment_date'),
+            left_on='as_of', right_on='assessment_date', by='customer_id',
+            allow_exact_matches=False,
+        ).set_index('index').sort_index()
+        frame['customer_risk_score'] = scored['overall_score'].fillna(0.0).to_numpy()
+    else:
+        frame['customer_risk_score'] = 0.0
+
+    verified_at = pd.to_datetime(frame['customer_id'].map(verifications), utc=True)
+    age = (frame['as_of'] - verified_at).dt.total_seconds() / 86400
+    frame['verification_age_days'] = age.where(age >= 0)
+    return frame[['transaction_id', 'customer_id', 'as_of', *FEATURE_COLUMNS]]
+
+
+def backfill_transaction_features(apps, schema_editor):
+    Transaction = apps.get_model('core', 'Transaction')
+    RiskAssessment = apps.get_model('core', 'RiskAssessment')
+    Customer = apps.get_model('core', 'Customer')
+    TransactionFeatures = apps.get_model('core', 'TransactionFeatures')
+    db_alias = schema_editor.connection.alias
+    transaction_columns = ['id', 'customer_id', 'amount', 'timestamp',
+                           'source_country', 'destination_country']
+    assessment_columns = ['customer_id', 'assessment_date', 'overall_score']
+    frame = compute_feature_frame(
+        pd.DataFrame.from_records(
+            Transaction.objects.using(db_alias).values_list(*transaction_columns)
+            .iterator(chunk_size=10000),
+            columns=transaction_columns,
+        ),
+        pd.DataFrame.from_records(
+            RiskAssessment.objects.using(db_alias).values_list(*assessment_columns).iterator(),
+            columns=assessment_columns,
+        ),
+        dict(Customer.objects.using(db_alias).exclude(last_verification_date=None)
+             .values_list('id', 'last_verification_date')),
+    )
+
+    def rows():
+        for row in frame.to_dict('records'):
+            if pd.isna(row['verification_age_days']):
+                row['verification_age_days'] = None
+            row['as_of'] = row['as_of'].to_pydatetime()
+            yield TransactionFeatures(**row)
+
+    TransactionFeatures.objects.using(db_alias).bulk_create(rows(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_scoringjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionFeatures',
+            fields=[
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='features', serialize=False, to='core.transaction')),
+                ('as_of', models.DateTimeField()),
+                ('amount', models.FloatField()),
+                ('history_length', models.PositiveIntegerField()),
+                ('total_amount', models.FloatField()),
+                ('cross_border', models.BooleanField()),
+                ('cross_border_count', models.PositiveIntegerField()),
+                ('customer_risk_score', models.FloatField()),
+                ('verification_age_days', models.FloatField(null=True)),
+                ('count_24h', models.PositiveIntegerField()),
+                ('amount_24h', models.FloatField()),
+                ('count_7d', models.PositiveIntegerField()),
+                ('amount_7d', models.FloatField()),
+                ('count_30d', models.PositiveIntegerField()),
+                ('amount_30d', models.FloatField()),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.customer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'as_of'], name='features_customer_asof_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_transaction_features, migrations.RunPython.noop),
+    ]
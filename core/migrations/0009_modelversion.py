@@ -0,0 +1,35 @@
+# Generated by Django 5.1.7 on 2026-10-16 22:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_transactionfeatures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('version', models.CharField(max_length=50)),
+                ('artifact', models.CharField(max_length=500)),
+                ('metrics', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('candidate', 'Candidate'), ('shadow', 'Shadow'), ('production', 'Production'), ('retired', 'Retired')], default='candidate', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('promoted_at', models.DateTimeField(blank=True, null=True)),
+                ('shadow_started_at', models.DateTimeField(blank=True, null=True)),
+                ('shadow_rows', models.PositiveIntegerField(default=0)),
+                ('shadow_disagreements', models.PositiveIntegerField(default=0)),
+                ('shadow_abs_diff_sum', models.FloatField(default=0.0)),
+            ],
+            options={
+                'ordering': ['name', '-created_at'],
+                'indexes': [models.Index(fields=['name', 'status'], name='modelversion_name_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('name', 'version'), name='modelversion_name_version_uniq')],
+            },
+        ),
+    ]
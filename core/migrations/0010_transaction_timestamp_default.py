@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:02
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_modelversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_transaction_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScreeningHit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=30)),
+                ('value', models.CharField(max_length=200)),
+                ('category', models.CharField(max_length=30)),
+                ('reason', models.CharField(max_length=200)),
+                ('list_version', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.customer')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'created_at'], name='screeninghit_customer_idx'), models.Index(fields=['list_version'], name='screeninghit_version_idx')],
+            },
+        ),
+    ]
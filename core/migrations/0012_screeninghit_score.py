@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_screeninghit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='screeninghit',
+            name='score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:20
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, Q, Sum
+
+
+# Migration 0004 backfilled the running totals through the default database
+# whichever database was being migrated. Backfill them again on the database
+# being migrated if they were left empty; databases the original backfill
+# reached already have rows and are left alone.
+
+def backfill_transaction_stats(apps, schema_editor):
+    Transaction = apps.get_model('core', 'Transaction')
+    CustomerTransactionStats = apps.get_model('core', 'CustomerTransactionStats')
+    db_alias = schema_editor.connection.alias
+    if CustomerTransactionStats.objects.using(db_alias).exists():
+        return
+    rows = Transaction.objects.using(db_alias).values('customer_id').annotate(
+        count=Count('id'),
+        total=Sum('amount'),
+        squares=Sum(F('amount') * F('amount'), output_field=models.FloatField()),
+        suspicious=Count('id', filter=Q(is_suspicious=True)),
+        first=Min('timestamp'),
+        last=Max('timestamp'),
+    )
+    CustomerTransactionStats.objects.using(db_alias).bulk_create([
+        CustomerTransactionStats(
+            customer_id=row['customer_id'],
+            transaction_count=row['count'],
+            total_amount=row['total'],
+            sum_of_squares=row['squares'],
+            suspicious_count=row['suspicious'],
+            first_transaction_at=row['first'],
+            last_transaction_at=row['last'],
+        ) for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_screeninghit_score'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_transaction_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.7 on 2026-10-17 00:20
+
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import migrations
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+# AML_ACTIVITY_HORIZON_HOURS when this migration was written. Migrations must
+# not depend on settings that can change after they have run.
+ACTIVITY_HORIZON_HOURS = 31 * 24
+
+
+# Migration 0005 backfilled the activity buckets through the default database
+# whichever database was being migrated. Backfill them again on the database
+# being migrated if they were left empty; databases the original backfill
+# reached already have rows and are left alone.
+
+def backfill_activity_buckets(apps, schema_editor):
+    Transaction = apps.get_model('core', 'Transaction')
+    CustomerActivityBucket = apps.get_model('core', 'CustomerActivityBucket')
+    db_alias = schema_editor.connection.alias
+    if CustomerActivityBucket.objects.using(db_alias).exists():
+        return
+    horizon_start = timezone.now() - timedelta(hours=ACTIVITY_HORIZON_HOURS)
+    rows = Transaction.objects.using(db_alias).filter(timestamp__gte=horizon_start).annotate(
+        bucket_start=TruncHour('timestamp', tzinfo=dt_timezone.utc)
+    ).values('customer_id', 'bucket_start').annotate(
+        count=Count('id'),
+        total=Sum('amount'),
+    )
+    CustomerActivityBucket.objects.using(db_alias).bulk_create([
+        CustomerActivityBucket(
+            customer_id=row['customer_id'],
+            bucket_start=row['bucket_start'],
+            transaction_count=row['count'],
+            total_amount=row['total'],
+        ) for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_backfill_transaction_stats_on_alias'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_activity_buckets, migrations.RunPython.noop),
+    ]
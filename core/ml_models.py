@@ -1,51 +1,342 @@
 """Machine learning models for AML detection and risk scoring."""
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+import joblib
 import numpy as np
-from sklearn.ensemble import IsolationForest, RandomForestClassifier
+from django.conf import settings
+from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 import pandas as pd
 
+from .features import feature_store
+from .models import CustomerTransactionStats
+from .reviews import risk_band
+
+ANOMALY_ARTIFACT_PREFIX = 'anomaly_detector'
+RISK_SCORER_ARTIFACT_PREFIX = 'risk_scorer'
+
+def new_version():
+    """A unique, time-ordered version for a newly trained or saved model.
+
+    Microseconds and a random suffix keep versions trained in the same
+    second (or on different hosts) apart; the version names the artifact
+    file and is the model's key in the registry.
+    """
+    return f'{datetime.now(dt_timezone.utc):%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}'
+
+def dump_artifact(artifact, path):
+    """Write ``artifact`` to a new file at ``path``, never replacing an existing one."""
+    with open(path, 'xb') as file:
+        try:
+            joblib.dump(artifact, file)
+        except BaseException:
+            # Never leave a truncated artifact behind for a later load
+            Path(path).unlink(missing_ok=True)
+            raise
+    return path
+
+# Rows pushed through a flattened forest at a time, bounding the node index matrix
+FOREST_CHUNK_ROWS = 1024
+
+def average_path_length(n_samples):
+    """Expected depth of an unsuccessful search in a tree grown on ``n_samples`` rows."""
+    n_samples = np.asarray(n_samples, dtype=float)
+    length = np.where(n_samples == 2, 1.0, 0.0)
+    many = n_samples > 2
+    length[many] = (2.0 * (np.log(n_samples[many] - 1.0) + np.euler_gamma)
+                    - 2.0 * (n_samples[many] - 1.0) / n_samples[many])
+    return length
+
+class FlatForest:
+    """A fitted isolation forest flattened into one array per node attribute.
+
+    scikit-learn keeps each tree in its own ``Tree`` object, and
+    unpickling one copies its nodes into private memory, so every worker
+    that loads a forest holds its own copy. Here the nodes of all trees
+    share contiguous arrays: children (left and right interleaved), split
+    feature and threshold, and the path length credited to a row that
+    ends at the node (its depth plus the expected depth of the rest of the
+    tree). The arrays are saved as plain numpy arrays, which
+    :func:`joblib.load` memory-maps read-only, so the processes serving an
+    artifact share its pages through the page cache.
+
+    Leaves point at themselves, so rows are pushed down every tree at
+    once, one level per step, for ``max_depth`` steps. Thresholds are
+    rounded down to float32, the precision scikit-learn splits features
+    at, which leaves every comparison unchanged; scores match
+    ``-IsolationForest.score_samples``.
+    """
+
+    ARRAYS = ('roots', 'children', 'feature', 'threshold', 'path_length')
+
+    def __init__(self, roots, children, feature, threshold, path_length, max_depth, normaliser,
+                 offset):
+        # Views, not copies: memory-mapped arrays stay shared
+        self.roots, self.children, self.feature, self.threshold, self.path_length = (
+            np.asarray(array) for array in (roots, children, feature, threshold, path_length)
+        )
+        self.max_depth = int(max_depth)
+        self.normaliser = float(normaliser)
+        self.offset = float(offset)
+
+    @classmethod
+    def from_isolation_forest(cls, forest):
+        """Flatten a fitted :class:`~sklearn.ensemble.IsolationForest`."""
+        roots, children, feature, threshold, path_length = [], [], [], [], []
+        start = 0
+        for estimator, features in zip(forest.estimators_, forest.estimators_features_):
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count) + start
+            leaf = tree.children_left < 0
+            roots.append(start)
+            children.append(np.column_stack((
+                np.where(leaf, nodes, tree.children_left + start),
+                np.where(leaf, nodes, tree.children_right + start),
+            )).ravel())
+            feature.append(np.where(leaf, 0, np.asarray(features)[np.maximum(tree.feature, 0)]))
+            threshold.append(np.where(leaf, np.inf, tree.threshold))
+            # compute_node_depths counts the root as 1
+            path_length.append(tree.compute_node_depths() - 1.0 +
+                               average_path_length(tree.n_node_samples))
+            start += tree.node_count
+        if 2 * start >= 2 ** 31:
+            raise ValueError(f'Forest of {start} nodes is too large to flatten')
+        threshold = np.concatenate(threshold)
+        rounded = threshold.astype(np.float32)
+        above = rounded > threshold
+        rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+        return cls(
+            np.array(roots, dtype=np.int32),
+            np.concatenate(children).astype(np.int32),
+            np.concatenate(feature).astype(np.int32),
+            rounded,
+            np.concatenate(path_length),
+            max(estimator.tree_.max_depth for estimator in forest.estimators_),
+            len(forest.estimators_) * average_path_length([forest.max_samples_])[0],
+            forest.offset_,
+        )
+
+    def state(self):
+        """The forest as plain arrays and numbers, for :meth:`__init__` and ``joblib.dump``."""
+        return {
+            **{name: getattr(self, name) for name in self.ARRAYS},
+            'max_depth': self.max_depth,
+            'normaliser': self.normaliser,
+            'offset': self.offset,
+        }
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    @property
+    def threshold_score(self):
+        """Anomaly score above which a row is an outlier (the fitted offset)."""
+        return -self.offset
+
+    def path_lengths(self, features):
+        """Sum over the trees of each row's path length."""
+        features = np.asarray(features, dtype=np.float32)
+        lengths = np.empty(len(features))
+        for start in range(0, len(features), FOREST_CHUNK_ROWS):
+            chunk = features[start:start + FOREST_CHUNK_ROWS]
+            cells = chunk.ravel()
+            row_starts = (np.arange(len(chunk), dtype=np.int32) * chunk.shape[1])[:, None]
+            node = np.repeat(self.roots[None, :], len(chunk), axis=0)
+            for _ in range(self.max_depth):
+                right = cells[row_starts + self.feature[node]] > self.threshold[node]
+                node = self.children[(node << 1) + right]
+            lengths[start:start + len(chunk)] = self.path_length[node].sum(axis=1)
+        return lengths
+
+    def anomaly_scores(self, features):
+        """Anomaly score in [0, 1] per row; higher is more anomalous."""
+        lengths = self.path_lengths(features)
+        if not self.normaliser:
+            return np.full(len(lengths), 0.5)
+        return 2.0 ** (-lengths / self.normaliser)
+
 class TransactionAnomalyDetector:
-    def __init__(self):
-        self.isolation_forest = IsolationForest(contamination=0.1, random_state=42)
+    """Isolation forest anomaly detector over per-transaction features.
+
+    The scaler and forest are fitted offline (see the ``train_anomaly_model``
+    management command) and persisted as a versioned artifact. At request
+    time only ``transform`` and ``predict`` are run, so verdicts are
+    deterministic for a given artifact. The forest is served as a
+    :class:`FlatForest` memory-mapped from the artifact, so every process
+    serving the same version shares one copy of it.
+    """
+
+    FEATURE_NAMES = ('amount', 'customer_risk_score', 'history_length')
+
+    def __init__(self, contamination=0.1, random_state=42):
+        self.isolation_forest = IsolationForest(
+            contamination=contamination, random_state=random_state
+        )
         self.scaler = StandardScaler()
-        
+        self.forest = None
+        self.version = None
+        self.is_fitted = False
+
     def extract_features(self, transaction):
-        """Extract relevant features for anomaly detection."""
-        features = [
-            float(transaction.amount),
-            transaction.customer.risk_score,
-            len(transaction.customer.transaction_set.all())  # Transaction history length
-        ]
-        return np.array(features).reshape(1, -1)
-    
+        """Read the transaction's point-in-time features from the feature store."""
+        return feature_store.vectors([transaction.pk], self.FEATURE_NAMES)
+
+    def fit(self, features):
+        """Fit the scaler and isolation forest on a historical feature matrix."""
+        features = np.asarray(features, dtype=float)
+        self.isolation_forest.fit(self.scaler.fit_transform(features))
+        self.forest = FlatForest.from_isolation_forest(self.isolation_forest)
+        self.version = new_version()
+        self.is_fitted = True
+        return self
+
+    def anomaly_scores(self, features):
+        """Return an anomaly score in [0, 1] per row; higher is more anomalous."""
+        features = np.asarray(features, dtype=float)
+        if not self.is_fitted:
+            # No trained artifact available: never flag on an untrained model.
+            return np.zeros(len(features))
+        return self.forest.anomaly_scores(self.scaler.transform(features))
+
+    @property
+    def threshold(self):
+        """Anomaly score above which a row is flagged (the forest's fitted offset)."""
+        if not self.is_fitted:
+            return 1.0
+        return self.forest.threshold_score
+
+    def predict(self, features):
+        """Return a boolean array flagging anomalous rows of a feature matrix."""
+        return self.anomaly_scores(features) > self.threshold
+
+    def score_batch(self, features):
+        """Return ``(scores, flags)`` for a feature matrix from this one model."""
+        scores = self.anomaly_scores(features)
+        return scores, scores > self.threshold
+
     def is_suspicious(self, transaction):
         """Determine if a transaction is suspicious using isolation forest."""
-        features = self.extract_features(transaction)
-        features_scaled = self.scaler.fit_transform(features)
-        prediction = self.isolation_forest.fit_predict(features_scaled)
-        return prediction[0] == -1
+        return bool(self.predict(self.extract_features(transaction))[0])
+
+    def save(self, directory=None):
+        """Persist the fitted model as ``anomaly_detector-<version>.joblib``.
+
+        The forest is stored flattened (see :class:`FlatForest`) and
+        uncompressed, so that :meth:`load` can memory-map it.
+        """
+        if not self.is_fitted:
+            raise ValueError('Cannot save an anomaly detector that has not been fitted')
+        directory = Path(directory or settings.ML_ARTIFACTS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{ANOMALY_ARTIFACT_PREFIX}-{self.version}.joblib'
+        return dump_artifact({
+            'version': self.version,
+            'feature_names': self.FEATURE_NAMES,
+            'scaler': self.scaler,
+            'forest': self.forest.state(),
+        }, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a detector previously written by :meth:`save`, memory-mapping its forest.
+
+        Artifacts saved before forests were flattened hold the fitted
+        ``IsolationForest`` instead; it is flattened on load, in private
+        memory.
+        """
+        artifact = joblib.load(path, mmap_mode='r')
+        if tuple(artifact['feature_names']) != cls.FEATURE_NAMES:
+            raise ValueError(f'Artifact {path} was trained on different features')
+        detector = cls()
+        detector.scaler = artifact['scaler']
+        if 'forest' in artifact:
+            detector.forest = FlatForest(**artifact['forest'])
+        else:
+            detector.isolation_forest = artifact['isolation_forest']
+            detector.forest = FlatForest.from_isolation_forest(detector.isolation_forest)
+        detector.version = artifact['version']
+        detector.is_fitted = True
+        return detector
+
+def latest_anomaly_artifact(directory=None, exclude=()):
+    """Return the path of the newest anomaly detector artifact not in ``exclude``, or None."""
+    directory = Path(directory or settings.ML_ARTIFACTS_DIR)
+    exclude = {Path(path).resolve() for path in exclude}
+    artifacts = sorted(
+        path for path in directory.glob(f'{ANOMALY_ARTIFACT_PREFIX}-*.joblib')
+        if path.resolve() not in exclude
+    )
+    return artifacts[-1] if artifacts else None
 
 class RiskScorer:
-    def __init__(self):
-        self.rf_classifier = RandomForestClassifier(n_estimators=100, random_state=42)
-        
+    """Weighted customer risk score over running transaction aggregates.
+
+    The score blends the suspicious-transaction ratio, transaction
+    frequency and mean transaction size, the latter two saturating at
+    ``frequency_scale`` transactions a day and ``amount_scale``. The
+    weights and scales are saved as a versioned artifact so they can be
+    registered, shadowed and promoted like a trained model; an unsaved
+    scorer uses the built-in defaults.
+    """
+
+    DEFAULT_WEIGHTS = {'suspicious_ratio': 0.3, 'frequency': 0.3, 'mean_amount': 0.4}
+
+    def __init__(self, weights=None, frequency_scale=10, amount_scale=10000, version='builtin'):
+        self.weights = {**self.DEFAULT_WEIGHTS, **(weights or {})}
+        self.frequency_scale = frequency_scale
+        self.amount_scale = amount_scale
+        self.version = version
+
     def calculate_risk_score(self, customer):
         """Calculate customer risk score based on various factors."""
-        # Get customer's transaction history
-        transactions = customer.transaction_set.all()
-        
-        if not transactions:
+        return self.score_from_stats(CustomerTransactionStats.for_customer(customer))
+
+    def score_from_stats(self, stats):
+        """Calculate a risk score from a customer's running transaction aggregates."""
+        if not stats.transaction_count:
             return 0.5  # Default medium risk for new customers
-        
+
         # Calculate risk factors
-        avg_transaction = np.mean([float(t.amount) for t in transactions])
-        transaction_frequency = len(transactions) / max(1, (pd.Timestamp.now() - 
-            pd.Timestamp(transactions.latest().timestamp)).days)
-        suspicious_ratio = len([t for t in transactions if t.is_suspicious]) / len(transactions)
-        
+        avg_transaction = stats.mean_amount
+        transaction_frequency = stats.transaction_count / max(1, (pd.Timestamp.now(tz='UTC') -
+            pd.Timestamp(stats.last_transaction_at)).days)
+        suspicious_ratio = stats.suspicious_ratio
+
         # Combine risk factors
-        risk_score = (0.3 * suspicious_ratio + 
-                     0.3 * min(1.0, transaction_frequency / 10) +
-                     0.4 * min(1.0, avg_transaction / 10000))
-        
+        risk_score = (self.weights['suspicious_ratio'] * suspicious_ratio +
+                      self.weights['frequency'] * min(1.0, transaction_frequency / self.frequency_scale) +
+                      self.weights['mean_amount'] * min(1.0, avg_transaction / self.amount_scale))
+
         return risk_score
+
+    def score_batch(self, stats_list):
+        """Return ``(scores, bands)`` for a list of customer aggregates."""
+        scores = np.array([self.score_from_stats(stats) for stats in stats_list], dtype=float)
+        return scores, np.array([risk_band(score) for score in scores])
+
+    def save(self, directory=None):
+        """Persist the scorer as ``risk_scorer-<version>.joblib`` under a fresh version."""
+        self.version = new_version()
+        directory = Path(directory or settings.ML_ARTIFACTS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{RISK_SCORER_ARTIFACT_PREFIX}-{self.version}.joblib'
+        return dump_artifact({
+            'version': self.version,
+            'weights': self.weights,
+            'frequency_scale': self.frequency_scale,
+            'amount_scale': self.amount_scale,
+        }, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a scorer previously written by :meth:`save`."""
+        artifact = joblib.load(path)
+        return cls(
+            weights=artifact['weights'],
+            frequency_scale=artifact['frequency_scale'],
+            amount_scale=artifact['amount_scale'],
+            version=artifact['version'],
+        )
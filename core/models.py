@@ -1,7 +1,11 @@
-from django.db import models
+from django.db import connection, models, transaction as db_transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from collections import defaultdict
 from datetime import datetime
+from decimal import Decimal
 
 class CustomerType(models.TextChoices):
     PERSONAL = 'personal', _('Personal')
@@ -64,7 +68,8 @@ class Transaction(models.Model):
     """
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=15, decimal_places=2)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add, so bulk imports of historical transactions keep their timestamps
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     transaction_type = models.CharField(
         max_length=50,
         choices=[
@@ -92,6 +97,230 @@ class Transaction(models.Model):
     
     def __str__(self):
         return f"{self.transaction_type} of {self.amount} by {self.customer.user.username}"
+    
+    class Meta:
+        indexes = [
+            # Per-customer history and window queries
+            models.Index(fields=['customer', 'timestamp'], name='txn_customer_ts_idx'),
+            # Recent-first listings and keyset pagination over (timestamp, id)
+            models.Index(fields=['timestamp', 'id'], name='txn_ts_id_idx'),
+            # Suspicious transactions are a small fraction of the table
+            models.Index(
+                fields=['timestamp'],
+                condition=models.Q(is_suspicious=True),
+                name='txn_suspicious_ts_idx'
+            ),
+            models.Index(fields=['screening_status', 'timestamp'], name='txn_screening_ts_idx'),
+        ]
+
+class CustomerTransactionStatsManager(models.Manager):
+    def record(self, transactions):
+        """Fold newly inserted transactions into their customers' running totals.
+        
+        Runs one atomic ``UPDATE ... SET col = col + delta`` per affected
+        customer, so concurrent inserts for the same customer cannot lose
+        updates.
+        """
+        deltas = {}
+        for transaction in transactions:
+            amount = Decimal(transaction.amount)
+            delta = deltas.setdefault(transaction.customer_id, {
+                'count': 0, 'total': Decimal('0'), 'squares': 0.0, 'suspicious': 0,
+                'first': transaction.timestamp, 'last': transaction.timestamp,
+            })
+            delta['count'] += 1
+            delta['total'] += amount
+            delta['squares'] += float(amount) ** 2
+            delta['suspicious'] += int(transaction.is_suspicious)
+            delta['first'] = min(delta['first'], transaction.timestamp)
+            delta['last'] = max(delta['last'], transaction.timestamp)
+        if not deltas:
+            return
+        
+        with db_transaction.atomic():
+            self.bulk_create(
+                [self.model(customer_id=customer_id) for customer_id in deltas],
+                ignore_conflicts=True
+            )
+            # One prepared statement executed per customer: building an ORM
+            # update per customer costs more than running it
+            ops = connection.ops
+            table = ops.quote_name(self.model._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'UPDATE {table} SET transaction_count = transaction_count + %s, '
+                    f'total_amount = total_amount + CAST(%s AS NUMERIC), '
+                    f'sum_of_squares = sum_of_squares + %s, '
+                    f'suspicious_count = suspicious_count + %s, '
+                    f'first_transaction_at = CASE WHEN first_transaction_at IS NULL '
+                    f'OR first_transaction_at > %s THEN %s ELSE first_transaction_at END, '
+                    f'last_transaction_at = CASE WHEN last_transaction_at IS NULL '
+                    f'OR last_transaction_at < %s THEN %s ELSE last_transaction_at END '
+                    f'WHERE customer_id = %s',
+                    [
+                        (
+                            delta['count'], str(delta['total']), delta['squares'], delta['suspicious'],
+                            *[ops.adapt_datetimefield_value(delta['first'])] * 2,
+                            *[ops.adapt_datetimefield_value(delta['last'])] * 2,
+                            customer_id,
+                        ) for customer_id, delta in deltas.items()
+                    ]
+                )
+    
+    def mark_suspicious(self, counts):
+        """Count already-recorded transactions that scoring has flagged as suspicious.
+
+        ``counts`` maps customer ids to newly flagged transactions; customers
+        with the same count share one UPDATE.
+        """
+        by_count = defaultdict(list)
+        for customer_id, count in counts.items():
+            by_count[count].append(customer_id)
+        for count, customer_ids in by_count.items():
+            self.filter(customer_id__in=customer_ids).update(
+                suspicious_count=F('suspicious_count') + count
+            )
+    
+    def rebuild(self, customer_ids=None):
+        """Recompute running totals from the raw transaction table.
+        
+        Used by ``core.aggregates.rebuild_customer_aggregates`` after
+        transactions are updated or deleted, and as the repair path after
+        they are changed outside the API and admin (shell, raw SQL).
+        """
+        transactions = Transaction.objects.all()
+        if customer_ids is not None:
+            transactions = transactions.filter(customer_id__in=customer_ids)
+        rows = transactions.values('customer_id').annotate(
+            count=Count('id'),
+            total=Sum('amount'),
+            squares=Sum(F('amount') * F('amount'), output_field=models.FloatField()),
+            suspicious=Count('id', filter=Q(is_suspicious=True)),
+            first=Min('timestamp'),
+            last=Max('timestamp'),
+        )
+        with db_transaction.atomic():
+            stale = self.all()
+            if customer_ids is not None:
+                stale = stale.filter(customer_id__in=customer_ids)
+            stale.delete()
+            self.bulk_create([
+                self.model(
+                    customer_id=row['customer_id'],
+                    transaction_count=row['count'],
+                    total_amount=row['total'],
+                    sum_of_squares=row['squares'],
+                    suspicious_count=row['suspicious'],
+                    first_transaction_at=row['first'],
+                    last_transaction_at=row['last'],
+                ) for row in rows.iterator()
+            ], batch_size=1000)
+
+class CustomerTransactionStats(models.Model):
+    """Running per-customer transaction aggregates.
+    
+    Maintained incrementally on every insert so risk scoring can read a
+    customer's count, mean, variance and suspicious ratio in O(1) rather
+    than scanning the full transaction history.
+    """
+    customer = models.OneToOneField(
+        Customer,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='transaction_stats'
+    )
+    transaction_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    sum_of_squares = models.FloatField(default=0.0)
+    suspicious_count = models.PositiveIntegerField(default=0)
+    first_transaction_at = models.DateTimeField(null=True)
+    last_transaction_at = models.DateTimeField(null=True)
+    
+    objects = CustomerTransactionStatsManager()
+    
+    @classmethod
+    def for_customer(cls, customer):
+        """Return the customer's current stats, or an empty unsaved row if they have none."""
+        return cls.objects.filter(customer_id=customer.pk).first() or cls(customer=customer)
+    
+    @property
+    def mean_amount(self):
+        if not self.transaction_count:
+            return 0.0
+        return float(self.total_amount) / self.transaction_count
+    
+    @property
+    def amount_variance(self):
+        if not self.transaction_count:
+            return 0.0
+        return max(0.0, self.sum_of_squares / self.transaction_count - self.mean_amount ** 2)
+    
+    @property
+    def suspicious_ratio(self):
+        if not self.transaction_count:
+            return 0.0
+        return self.suspicious_count / self.transaction_count
+    
+    def __str__(self):
+        return f"Transaction stats for {self.customer.user.username}"
+
+class CustomerActivityBucket(models.Model):
+    """Hourly per-customer transaction totals.
+    
+    Rolling buckets kept over a bounded horizon so that windowed rules
+    (structuring, velocity) can sum a customer's recent activity without
+    reading raw transactions. See ``core.aggregates.ActivityWindows``.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    bucket_start = models.DateTimeField()
+    transaction_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'bucket_start'],
+                                    name='unique_customer_activity_bucket')
+        ]
+    
+    def __str__(self):
+        return f"Activity for {self.customer_id} from {self.bucket_start}"
+
+class TransactionFeatures(models.Model):
+    """Point-in-time ML features of a transaction.
+    
+    Written once when the transaction is recorded, from what was known at
+    its timestamp, and read by online scoring and training alike. See
+    ``core.features``.
+    """
+    transaction = models.OneToOneField(
+        Transaction,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='features'
+    )
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    as_of = models.DateTimeField()
+    amount = models.FloatField()
+    history_length = models.PositiveIntegerField()
+    total_amount = models.FloatField()
+    cross_border = models.BooleanField()
+    cross_border_count = models.PositiveIntegerField()
+    customer_risk_score = models.FloatField()
+    verification_age_days = models.FloatField(null=True)
+    count_24h = models.PositiveIntegerField()
+    amount_24h = models.FloatField()
+    count_7d = models.PositiveIntegerField()
+    amount_7d = models.FloatField()
+    count_30d = models.PositiveIntegerField()
+    amount_30d = models.FloatField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'as_of'], name='features_customer_asof_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Features of transaction {self.transaction_id}"
 
 class RiskAssessment(models.Model):
     """Risk Assessment model for customer risk profiling.
@@ -125,6 +354,136 @@ class RiskAssessment(models.Model):
     
     class Meta:
         get_latest_by = 'assessment_date'
+        indexes = [
+            models.Index(fields=['customer', 'assessment_date'], name='assessment_customer_date_idx'),
+            models.Index(fields=['assessment_date'], name='assessment_date_idx'),
+        ]
+
+class ScoringJob(models.Model):
+    """Durable queue entry for scoring a transaction after it has been committed.
+    
+    Used when TRANSACTION_SCORING_MODE is 'async': the API stores the
+    transaction and its job in one database transaction and returns at once,
+    and ``run_scoring_worker`` processes queued jobs with retries.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    transaction = models.OneToOneField(
+        Transaction,
+        on_delete=models.CASCADE,
+        related_name='scoring_job'
+    )
+    status = models.CharField(
+        max_length=20,
+        default=QUEUED,
+        choices=[
+            (QUEUED, _('Queued')),
+            (RUNNING, _('Running')),
+            (DONE, _('Done')),
+            (FAILED, _('Failed'))
+        ]
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='scoringjob_status_avail_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Scoring job for transaction {self.transaction_id} ({self.status})"
+
+class ModelVersion(models.Model):
+    """A registered model artifact and its rollout state.
+
+    The artifact itself stays on disk; this row records where it is, how
+    it was evaluated and which version each worker should serve. At most
+    one version per model name is in production and at most one in
+    shadow. Shadow counters are accumulated by the background shadow
+    scorer while the version runs alongside production.
+    """
+    CANDIDATE = 'candidate'
+    SHADOW = 'shadow'
+    PRODUCTION = 'production'
+    RETIRED = 'retired'
+
+    name = models.CharField(max_length=50)
+    version = models.CharField(max_length=50)
+    artifact = models.CharField(max_length=500)
+    metrics = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=20,
+        default=CANDIDATE,
+        choices=[
+            (CANDIDATE, _('Candidate')),
+            (SHADOW, _('Shadow')),
+            (PRODUCTION, _('Production')),
+            (RETIRED, _('Retired'))
+        ]
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    promoted_at = models.DateTimeField(null=True, blank=True)
+    shadow_started_at = models.DateTimeField(null=True, blank=True)
+    shadow_rows = models.PositiveIntegerField(default=0)
+    shadow_disagreements = models.PositiveIntegerField(default=0)
+    shadow_abs_diff_sum = models.FloatField(default=0.0)
+
+    class Meta:
+        ordering = ['name', '-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'version'], name='modelversion_name_version_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['name', 'status'], name='modelversion_name_status_idx'),
+        ]
+
+    @property
+    def disagreement_rate(self):
+        return self.shadow_disagreements / self.shadow_rows if self.shadow_rows else None
+
+    @property
+    def mean_abs_diff(self):
+        return self.shadow_abs_diff_sum / self.shadow_rows if self.shadow_rows else None
+
+    def __str__(self):
+        return f"{self.name} {self.version} ({self.status})"
+
+class ScreeningHit(models.Model):
+    """A screening list entry matched by a customer or one of their transactions.
+
+    ``field`` is what matched (``source_country``, ``destination_country``,
+    ``country_code`` or ``name``) and ``list_version`` the version of the
+    screening lists that matched it, so hits stay explainable after the
+    lists change. Customer-level hits have no transaction. Name hits carry
+    the similarity ``score`` of the customer's name to the listed one.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, null=True, blank=True)
+    field = models.CharField(max_length=30)
+    value = models.CharField(max_length=200)
+    category = models.CharField(max_length=30)
+    reason = models.CharField(max_length=200)
+    score = models.FloatField(null=True, blank=True)
+    list_version = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'created_at'], name='screeninghit_customer_idx'),
+            models.Index(fields=['list_version'], name='screeninghit_version_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.field}={self.value} ({self.category}, lists {self.list_version})"
 
 class VerificationDocument(models.Model):
     """Document verification model for KYC process.
@@ -0,0 +1,320 @@
+"""Local model registry with hot reload and shadow scoring.
+
+Model artifacts are files under ``ML_ARTIFACTS_DIR``; each registered
+version has a :class:`~core.models.ModelVersion` row recording its path,
+metrics and rollout status. Every process serves the production version
+of each model from :data:`model_registry`, which re-reads the registry at
+most every ``MODEL_REGISTRY_POLL_SECONDS`` and swaps in a newly promoted
+version without a restart. A version in shadow is scored on the same
+traffic by :data:`shadow_scorer` in a background thread, which records
+how often it disagrees with production on the ``ModelVersion`` row.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .graph import transaction_graph
+from .ml_models import RiskScorer, TransactionAnomalyDetector, latest_anomaly_artifact
+from .models import ModelVersion
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_DETECTOR = 'anomaly_detector'
+RISK_SCORER = 'risk_scorer'
+
+MODEL_CLASSES = {
+    ANOMALY_DETECTOR: TransactionAnomalyDetector,
+    RISK_SCORER: RiskScorer,
+}
+
+def register(name, model, path, metrics=None, status=ModelVersion.CANDIDATE):
+    """Record a saved artifact as a new version of ``name``.
+
+    ``status`` may be ``production`` or ``shadow`` to roll the version out
+    straight away; otherwise it is registered as a candidate.
+    """
+    if name not in MODEL_CLASSES:
+        raise ValueError(f'Unknown model {name!r}')
+    version = ModelVersion.objects.create(
+        name=name, version=model.version, artifact=str(path), metrics=metrics or {}
+    )
+    if status == ModelVersion.PRODUCTION:
+        return promote(name, version.version)
+    if status == ModelVersion.SHADOW:
+        return start_shadow(name, version.version)
+    return version
+
+def promote(name, version):
+    """Make ``version`` the production model of ``name``, retiring the previous one."""
+    with db_transaction.atomic():
+        model_version = ModelVersion.objects.select_for_update().get(name=name, version=version)
+        ModelVersion.objects.filter(name=name, status=ModelVersion.PRODUCTION).exclude(
+            pk=model_version.pk
+        ).update(status=ModelVersion.RETIRED)
+        model_version.status = ModelVersion.PRODUCTION
+        model_version.promoted_at = timezone.now()
+        model_version.save(update_fields=['status', 'promoted_at'])
+    return model_version
+
+def start_shadow(name, version):
+    """Score traffic with ``version`` alongside production, from fresh statistics.
+
+    A version already in shadow for ``name`` goes back to being a candidate.
+    """
+    with db_transaction.atomic():
+        model_version = ModelVersion.objects.select_for_update().get(name=name, version=version)
+        if model_version.status == ModelVersion.PRODUCTION:
+            raise ValueError(f'{name} {version} is already in production')
+        ModelVersion.objects.filter(name=name, status=ModelVersion.SHADOW).exclude(
+            pk=model_version.pk
+        ).update(status=ModelVersion.CANDIDATE)
+        model_version.status = ModelVersion.SHADOW
+        model_version.shadow_started_at = timezone.now()
+        model_version.shadow_rows = 0
+        model_version.shadow_disagreements = 0
+        model_version.shadow_abs_diff_sum = 0.0
+        model_version.save(update_fields=[
+            'status', 'shadow_started_at', 'shadow_rows', 'shadow_disagreements',
+            'shadow_abs_diff_sum',
+        ])
+    return model_version
+
+def retire(name, version):
+    """Stop serving ``version``.
+
+    If it was in production, workers serve no registered version until
+    another is promoted: only an artifact the registry has never tracked
+    (trained before it existed) or the untrained detector, which flags
+    nothing. Promote a replacement rather than relying on the fallback.
+    """
+    ModelVersion.objects.filter(name=name, version=version).update(status=ModelVersion.RETIRED)
+
+def load_model(name, path):
+    return MODEL_CLASSES[name].load(path)
+
+def _builtin_model(name):
+    """The model served for ``name`` when no version is in production."""
+    if name == RISK_SCORER:
+        return RiskScorer()
+    # Artifacts trained before the registry existed are still picked up;
+    # registered ones never are, whatever their status, so a retired,
+    # candidate or shadow version is not served by accident
+    tracked = ModelVersion.objects.filter(name=name).values_list('artifact', flat=True)
+    path = latest_anomaly_artifact(exclude=tracked)
+    if path is None:
+        logger.warning('No trained anomaly detector found in %s; '
+                       'run "manage.py train_anomaly_model"', settings.ML_ARTIFACTS_DIR)
+        return TransactionAnomalyDetector()
+    return TransactionAnomalyDetector.load(path)
+
+class ModelRegistry:
+    """Per-process cache of the production and shadow model of each name.
+
+    Lookups are dictionary reads. At most every ``poll_seconds`` one caller
+    re-reads the active registry rows and loads any version it does not
+    hold yet; the cache is then replaced in a single assignment, so callers
+    see either the old or the new model and a call already holding the old
+    one finishes with it. If an artifact fails to load, the previous model
+    for that slot is kept and the load is retried on the next poll.
+    """
+
+    def __init__(self, poll_seconds=None):
+        self.poll_seconds = (settings.MODEL_REGISTRY_POLL_SECONDS if poll_seconds is None
+                             else poll_seconds)
+        self._models = {}
+        self._fallbacks = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def production(self, name):
+        """Return the model serving ``name`` in this process."""
+        self._refresh()
+        entry = self._models.get((name, ModelVersion.PRODUCTION))
+        if entry is not None:
+            return entry[1]
+        if name not in self._fallbacks:
+            try:
+                self._fallbacks[name] = _builtin_model(name)
+            except DatabaseError:
+                # Not cached, so the fallback is looked up again once the
+                # registry can be read (e.g. after ``migrate``)
+                logger.warning('Could not read the model registry; serving an untrained %s', name)
+                return MODEL_CLASSES[name]()
+        return self._fallbacks[name]
+
+    def shadow(self, name):
+        """Return the shadow model of ``name``, or None if there is none."""
+        self._refresh()
+        entry = self._models.get((name, ModelVersion.SHADOW))
+        return entry[1] if entry is not None else None
+
+    def refresh(self):
+        """Re-read the registry now rather than at the next poll."""
+        self._refresh(force=True)
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.poll_seconds:
+            return
+        # Only the first load makes callers wait; later polls are done by
+        # whichever caller gets there first while the rest keep serving
+        if not self._lock.acquire(blocking=self._checked_at is None or force):
+            return
+        try:
+            if not force and self._checked_at is not None and now - self._checked_at < self.poll_seconds:
+                return
+            self._checked_at = now
+            self._models = self._load_active()
+        finally:
+            self._lock.release()
+
+    def _load_active(self):
+        try:
+            rows = list(ModelVersion.objects.filter(
+                status__in=[ModelVersion.PRODUCTION, ModelVersion.SHADOW]
+            ))
+        except DatabaseError:
+            logger.exception('Could not read the model registry; keeping the loaded models')
+            return self._models
+        loaded = {(name, model.version): model for (name, _), (_, model) in self._models.items()}
+        models = {}
+        for row in rows:
+            key = (row.name, row.status)
+            model = loaded.get((row.name, row.version))
+            if model is None:
+                try:
+                    model = load_model(row.name, row.artifact)
+                except Exception:
+                    logger.exception('Could not load %s %s from %s', row.name, row.version, row.artifact)
+                    if key in self._models:
+                        models[key] = self._models[key]
+                    continue
+                logger.info('Loaded %s %s (%s)', row.name, row.version, row.status)
+            models[key] = (row.version, model)
+        return models
+
+class ShadowScorer:
+    """Score production traffic with shadow models off the request path.
+
+    :meth:`submit` only enqueues the inputs and the production outputs; if
+    the bounded queue is full the sample is dropped and counted rather
+    than slowing the caller. A daemon thread scores each sample with the
+    shadow version current at submission and accumulates rows, label
+    disagreements and absolute score differences, adding them to the
+    version's ``ModelVersion`` row every ``flush_rows`` rows or when idle.
+    """
+
+    def __init__(self, registry, queue_size=None, flush_rows=None):
+        self.registry = registry
+        self.queue_size = queue_size or settings.SHADOW_QUEUE_SIZE
+        self.flush_rows = flush_rows or settings.SHADOW_FLUSH_ROWS
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, name, inputs, scores, labels):
+        """Queue production ``scores`` and ``labels`` for ``inputs`` for comparison."""
+        model = self.registry.shadow(name)
+        if model is None:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((name, model, inputs, np.asarray(scores), np.asarray(labels)))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so a forked web worker starts its own
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name='shadow-scorer', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        pending = {}
+        while True:
+            try:
+                name, model, inputs, scores, labels = self._queue.get(timeout=1)
+            except queue.Empty:
+                for key in list(pending):
+                    self._flush(key, pending.pop(key))
+                continue
+            try:
+                shadow_scores, shadow_labels = model.score_batch(inputs)
+            except Exception:
+                logger.exception('Shadow scoring with %s %s failed', name, model.version)
+                continue
+            key = (name, model.version)
+            totals = pending.setdefault(key, [0, 0, 0.0])
+            totals[0] += len(scores)
+            totals[1] += int(np.count_nonzero(shadow_labels != labels))
+            totals[2] += float(np.abs(shadow_scores - scores).sum())
+            if totals[0] >= self.flush_rows:
+                self._flush(key, pending.pop(key))
+
+    def _flush(self, key, totals):
+        name, version = key
+        rows, disagreements, abs_diff = totals
+        try:
+            ModelVersion.objects.filter(
+                name=name, version=version, status=ModelVersion.SHADOW
+            ).update(
+                shadow_rows=F('shadow_rows') + rows,
+                shadow_disagreements=F('shadow_disagreements') + disagreements,
+                shadow_abs_diff_sum=F('shadow_abs_diff_sum') + abs_diff,
+            )
+        except DatabaseError:
+            logger.exception('Could not record shadow statistics for %s %s', name, version)
+
+model_registry = ModelRegistry()
+shadow_scorer = ShadowScorer(model_registry)
+
+def preload_models():
+    """Load the production model of every name into this process now.
+
+    Called when the WSGI/ASGI application is imported, so a server that
+    imports it before forking (``gunicorn --preload``) loads each artifact
+    once and its workers start with the models already in place, sharing
+    their memory-mapped pages instead of each reading the artifacts. With
+    ``TRANSACTION_GRAPH_PRELOAD`` the transaction flow graph is loaded too,
+    so the first scoring request does not read the whole horizon of
+    transactions; otherwise that request loads it. Preloading is best
+    effort: if the database cannot be read yet (e.g. before ``migrate``),
+    a warning is logged and everything is loaded on first use instead.
+    """
+    if not (settings.MODEL_PRELOAD or settings.TRANSACTION_GRAPH_PRELOAD):
+        return
+    try:
+        if settings.MODEL_PRELOAD:
+            for name in MODEL_CLASSES:
+                model_registry.production(name)
+        if settings.TRANSACTION_GRAPH_PRELOAD:
+            transaction_graph.current()
+    except DatabaseError as exc:
+        logger.warning('Could not preload models (%s); they will be loaded on first use', exc)
+    finally:
+        # Forked workers must not share the master's database connection
+        connections.close_all()
+
+def get_anomaly_detector():
+    """Return the production transaction anomaly detector for this process."""
+    return model_registry.production(ANOMALY_DETECTOR)
+
+def get_risk_scorer():
+    """Return the production customer risk scorer for this process."""
+    return model_registry.production(RISK_SCORER)
@@ -0,0 +1,78 @@
+"""Portfolio-wide periodic risk reviews.
+
+Customers are due for review when none of their risk assessments has a
+``next_review_date`` in the future. Reviews are scored a chunk of
+customers at a time from one bulk transaction query
+(:func:`review_chunk`, safe to run in a worker process) and written back
+with bulk inserts and updates (:func:`save_reviews`).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Exists, OuterRef
+
+from .dashboard import invalidate_dashboard_metrics
+from .models import Customer, RiskAssessment, Transaction
+from .validators import RiskAssessmentRules
+
+def due_customer_ids(as_of):
+    """Return the ids of customers due for a periodic review at ``as_of``, in id order."""
+    scheduled = RiskAssessment.objects.filter(customer=OuterRef('pk'), next_review_date__gt=as_of)
+    return list(
+        Customer.objects.filter(~Exists(scheduled)).order_by('id').values_list('id', flat=True)
+    )
+
+def risk_band(score):
+    """Map a risk score to the low/medium/high bands used across the service."""
+    return 'high' if score >= 0.7 else 'medium' if score >= 0.3 else 'low'
+
+def next_review_date(score, as_of):
+    """Schedule the next review; higher-risk customers are reviewed sooner."""
+    return as_of + timedelta(days=settings.PERIODIC_REVIEW_INTERVAL_DAYS[risk_band(score)])
+
+def review_chunk(customer_ids, as_of):
+    """Score the transaction patterns of a chunk of customers with one query.
+
+    Returns ``(results, transaction_count)`` where ``results`` is a list of
+    ``(customer_id, risk_factors)`` in the order of ``customer_ids``.
+    Customers without transactions get the default medium risk.
+    """
+    rows = Transaction.objects.filter(customer_id__in=customer_ids).order_by(
+        'customer_id', 'timestamp', 'id'
+    ).values_list('customer_id', 'amount', 'timestamp')
+    scored_ids, amounts, timestamps, offsets = RiskAssessmentRules.pattern_columns(rows)
+    factors = RiskAssessmentRules.evaluate_pattern_batch(amounts, timestamps, offsets, now=as_of)
+
+    by_customer = {
+        int(customer_id): {name: float(factors[name][i]) for name in RiskAssessmentRules.PATTERN_FACTORS}
+        for i, customer_id in enumerate(scored_ids)
+    }
+    results = [
+        (customer_id, by_customer.get(customer_id, {'overall_risk': 0.5}))
+        for customer_id in customer_ids
+    ]
+    return results, len(amounts)
+
+def save_reviews(results, as_of):
+    """Write one periodic assessment per customer and update their risk scores.
+
+    Marks the cached dashboard metrics stale once the chunk is saved.
+    """
+    with db_transaction.atomic():
+        RiskAssessment.objects.bulk_create([
+            RiskAssessment(
+                customer_id=customer_id,
+                risk_factors=risk_factors,
+                overall_score=risk_factors['overall_risk'],
+                recommendations=RiskAssessmentRules.generate_recommendations(risk_factors),
+                assessment_type='periodic',
+                next_review_date=next_review_date(risk_factors['overall_risk'], as_of)
+            ) for customer_id, risk_factors in results
+        ], batch_size=1000)
+        Customer.objects.bulk_update([
+            Customer(id=customer_id, risk_score=risk_factors['overall_risk'])
+            for customer_id, risk_factors in results
+        ], ['risk_score'], batch_size=1000)
+    # Bulk writes send no signals, so the dashboard is not marked stale by them
+    invalidate_dashboard_metrics()
@@ -0,0 +1,234 @@
+"""Declarative compliance rules, compiled into one shared evaluation plan.
+
+Rules are data, ``COMPLIANCE_RULES`` in settings::
+
+    {'name': 'ctr_threshold', 'report': 'CTR', 'severity': 'HIGH',
+     'description': 'Transaction amount (£{amount}) exceeds CTR threshold',
+     'conditions': {'amount__gt': 10000}}
+
+A rule fires when all of its conditions hold. Conditions are
+``<column>__<op>`` lookups in the style of queryset filters. Columns are
+transaction fields (``amount``, ``transaction_type``, ``source_country``,
+``destination_country``) or the customer's activity over one of
+``AML_ACTIVITY_WINDOWS`` (``sum_7d``, ``count_24h``, ...). Ops are ``gt``,
+``gte``, ``lt``, ``lte``, ``exact`` (the default), ``in`` and ``not_in``.
+Descriptions are formatted with the transaction's fields and columns.
+
+:meth:`RulePlan.compile` validates the rules once and works out what they
+read. Each column is then built once per batch whichever rules use it,
+every window column comes from the same grouped query over the activity
+buckets, and identical conditions are evaluated once. Evaluation is
+vectorised over a batch of transactions; a single transaction is a batch
+of one. The plan accumulates the time spent on each rule and column.
+"""
+import re
+import string
+import time
+from collections import Counter, namedtuple
+from dataclasses import dataclass
+
+import numpy as np
+from django.core.exceptions import ImproperlyConfigured
+
+from .aggregates import activity_windows
+
+# Transaction fields rules can test, and how each becomes a column
+FIELDS = {
+    'amount': float,
+    'transaction_type': str,
+    'source_country': str,
+    'destination_country': str,
+}
+AGGREGATE_COLUMN = re.compile(r'^(sum|count)_(\w+)$')
+
+OPERATORS = {
+    'gt': np.greater,
+    'gte': np.greater_equal,
+    'lt': np.less,
+    'lte': np.less_equal,
+    'exact': np.equal,
+    'in': np.isin,
+    'not_in': lambda column, values: np.isin(column, values, invert=True),
+}
+
+# Fields every evaluated row must carry
+ROW_FIELDS = ('id', 'customer_id', 'amount', 'transaction_type', 'source_country',
+              'destination_country', 'timestamp')
+
+Condition = namedtuple('Condition', ['column', 'op', 'value'])
+
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    report: str
+    severity: str
+    description: str
+    conditions: tuple
+
+@dataclass
+class RuleStats:
+    """Running totals of one rule's evaluations in this process."""
+    calls: int = 0
+    rows: int = 0
+    alerts: int = 0
+    seconds: float = 0.0
+
+def compile_condition(rule_name, lookup, value):
+    """Parse one ``column__op`` lookup into a :class:`Condition`."""
+    column, _, op = lookup.rpartition('__')
+    if not column:
+        column, op = op, 'exact'
+    if op not in OPERATORS:
+        raise ImproperlyConfigured(f'Rule {rule_name}: unknown operator {op!r} in {lookup!r}')
+    aggregate = AGGREGATE_COLUMN.match(column)
+    if aggregate and aggregate.group(2) not in activity_windows.windows:
+        raise ImproperlyConfigured(
+            f'Rule {rule_name}: {column!r} uses a window not in AML_ACTIVITY_WINDOWS'
+        )
+    if not aggregate and column not in FIELDS:
+        raise ImproperlyConfigured(f'Rule {rule_name}: unknown column {column!r}')
+    cast = FIELDS.get(column, float)
+    if op in ('in', 'not_in'):
+        if isinstance(value, str) or not hasattr(value, '__iter__'):
+            raise ImproperlyConfigured(f'Rule {rule_name}: {lookup!r} needs a list of values')
+    try:
+        value = tuple(cast(item) for item in value) if op in ('in', 'not_in') else cast(value)
+    except (TypeError, ValueError):
+        raise ImproperlyConfigured(
+            f'Rule {rule_name}: {lookup!r} compares {column!r} with {value!r}'
+        ) from None
+    return Condition(column, op, value)
+
+class RulePlan:
+    """Compiled rules with the columns and conditions they share.
+
+    Built by :meth:`compile`. :meth:`evaluate` returns which rules fire for
+    each row of a batch; :meth:`fired` yields the rows that raise alerts.
+    ``stats`` holds a :class:`RuleStats` per rule, whose time includes the
+    conditions it shares with others, and ``column_seconds`` the time spent
+    building each column (``activity`` for all the window columns).
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.conditions = tuple(dict.fromkeys(
+            condition for rule in self.rules for condition in rule.conditions
+        ))
+        columns = {condition.column for condition in self.conditions}
+        self.fields = tuple(sorted(columns & FIELDS.keys()))
+        self.aggregates = tuple(sorted(columns - FIELDS.keys()))
+        self.windows = tuple(sorted({AGGREGATE_COLUMN.match(name).group(2) for name in self.aggregates}))
+        self._positions = [
+            [self.conditions.index(condition) for condition in rule.conditions] for rule in self.rules
+        ]
+        self.stats = {rule.name: RuleStats() for rule in self.rules}
+        self.column_seconds = Counter()
+
+    @classmethod
+    def compile(cls, definitions):
+        """Validate rule definitions and plan their evaluation.
+
+        Raises ImproperlyConfigured naming the first rule that is malformed.
+        """
+        rules = []
+        for definition in definitions:
+            name = definition.get('name')
+            if not name:
+                raise ImproperlyConfigured(f'Compliance rules need a name: {definition!r}')
+            if name in {rule.name for rule in rules}:
+                raise ImproperlyConfigured(f'Duplicate compliance rule {name!r}')
+            conditions = tuple(
+                compile_condition(name, lookup, value)
+                for lookup, value in (definition.get('conditions') or {}).items()
+            )
+            if not conditions:
+                raise ImproperlyConfigured(f'Rule {name} has no conditions')
+            description = definition.get('description', name)
+            known = {*ROW_FIELDS, *(condition.column for condition in conditions)}
+            for _, field, _, _ in string.Formatter().parse(description):
+                if field is not None and re.split(r'[.\[]', field)[0] not in known:
+                    raise ImproperlyConfigured(
+                        f'Rule {name}: description uses {{{field}}}, which is neither a '
+                        f'transaction field nor one of its columns'
+                    )
+            rules.append(Rule(
+                name,
+                definition.get('report', 'SAR'),
+                definition.get('severity', 'MEDIUM'),
+                description,
+                conditions,
+            ))
+        return cls(rules)
+
+    def columns(self, rows, now=None):
+        """Build every column the rules read for ``rows``, once each."""
+        columns = {}
+        for name in self.fields:
+            started = time.perf_counter()
+            if FIELDS[name] is float:
+                columns[name] = np.fromiter((float(row[name]) for row in rows), dtype=float,
+                                            count=len(rows))
+            else:
+                columns[name] = np.array([row[name] for row in rows])
+            self.column_seconds[name] += time.perf_counter() - started
+
+        if self.aggregates:
+            started = time.perf_counter()
+            totals = activity_windows.totals_for_customers(
+                {row['customer_id'] for row in rows}, self.windows, now
+            )
+            for name in self.aggregates:
+                kind, window = AGGREGATE_COLUMN.match(name).groups()
+                attribute = 'amount' if kind == 'sum' else 'count'
+                columns[name] = np.fromiter(
+                    (float(getattr(totals[row['customer_id']][window], attribute)) for row in rows),
+                    dtype=float, count=len(rows),
+                )
+            self.column_seconds['activity'] += time.perf_counter() - started
+        return columns
+
+    def evaluate(self, rows, now=None):
+        """Return ``(fired, columns)`` for a batch of rows.
+
+        ``fired`` is a boolean array with a row per transaction and a column
+        per rule, in :attr:`rules` order.
+        """
+        columns = self.columns(rows, now)
+        results, seconds = [], []
+        for condition in self.conditions:
+            started = time.perf_counter()
+            results.append(OPERATORS[condition.op](columns[condition.column], condition.value))
+            seconds.append(time.perf_counter() - started)
+
+        fired = np.empty((len(rows), len(self.rules)), dtype=bool)
+        for i, (rule, positions) in enumerate(zip(self.rules, self._positions)):
+            started = time.perf_counter()
+            fired[:, i] = np.logical_and.reduce([results[p] for p in positions])
+            stats = self.stats[rule.name]
+            stats.calls += 1
+            stats.rows += len(rows)
+            stats.seconds += time.perf_counter() - started + sum(seconds[p] for p in positions)
+        return fired, columns
+
+    def fired(self, rows, now=None):
+        """Yield ``(row, [(rule, description)])`` for each row that fires a rule."""
+        if not rows:
+            return
+        fired, columns = self.evaluate(rows, now)
+        counts = fired.sum(axis=0)
+        for rule, count in zip(self.rules, counts):
+            self.stats[rule.name].alerts += int(count)
+        for i in np.flatnonzero(fired.any(axis=1)):
+            row = rows[i]
+            values = {**row, **{name: columns[name][i] for name in self.aggregates}}
+            yield row, [
+                (rule, rule.description.format_map(values))
+                for rule, hit in zip(self.rules, fired[i]) if hit
+            ]
+
+    def timings(self):
+        """Per-rule and per-column timings accumulated so far."""
+        return {
+            'rules': {name: vars(stats).copy() for name, stats in self.stats.items()},
+            'columns': dict(self.column_seconds),
+        }
@@ -0,0 +1,275 @@
+"""Transaction scoring and the durable post-commit scoring queue.
+
+``score_transactions`` is the single scoring path: the synchronous API,
+the bulk endpoint and the queue workers all call it. In async mode the
+API only enqueues a :class:`~core.models.ScoringJob` alongside the
+transaction, and :class:`ScoringWorkerPool` drains the queue in batches.
+"""
+import logging
+import threading
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction as db_transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .dashboard import invalidate_dashboard_metrics
+from .features import feature_store
+from .graph import graph_risk, transaction_graph
+from .inference import get_anomaly_scorer
+from .models import (Customer, CustomerTransactionStats, RiskAssessment, ScoringJob,
+                     Transaction)
+from .registry import ANOMALY_DETECTOR, RISK_SCORER, get_risk_scorer, shadow_scorer
+from .screening import record_hits, screening_lists, screening_status
+
+logger = logging.getLogger(__name__)
+
+def score_transactions(transactions, detector=None):
+    """Score saved transactions with one vectorised model call.
+
+    Sets ``is_suspicious``, ``risk_score`` and ``screening_status`` on each
+    transaction, screening its source and destination countries against
+    the current screening lists (a sanctioned country blocks it), raises
+    the risk score of those taking part in a layering pattern in the
+    transaction flow graph (``core.graph``), opens a risk assessment for
+    every suspicious one, and
+    recomputes the risk score of each affected customer once. Transactions
+    must already be recorded (see ``core.aggregates.record_transactions``)
+    and have their customer loaded.
+    """
+    transactions = list(transactions)
+    if not transactions:
+        return
+    detector = detector or get_anomaly_scorer()
+
+    # Point-in-time features were materialised when the rows were recorded
+    features = feature_store.vectors([t.id for t in transactions], detector.FEATURE_NAMES)
+    scores, flags = detector.score_batch(features)
+    shadow_scorer.submit(ANOMALY_DETECTOR, features, scores, flags)
+
+    # Layering patterns in the flow graph raise the risk score, not the label
+    graph_scores = graph_risk(transaction_graph.add(transactions).signals(transactions))
+
+    index = screening_lists.current()
+    newly_suspicious = []
+    hits = []
+    for t, score, flagged, graph_score in zip(transactions, scores, flags, graph_scores):
+        if flagged and not t.is_suspicious:
+            newly_suspicious.append(t)
+        t.is_suspicious = t.is_suspicious or bool(flagged)
+        t.risk_score = max(float(score), float(graph_score))
+        # Screening hits set the status but not is_suspicious, the anomaly label
+        transaction_hits = index.screen_transaction(t.source_country, t.destination_country)
+        hits.extend((t.customer_id, t.id, hit) for hit in transaction_hits)
+        t.screening_status = screening_status(transaction_hits, t.is_suspicious)
+
+    with db_transaction.atomic():
+        save_scores(transactions)
+        record_hits(hits, index)
+        CustomerTransactionStats.objects.mark_suspicious(
+            Counter(t.customer_id for t in newly_suspicious)
+        )
+        RiskAssessment.objects.bulk_create([
+            RiskAssessment(
+                customer=t.customer,
+                risk_factors={'suspicious_transaction': True},
+                overall_score=min(1.0, t.customer.risk_score + 0.2),
+                recommendations='Suspicious transaction detected. Enhanced due diligence recommended.'
+            ) for t in newly_suspicious
+        ], batch_size=1000)
+        update_customer_risk({t.customer_id: t.customer for t in transactions}.values())
+    invalidate_dashboard_metrics()
+
+def save_scores(transactions):
+    """Write the screening outcome of scored transactions back to their rows.
+
+    One prepared UPDATE executed per row: ``bulk_update`` compiles a CASE
+    expression over every row of a batch, which dominates the cost of
+    scoring large batches.
+    """
+    table = connection.ops.quote_name(Transaction._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {table} SET is_suspicious = %s, risk_score = %s, screening_status = %s '
+            f'WHERE id = %s',
+            [(t.is_suspicious, t.risk_score, t.screening_status, t.id) for t in transactions]
+        )
+
+def update_customer_risk(customers):
+    """Recompute and store the risk score of each customer from their aggregates."""
+    customers = list(customers)
+    stats = CustomerTransactionStats.objects.in_bulk([customer.pk for customer in customers])
+    stats_list = [
+        stats.get(customer.pk) or CustomerTransactionStats(customer=customer)
+        for customer in customers
+    ]
+    scores, bands = get_risk_scorer().score_batch(stats_list)
+    shadow_scorer.submit(RISK_SCORER, stats_list, scores, bands)
+    for customer, score in zip(customers, scores):
+        customer.risk_score = float(score)
+    Customer.objects.bulk_update(customers, ['risk_score'], batch_size=1000)
+
+def enqueue_scoring(transactions):
+    """Queue saved transactions for asynchronous scoring.
+
+    Call inside the same database transaction as the insert, so a
+    transaction is never committed without its job.
+    """
+    ScoringJob.objects.bulk_create(
+        [ScoringJob(transaction=t) for t in transactions], batch_size=1000
+    )
+
+def claim_jobs(worker_id, limit):
+    """Atomically claim up to ``limit`` due jobs for ``worker_id``.
+
+    Uses a conditional UPDATE rather than row locks, so it works the same
+    on SQLite and on server databases: a job is only claimed by the worker
+    whose UPDATE moved it out of the queued state.
+    """
+    now = timezone.now()
+    candidates = list(
+        ScoringJob.objects.filter(status=ScoringJob.QUEUED, available_at__lte=now)
+        .order_by('available_at', 'id').values_list('id', flat=True)[:limit]
+    )
+    if not candidates:
+        return []
+    ScoringJob.objects.filter(id__in=candidates, status=ScoringJob.QUEUED).update(
+        status=ScoringJob.RUNNING,
+        attempts=F('attempts') + 1,
+        claimed_by=worker_id,
+        claimed_at=now,
+    )
+    return list(ScoringJob.objects.filter(
+        id__in=candidates, status=ScoringJob.RUNNING, claimed_by=worker_id
+    ))
+
+def requeue_stale_jobs(lease_seconds=None):
+    """Return jobs left running by a crashed worker to the queue.
+
+    A job whose lease expired on its last allowed attempt is failed and
+    its transaction flagged for review, as after any other final failure,
+    so a transaction that crashes its worker is not retried forever.
+    Returns the number of jobs requeued.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=lease_seconds or settings.SCORING_JOB_LEASE_SECONDS)
+    stale = ScoringJob.objects.filter(status=ScoringJob.RUNNING, claimed_at__lt=now - lease)
+    exhausted = stale.filter(attempts__gte=settings.SCORING_MAX_ATTEMPTS)
+    with db_transaction.atomic():
+        Transaction.objects.filter(scoring_job__in=exhausted).update(screening_status='flagged')
+        exhausted.update(
+            status=ScoringJob.FAILED, finished_at=now,
+            last_error='Worker lease expired on the final attempt',
+        )
+        return stale.update(status=ScoringJob.QUEUED, claimed_by='')
+
+def process_jobs(jobs):
+    """Score the transactions of claimed jobs, retrying failures with backoff.
+
+    Jobs are scored as one batch; if the batch fails, each job is retried
+    on its own so a single bad transaction cannot hold back the others.
+    """
+    try:
+        _score_jobs(jobs)
+    except Exception as exc:
+        if len(jobs) == 1:
+            _record_failure(jobs[0], exc)
+            return
+        logger.warning('Scoring batch of %d jobs failed, retrying individually: %s', len(jobs), exc)
+        for job in jobs:
+            try:
+                _score_jobs([job])
+            except Exception as job_exc:
+                _record_failure(job, job_exc)
+
+def _score_jobs(jobs):
+    with db_transaction.atomic():
+        transactions = list(
+            Transaction.objects.select_related('customer')
+            .filter(id__in=[job.transaction_id for job in jobs]).order_by('timestamp', 'id')
+        )
+        score_transactions(transactions)
+        ScoringJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            status=ScoringJob.DONE, finished_at=timezone.now(), last_error=''
+        )
+
+def _record_failure(job, exc):
+    logger.exception('Scoring job %s failed (attempt %d)', job.id, job.attempts, exc_info=exc)
+    if job.attempts >= settings.SCORING_MAX_ATTEMPTS:
+        ScoringJob.objects.filter(id=job.id).update(
+            status=ScoringJob.FAILED, finished_at=timezone.now(), last_error=str(exc)
+        )
+        Transaction.objects.filter(id=job.transaction_id).update(screening_status='flagged')
+        return
+    backoff = settings.SCORING_RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1)
+    ScoringJob.objects.filter(id=job.id).update(
+        status=ScoringJob.QUEUED,
+        claimed_by='',
+        available_at=timezone.now() + timedelta(seconds=backoff),
+        last_error=str(exc),
+    )
+
+def pending_job_count():
+    """Number of jobs still waiting to be scored."""
+    return ScoringJob.objects.filter(
+        Q(status=ScoringJob.QUEUED) | Q(status=ScoringJob.RUNNING)
+    ).count()
+
+class ScoringWorkerPool:
+    """Threads that drain the scoring queue in batches.
+
+    Each thread claims up to ``batch_size`` due jobs at a time and sleeps
+    for ``poll_interval`` seconds when the queue is empty.
+    """
+
+    def __init__(self, workers=None, batch_size=None, poll_interval=1.0):
+        self.workers = workers or settings.SCORING_WORKERS
+        self.batch_size = batch_size or settings.SCORING_BATCH_SIZE
+        self.poll_interval = poll_interval
+        self.processed = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self, drain=False):
+        """Run until stopped, or until the queue is empty if ``drain`` is set."""
+        requeue_stale_jobs()
+        # Load the flow graph once up front rather than in the first batch
+        transaction_graph.current()
+        threads = [
+            threading.Thread(target=self._work, args=(drain,), name=f'scoring-worker-{i}')
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+        return self.processed
+
+    def stop(self):
+        self._stop.set()
+
+    def _work(self, drain):
+        worker_id = uuid.uuid4().hex
+        try:
+            while not self._stop.is_set():
+                close_old_connections()
+                jobs = claim_jobs(worker_id, self.batch_size)
+                if not jobs:
+                    if drain:
+                        return
+                    self._stop.wait(self.poll_interval)
+                    continue
+                process_jobs(jobs)
+                with self._lock:
+                    self.processed += len(jobs)
+        finally:
+            connections.close_all()
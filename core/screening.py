@@ -0,0 +1,553 @@
+"""Sanctions, high-risk jurisdiction and watchlist screening.
+
+The screening lists live in a versioned JSON file, ``SCREENING_LISTS_PATH``::
+
+    {"version": "7",
+     "jurisdictions": {"XX": {"category": "sanctioned", "reason": "..."}},
+     "watchlist": [{"id": "WL-1", "name": "...", "category": "sanctioned",
+                    "country": "XX"}]}
+
+It is parsed once into an immutable :class:`ScreeningIndex`. Country
+lookups are dictionary reads; names are matched fuzzily through a
+character trigram index over the watchlist (:class:`NameIndex`), so
+spelling variants, transliterations and reordered names of sanctioned
+persons and PEPs are caught and ranked by similarity. Every caller in a
+process shares :data:`screening_lists`, which checks the file's
+modification time and size at most every ``SCREENING_LISTS_POLL_SECONDS``
+and swaps in a new index when it changes.
+
+Transactions are screened on their source and destination countries as
+they are scored; customers on their country and name when they or their
+user are saved.
+A new watchlist match on a customer's name also records a ``triggered``
+risk assessment for a compliance officer to confirm or dismiss.
+:func:`rescreen_book` applies a new version of the lists to the whole book.
+"""
+import json
+import logging
+import math
+import multiprocessing
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction as db_transaction
+from django.db.models import Q
+
+from .keyset import iter_keyset
+from .models import Customer, RiskAssessment, ScreeningHit, Transaction
+
+logger = logging.getLogger(__name__)
+
+SANCTIONED = 'sanctioned'
+HIGH_RISK = 'high_risk'
+NON_COOPERATIVE = 'non_cooperative'
+PEP = 'pep'
+CATEGORIES = (SANCTIONED, HIGH_RISK, NON_COOPERATIVE, PEP)
+
+# Hits in these categories block a transaction; any other hit flags it for review
+BLOCKING_CATEGORIES = frozenset({SANCTIONED})
+
+Jurisdiction = namedtuple('Jurisdiction', ['code', 'category', 'reason'])
+WatchlistEntry = namedtuple('WatchlistEntry', ['id', 'name', 'category', 'country'])
+# ``score`` is the name similarity of a watchlist hit; country hits have none
+Hit = namedtuple('Hit', ['field', 'value', 'category', 'reason', 'score'], defaults=[None])
+
+COUNTRY_CODE = re.compile(r'^[A-Z]{2}$')
+
+NON_WORD = re.compile(r'[\W_]+')
+EMPTY_POSTING = np.empty(0, dtype=np.int32)
+
+def name_key(name):
+    """Normalise a name for matching.
+
+    Casefolds, drops accents and punctuation and sorts the words, so
+    "Doe, JOHN" and "John Doe" share a key.
+    """
+    name = name or ''
+    if not name.isascii():
+        decomposed = unicodedata.normalize('NFKD', name)
+        name = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(sorted(NON_WORD.sub(' ', name.casefold()).split()))
+
+def name_grams(name):
+    """The set of character trigrams of a name's key.
+
+    The key is padded so word starts weigh more than word ends and names
+    of one or two letters still have grams.
+    """
+    key = name_key(name)
+    if not key:
+        return set()
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class NameIndex:
+    """Inverted trigram index over watchlist names, ranked by Dice similarity.
+
+    The similarity of two names is ``2 * |A & B| / (|A| + |B|)`` over their
+    trigram sets. A name scoring at least ``threshold`` against a query of
+    ``q`` trigrams has between ``t * q / (2 - t)`` and ``(2 - t) * q / t``
+    trigrams and shares at least ``ceil(t * q / (2 - t))`` of the query's,
+    so it appears in the postings of the rarest ``q - that + 1`` of them.
+    Entries are stored in order of trigram count, which makes the size
+    bound a contiguous slice of every posting; candidates come from the
+    sliced rarest postings only (prefix filtering) and their overlap is
+    completed with binary searches in the others. A query costs a few
+    numpy calls on short arrays however long the watchlist is.
+    """
+    __slots__ = ('entries', '_sizes', '_size_starts', '_postings')
+
+    def __init__(self, entries):
+        grams = sorted(((name_grams(entry.name), entry) for entry in entries),
+                       key=lambda item: len(item[0]))
+        self.entries = tuple(entry for _, entry in grams)
+        self._sizes = np.fromiter((len(g) for g, _ in grams), dtype=np.int32, count=len(grams))
+        # Numbers each gram on first sight, without a Python-level loop per gram
+        vocabulary = defaultdict()
+        vocabulary.default_factory = vocabulary.__len__
+        gram_ids = array('i')
+        for entry_grams, _ in grams:
+            gram_ids.extend(map(vocabulary.__getitem__, entry_grams))
+        # One array of entry positions grouped by gram, ascending within each group
+        gram_ids = np.frombuffer(gram_ids, dtype=np.intc)
+        order = np.argsort(gram_ids, kind='stable')
+        positions = np.repeat(np.arange(len(grams), dtype=np.int32), self._sizes)[order]
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(gram_ids, minlength=len(vocabulary)))))
+        # First position holding each trigram count; int32 like the postings,
+        # so searching them for these bounds needs no cast
+        self._size_starts = np.searchsorted(
+            self._sizes, np.arange(self._sizes.max(initial=0) + 2, dtype=np.int32)
+        ).astype(np.int32)
+        for column in (positions, self._sizes, self._size_starts):
+            column.flags.writeable = False
+        self._postings = MappingProxyType({
+            gram: positions[bounds[i]:bounds[i + 1]] for gram, i in vocabulary.items()
+        })
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _sliced_postings(self, grams, threshold):
+        """The query's postings cut to plausible sizes, rarest first, and the prefix length."""
+        size = len(grams)
+        shared = math.ceil(threshold * size / (2 - threshold) - 1e-9)
+        longest = math.floor((2 - threshold) * size / threshold + 1e-9)
+        limit = len(self._size_starts) - 1
+        bounds = self._size_starts[[min(shared, limit), min(longest + 1, limit)]]
+        postings = []
+        for gram in grams:
+            positions = self._postings.get(gram, EMPTY_POSTING)
+            start, stop = np.searchsorted(positions, bounds)
+            postings.append(positions[start:stop])
+        postings.sort(key=len)
+        return postings, size - shared + 1
+
+    def candidates(self, grams, threshold):
+        """Positions of the entries that may score ``threshold`` against ``grams``."""
+        postings, prefix = self._sliced_postings(grams, threshold)
+        return np.unique(np.concatenate(postings[:prefix]))
+
+    def match(self, name, threshold):
+        """Return ``(entry, score)`` pairs scoring at least ``threshold``, best first."""
+        grams = name_grams(name)
+        if not grams or not self.entries:
+            return []
+        postings, prefix = self._sliced_postings(grams, threshold)
+        candidates, overlap = np.unique(np.concatenate(postings[:prefix]), return_counts=True)
+        # Trigrams each candidate must share to reach the threshold; those that
+        # can no longer get there are dropped before the next posting is read
+        needed = threshold * (len(grams) + self._sizes[candidates]) / 2 - 1e-9
+        remaining = len(postings) - prefix
+        for positions in postings[prefix:]:
+            keep = overlap + remaining >= needed
+            candidates, overlap, needed = candidates[keep], overlap[keep], needed[keep]
+            if not len(candidates):
+                return []
+            if len(positions):
+                found = np.minimum(np.searchsorted(positions, candidates), len(positions) - 1)
+                overlap += positions[found] == candidates
+            remaining -= 1
+        scores = 2 * overlap / (len(grams) + self._sizes[candidates])
+        keep = scores >= threshold
+        matches = [(self.entries[position], float(score))
+                   for position, score in zip(candidates[keep], scores[keep])]
+        matches.sort(key=lambda match: (-match[1], match[0].id))
+        return matches
+
+@dataclass(frozen=True)
+class ScreeningIndex:
+    """One version of the screening lists, indexed for fast lookups."""
+    version: str
+    jurisdictions: Mapping[str, Jurisdiction]
+    watchlist: NameIndex
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build an index from parsed list data, raising ValueError if it is malformed."""
+        version = str(data.get('version') or '').strip()
+        if not version:
+            raise ValueError('Screening lists have no version')
+        jurisdictions = {}
+        for code, entry in (data.get('jurisdictions') or {}).items():
+            code = code.upper()
+            if not COUNTRY_CODE.match(code):
+                raise ValueError(f'Invalid country code {code!r}')
+            if entry.get('category') not in CATEGORIES:
+                raise ValueError(f'Unknown category {entry.get("category")!r} for {code}')
+            jurisdictions[code] = Jurisdiction(code, entry['category'], entry.get('reason') or entry['category'])
+        watchlist = []
+        for entry in data.get('watchlist') or []:
+            if entry.get('category') not in CATEGORIES:
+                raise ValueError(f'Unknown category {entry.get("category")!r} for {entry.get("id")}')
+            if not entry.get('id') or not name_key(entry.get('name')):
+                raise ValueError(f'Watchlist entries need an id and a name: {entry!r}')
+            watchlist.append(WatchlistEntry(
+                str(entry['id']), entry['name'], entry['category'], entry.get('country'),
+            ))
+        return cls(version, MappingProxyType(jurisdictions), NameIndex(watchlist))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def jurisdiction(self, code):
+        return self.jurisdictions.get((code or '').upper())
+
+    def watchlist_matches(self, name, threshold=None):
+        """Watchlist entries similar to ``name`` as ``(entry, score)`` pairs, best first.
+
+        ``threshold`` defaults to ``SCREENING_NAME_THRESHOLD``; 1.0 only
+        matches names with the same key.
+        """
+        if threshold is None:
+            threshold = settings.SCREENING_NAME_THRESHOLD
+        return self.watchlist.match(name, threshold)
+
+    def screen_countries(self, **countries):
+        """Return a hit for each ``field=country_code`` argument on a listed jurisdiction."""
+        hits = []
+        for field, code in countries.items():
+            jurisdiction = self.jurisdiction(code)
+            if jurisdiction is not None:
+                hits.append(Hit(field, jurisdiction.code, jurisdiction.category, jurisdiction.reason))
+        return hits
+
+    def screen_transaction(self, source_country, destination_country):
+        return self.screen_countries(source_country=source_country,
+                                     destination_country=destination_country)
+
+    def screen_customer(self, country_code, name=None):
+        hits = self.screen_countries(country_code=country_code)
+        for entry, score in self.watchlist_matches(name) if name and self.watchlist else ():
+            hits.append(Hit('name', entry.name, entry.category, f'Watchlist match {entry.id}', score))
+        return hits
+
+def screening_status(hits, suspicious=False):
+    """The ``Transaction.screening_status`` implied by screening hits and the anomaly flag."""
+    if any(hit.category in BLOCKING_CATEGORIES for hit in hits):
+        return 'blocked'
+    return 'flagged' if hits or suspicious else 'cleared'
+
+def customer_name(first_name, last_name):
+    return ' '.join(part for part in (first_name, last_name) if part)
+
+class ScreeningLists:
+    """Per-process holder of the current :class:`ScreeningIndex`.
+
+    Callers get the index in a single attribute read. At most every
+    ``poll_seconds`` one caller stats the lists file and, if it changed,
+    parses it into a new index that replaces the old one in one
+    assignment. A file that fails to parse is logged and the previous
+    index kept; only the first load raises, since screening against no
+    lists would clear everything.
+    """
+
+    def __init__(self, path=None, poll_seconds=None):
+        self._path = path
+        self.poll_seconds = (settings.SCREENING_LISTS_POLL_SECONDS if poll_seconds is None
+                             else poll_seconds)
+        self._index = None
+        self._stamp = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return Path(self._path or settings.SCREENING_LISTS_PATH)
+
+    def current(self):
+        """Return the index of the lists file as of the last poll."""
+        self._refresh()
+        return self._index
+
+    def reload(self):
+        """Re-read the lists file now if it changed, rather than at the next poll."""
+        self._refresh(force=True)
+        return self._index
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._index is not None and now - self._checked_at < self.poll_seconds:
+            return
+        if not self._lock.acquire(blocking=self._index is None or force):
+            return
+        try:
+            if not force and self._index is not None and now - self._checked_at < self.poll_seconds:
+                return
+            self._checked_at = now
+            self._load()
+        finally:
+            self._lock.release()
+
+    def _load(self):
+        try:
+            stat = self.path.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if stamp == self._stamp and self._index is not None:
+                return
+            # A broken file is reported once, not on every poll until it is fixed
+            self._stamp = stamp
+            index = ScreeningIndex.load(self.path)
+        except (OSError, ValueError):
+            if self._index is None:
+                raise
+            logger.exception('Could not reload screening lists from %s; keeping version %s',
+                             self.path, self._index.version)
+            return
+        if self._index is not None and index.version != self._index.version:
+            logger.info('Screening lists %s replaced %s; run "manage.py rescreen" '
+                        'to apply them to the book', index.version, self._index.version)
+        self._index = index
+
+screening_lists = ScreeningLists()
+
+def record_hits(hits, index):
+    """Store ``(customer_id, transaction_id, Hit)`` triples as ScreeningHit rows."""
+    ScreeningHit.objects.bulk_create([
+        ScreeningHit(
+            customer_id=customer_id, transaction_id=transaction_id, field=hit.field,
+            value=hit.value, category=hit.category, reason=hit.reason, score=hit.score,
+            list_version=index.version,
+        ) for customer_id, transaction_id, hit in hits
+    ], batch_size=1000)
+
+def escalate_customers(blocked_ids, flagged_ids):
+    """Raise the compliance status of customers with hits; never lowers it.
+
+    Sanctioned hits make a customer non-compliant, other hits put them up
+    for review. Clearing a customer after the lists change is left to a
+    compliance officer.
+    """
+    Customer.objects.filter(id__in=blocked_ids).exclude(
+        compliance_status='non_compliant'
+    ).update(compliance_status='non_compliant')
+    Customer.objects.filter(id__in=set(flagged_ids) - set(blocked_ids)).exclude(
+        compliance_status__in=['review_required', 'non_compliant']
+    ).update(compliance_status='review_required')
+
+def watchlist_assessment(customer_id, hits, index):
+    """A ``triggered`` risk assessment for the watchlist matches among ``hits``.
+
+    The overall score is the similarity of the best match.
+    """
+    matches = sorted((hit for hit in hits if hit.field == 'name'), key=lambda hit: -hit.score)
+    best = matches[0]
+    return RiskAssessment(
+        customer_id=customer_id,
+        risk_factors={
+            'list_version': index.version,
+            'watchlist_matches': [
+                {'name': hit.value, 'category': hit.category, 'reason': hit.reason,
+                 'score': round(hit.score, 3)}
+                for hit in matches
+            ],
+        },
+        overall_score=best.score,
+        recommendations=(
+            f'Name resembles watchlist entry "{best.value}" ({best.category}, similarity '
+            f'{best.score:.2f}). Confirm or dismiss the match before approving further activity.'
+        ),
+        assessment_type='triggered',
+    )
+
+def apply_customer_hits(hits_by_customer, index):
+    """Record customer-level hits, escalate the customers and open reviews of name matches.
+
+    ``hits_by_customer`` maps customer ids to their hits against ``index``.
+    Hits already recorded under the same list version are not recorded
+    again; each customer with a new watchlist match gets a ``triggered``
+    risk assessment. Returns the new hits by customer.
+    """
+    recorded = set(ScreeningHit.objects.filter(
+        customer_id__in=list(hits_by_customer), transaction=None, list_version=index.version
+    ).values_list('customer_id', 'field', 'value'))
+    new = {}
+    for customer_id, hits in hits_by_customer.items():
+        fresh = [hit for hit in hits if (customer_id, hit.field, hit.value) not in recorded]
+        if fresh:
+            new[customer_id] = fresh
+    blocked = [
+        customer_id for customer_id, hits in hits_by_customer.items()
+        if any(hit.category in BLOCKING_CATEGORIES for hit in hits)
+    ]
+    with db_transaction.atomic():
+        record_hits([(customer_id, None, hit) for customer_id, hits in new.items() for hit in hits],
+                    index)
+        RiskAssessment.objects.bulk_create([
+            watchlist_assessment(customer_id, hits, index) for customer_id, hits in new.items()
+            if any(hit.field == 'name' for hit in hits)
+        ], batch_size=1000)
+        escalate_customers(blocked, list(hits_by_customer))
+    return new
+
+def screen_customer(customer, index=None):
+    """Screen a saved customer, recording hits and escalating its compliance status.
+
+    See :func:`apply_customer_hits`. Returns the hits.
+    """
+    index = index or screening_lists.current()
+    name = customer_name(customer.user.first_name, customer.user.last_name) if index.watchlist else None
+    hits = index.screen_customer(customer.country_code, name)
+    if not hits:
+        return hits
+    apply_customer_hits({customer.pk: hits}, index)
+    if any(hit.category in BLOCKING_CATEGORIES for hit in hits):
+        customer.compliance_status = 'non_compliant'
+    elif customer.compliance_status != 'non_compliant':
+        customer.compliance_status = 'review_required'
+    return hits
+
+def screen_customer_rows(rows, index):
+    """Screen customer ``values()`` rows; returns ``{customer_id: hits}`` for those with hits.
+
+    Reads nothing from the database, so it can run in a worker process.
+    """
+    results = {}
+    for row in rows:
+        hits = index.screen_customer(
+            row['country_code'], customer_name(row['user__first_name'], row['user__last_name'])
+        )
+        if hits:
+            results[row['id']] = hits
+    return results
+
+# The index forked rescreen workers screen against, inherited from the parent
+_worker_index = None
+
+def _screen_in_worker(rows):
+    return len(rows), screen_customer_rows(rows, _worker_index)
+
+def _screen_chunks(chunks, index, workers):
+    """Yield ``(row_count, hits_by_customer)`` for each chunk of customer rows.
+
+    With more than one worker the chunks are screened in forked processes,
+    which inherit the parsed index rather than each building their own,
+    while the parent reads the next chunks and writes the results. At most
+    two chunks per worker are in flight, and results arrive out of order.
+    """
+    if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for rows in chunks:
+            yield len(rows), screen_customer_rows(rows, index)
+        return
+
+    global _worker_index
+    _worker_index = index
+    executor = None
+    pending = set()
+    try:
+        for rows in chunks:
+            if executor is None:
+                # Forked workers must not share the parent's database connection
+                connections.close_all()
+                executor = ProcessPoolExecutor(max_workers=workers,
+                                               mp_context=multiprocessing.get_context('fork'))
+            pending.add(executor.submit(_screen_in_worker, rows))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in wait(pending).done:
+            yield future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        _worker_index = None
+
+def _chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+def rescreen_book(index=None, chunk_size=2000, workers=1):
+    """Screen every customer and transaction against ``index``, in chunks.
+
+    Meant to run after the lists change. Customers are screened in
+    ``workers`` processes and handled as in :func:`apply_customer_hits`.
+    Hits already recorded under the same list version are skipped, so a
+    rerun is idempotent. Scored transactions move from ``cleared`` to
+    ``flagged`` or ``blocked``, and from ``flagged`` to ``blocked``, but
+    are never cleared. Pending ones are screened when scored. Only
+    transactions touching a listed country are read.
+    Returns counts of what was screened and changed.
+    """
+    index = index or screening_lists.current()
+    counts = Counter()
+
+    customers = iter_keyset(
+        Customer.objects.values('id', 'country_code', 'user__first_name', 'user__last_name'),
+        fields=('id',), chunk_size=chunk_size,
+    )
+    for row_count, hits_by_customer in _screen_chunks(_chunks(customers, chunk_size), index, workers):
+        new = apply_customer_hits(hits_by_customer, index) if hits_by_customer else {}
+        counts['customers'] += row_count
+        counts['customer_hits'] += len(hits_by_customer)
+        counts['watchlist_reviews'] += sum(
+            any(hit.field == 'name' for hit in hits) for hits in new.values()
+        )
+
+    codes = list(index.jurisdictions)
+    transactions = iter_keyset(
+        Transaction.objects.filter(Q(source_country__in=codes) | Q(destination_country__in=codes))
+        .values('id', 'customer_id', 'source_country', 'destination_country', 'screening_status'),
+        fields=('id',), chunk_size=chunk_size,
+    )
+    for chunk in _chunks(transactions, chunk_size):
+        recorded = set(ScreeningHit.objects.filter(
+            transaction_id__in=[row['id'] for row in chunk], list_version=index.version
+        ).values_list('transaction_id', 'field'))
+        hits, updates = [], {'blocked': [], 'flagged': []}
+        for row in chunk:
+            row_hits = index.screen_transaction(row['source_country'], row['destination_country'])
+            if not row_hits:
+                continue
+            counts['transaction_hits'] += 1
+            hits.extend((row['customer_id'], row['id'], hit) for hit in row_hits
+                        if (row['id'], hit.field) not in recorded)
+            status = screening_status(row_hits)
+            if row['screening_status'] == 'cleared' or (
+                row['screening_status'] == 'flagged' and status == 'blocked'
+            ):
+                updates[status].append(row['id'])
+        with db_transaction.atomic():
+            record_hits(hits, index)
+            for status, ids in updates.items():
+                Transaction.objects.filter(id__in=ids).update(screening_status=status)
+        counts['transactions'] += len(chunk)
+        counts['transactions_blocked'] += len(updates['blocked'])
+        counts['transactions_flagged'] += len(updates['flagged'])
+    return counts
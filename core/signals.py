@@ -0,0 +1,32 @@
+"""Signal handlers keeping derived caches and screening in step with model writes."""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .dashboard import invalidate_dashboard_metrics
+from .models import Customer, RiskAssessment, Transaction, VerificationDocument
+from .screening import screen_customer
+
+@receiver([post_save, post_delete], sender=Customer)
+@receiver([post_save, post_delete], sender=Transaction)
+@receiver([post_save, post_delete], sender=RiskAssessment)
+@receiver([post_save, post_delete], sender=VerificationDocument)
+def mark_dashboard_stale(sender, **kwargs):
+    invalidate_dashboard_metrics()
+
+@receiver(post_save, sender=Customer)
+def screen_saved_customer(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The country may have changed; hits escalate the compliance status
+    if raw or (update_fields is not None and 'country_code' not in update_fields):
+        return
+    screen_customer(instance)
+
+@receiver(post_save, sender=User)
+def screen_renamed_customer(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Customers are matched against the watchlist on their user's name
+    if raw or (update_fields is not None and not {'first_name', 'last_name'} & set(update_fields)):
+        return
+    customer = Customer.objects.filter(user=instance).first()
+    if customer is not None:
+        customer.user = instance
+        screen_customer(customer)
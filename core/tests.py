@@ -1,3 +1,1251 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import joblib
+import numpy as np
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import OperationalError
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from .aggregates import activity_windows, record_transactions
+from .compliance import RegulatoryReporting, ReportType
+from .features import FEATURE_COLUMNS, feature_store
+from .graph import PATTERN_RISK, FlowGraph, Segment, TransactionGraph, edge_columns, graph_risk
+from .inference import MicroBatcher, _Request, get_anomaly_scorer
+from .ml_models import FlatForest, RiskScorer, TransactionAnomalyDetector
+from .models import (
+    Customer, CustomerActivityBucket, CustomerTransactionStats, ModelVersion, RiskAssessment, ScoringJob,
+    ScreeningHit, Transaction, TransactionFeatures,
+)
+from .registry import (
+    ANOMALY_DETECTOR, RISK_SCORER, ModelRegistry, preload_models, promote, register, retire,
+)
+from .rules import ROW_FIELDS, RulePlan
+from .scoring import claim_jobs, enqueue_scoring, process_jobs, requeue_stale_jobs, score_transactions
+from .screening import (
+    NameIndex, WatchlistEntry, apply_customer_hits, name_grams, rescreen_book, screening_lists,
+    screening_status,
+)
+from .validators import (
+    AMOUNT_NEEDS_EDD, AMOUNT_NOT_POSITIVE, INVALID_TRANSACTION_TYPE, TRANSACTION_BATCH,
+    RiskAssessmentRules, error_details, validate_transactions,
+)
+from .views import _transaction_page
+
+
+def make_customer(username='alice', **fields):
+    return Customer.objects.create(user=User.objects.create(username=username), **fields)
+
+
+def make_transactions(customer, amounts, start=None, step=timedelta(hours=1),
+                      transaction_type='transfer', **fields):
+    """Insert and record transactions of ``amounts``, ``step`` apart from ``start``."""
+    start = start or timezone.now() - step * len(amounts)
+    transactions = [
+        Transaction.objects.create(customer=customer, amount=Decimal(amount),
+                                   transaction_type=transaction_type,
+                                   timestamp=start + step * i, **fields)
+        for i, amount in enumerate(amounts)
+    ]
+    record_transactions(transactions)
+    return transactions
+
+
+@override_settings(SCORING_MAX_ATTEMPTS=3, SCORING_RETRY_BACKOFF_SECONDS=30,
+                   SCORING_JOB_LEASE_SECONDS=300)
+class ScoringQueueTests(TestCase):
+    def setUp(self):
+        self.transactions = make_transactions(make_customer(), [100, 200, 300])
+        enqueue_scoring(self.transactions)
+
+    def test_claim_marks_jobs_running_for_one_worker(self):
+        jobs = claim_jobs('worker-a', 2)
+        self.assertEqual(len(jobs), 2)
+        self.assertTrue(all(job.status == ScoringJob.RUNNING for job in jobs))
+        self.assertTrue(all(job.attempts == 1 and job.claimed_by == 'worker-a' for job in jobs))
+
+        # Another worker only gets what is left
+        rest = claim_jobs('worker-b', 10)
+        self.assertEqual(len(rest), 1)
+        self.assertNotIn(rest[0].id, {job.id for job in jobs})
+        self.assertEqual(claim_jobs('worker-c', 10), [])
+
+    def test_claim_skips_jobs_not_yet_due(self):
+        ScoringJob.objects.update(available_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(claim_jobs('worker-a', 10), [])
+
+    def test_processed_jobs_are_done_and_transactions_screened(self):
+        process_jobs(claim_jobs('worker-a', 10))
+        self.assertEqual(ScoringJob.objects.filter(status=ScoringJob.DONE).count(), 3)
+        self.assertFalse(Transaction.objects.filter(screening_status='pending').exists())
+
+    def test_failed_job_is_retried_with_backoff(self):
+        jobs = claim_jobs('worker-a', 1)
+        with mock.patch('core.scoring.score_transactions', side_effect=RuntimeError('boom')), \
+                self.assertLogs('core.scoring', 'ERROR'):
+            process_jobs(jobs)
+        job = ScoringJob.objects.get(id=jobs[0].id)
+        self.assertEqual(job.status, ScoringJob.QUEUED)
+        self.assertEqual(job.claimed_by, '')
+        self.assertEqual(job.last_error, 'boom')
+        self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=20))
+
+    def test_failing_batch_is_retried_one_job_at_a_time(self):
+        bad = self.transactions[1].id
+
+        def score(transactions, detector=None):
+            if any(t.id == bad for t in transactions):
+                raise RuntimeError('bad row')
+
+        with mock.patch('core.scoring.score_transactions', side_effect=score), \
+                self.assertLogs('core.scoring', 'WARNING'):
+            process_jobs(claim_jobs('worker-a', 10))
+        statuses = dict(ScoringJob.objects.values_list('transaction_id', 'status'))
+        self.assertEqual(statuses.pop(bad), ScoringJob.QUEUED)
+        self.assertEqual(set(statuses.values()), {ScoringJob.DONE})
+
+    def test_job_fails_after_max_attempts(self):
+        ScoringJob.objects.update(attempts=2)
+        jobs = claim_jobs('worker-a', 1)
+        with mock.patch('core.scoring.score_transactions', side_effect=RuntimeError('boom')), \
+                self.assertLogs('core.scoring', 'ERROR'):
+            process_jobs(jobs)
+        job = ScoringJob.objects.get(id=jobs[0].id)
+        self.assertEqual(job.status, ScoringJob.FAILED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(Transaction.objects.get(id=job.transaction_id).screening_status, 'flagged')
+
+    def test_stale_jobs_are_requeued(self):
+        claim_jobs('worker-a', 10)
+        ScoringJob.objects.update(claimed_at=timezone.now() - timedelta(seconds=301))
+        self.assertEqual(requeue_stale_jobs(), 3)
+        self.assertEqual(ScoringJob.objects.filter(status=ScoringJob.QUEUED).count(), 3)
+
+    def test_leases_within_their_time_are_kept(self):
+        claim_jobs('worker-a', 10)
+        self.assertEqual(requeue_stale_jobs(), 0)
+        self.assertEqual(ScoringJob.objects.filter(status=ScoringJob.RUNNING).count(), 3)
+
+    def test_stale_job_on_last_attempt_fails_instead_of_requeueing(self):
+        ScoringJob.objects.filter(transaction=self.transactions[0]).update(attempts=2)
+        claim_jobs('worker-a', 10)
+        ScoringJob.objects.update(claimed_at=timezone.now() - timedelta(seconds=301))
+        self.assertEqual(requeue_stale_jobs(), 2)
+        job = ScoringJob.objects.get(transaction=self.transactions[0])
+        self.assertEqual(job.status, ScoringJob.FAILED)
+        self.assertEqual(Transaction.objects.get(id=job.transaction_id).screening_status, 'flagged')
+        self.assertEqual(claim_jobs('worker-b', 10)[0].attempts, 2)
+
+
+class MaintainedAggregateTests(TestCase):
+    """The incrementally maintained aggregates against a recomputation from raw rows."""
+
+    def setUp(self):
+        self.customers = [make_customer(f'customer{i}') for i in range(4)]
+        self.rng = np.random.default_rng(11)
+        self.now = timezone.now()
+
+    def insert_batches(self, batches=12, max_age=timedelta(days=3)):
+        """Insert and record batches mixing customers, with timestamps in no particular order."""
+        for _ in range(batches):
+            batch = [
+                Transaction.objects.create(
+                    customer=self.customers[self.rng.integers(len(self.customers))],
+                    amount=Decimal(int(self.rng.integers(1, 10 ** 6))) / 100,
+                    transaction_type='transfer',
+                    is_suspicious=bool(self.rng.random() < 0.2),
+                    timestamp=self.now - max_age * self.rng.random(),
+                ) for _ in range(self.rng.integers(1, 8))
+            ]
+            record_transactions(batch)
+
+    def test_running_totals_match_a_rebuild(self):
+        self.insert_batches()
+        # Flagged by scoring after being recorded
+        flagged = list(Transaction.objects.filter(is_suspicious=False)[:5])
+        Transaction.objects.filter(id__in=[t.id for t in flagged]).update(is_suspicious=True)
+        counts = {}
+        for transaction in flagged:
+            counts[transaction.customer_id] = counts.get(transaction.customer_id, 0) + 1
+        CustomerTransactionStats.objects.mark_suspicious(counts)
+
+        def stats():
+            return {
+                row.customer_id: (row.transaction_count, row.total_amount, row.sum_of_squares,
+                                  row.suspicious_count, row.first_transaction_at, row.last_transaction_at)
+                for row in CustomerTransactionStats.objects.all()
+            }
+
+        maintained = stats()
+        CustomerTransactionStats.objects.rebuild()
+        rebuilt = stats()
+        self.assertEqual(maintained.keys(), rebuilt.keys())
+        for customer_id, row in rebuilt.items():
+            with self.subTest(customer=customer_id):
+                self.assertEqual(maintained[customer_id][:2], row[:2])
+                self.assertAlmostEqual(maintained[customer_id][2], row[2], delta=row[2] * 1e-9)
+                self.assertEqual(maintained[customer_id][3:], row[3:])
+
+    def test_activity_buckets_match_a_rebuild(self):
+        # Pin the clock so the horizon cannot move between recording and rebuilding
+        clock = mock.patch('django.utils.timezone.now', return_value=self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        # Some rows fall outside the 31-day horizon
+        self.insert_batches(batches=20, max_age=timedelta(days=40))
+        ids = [customer.id for customer in self.customers]
+
+        def buckets():
+            return set(CustomerActivityBucket.objects.values_list(
+                'customer_id', 'bucket_start', 'transaction_count', 'total_amount'
+            ))
+
+        maintained = buckets()
+        totals = activity_windows.totals_for_customers(ids)
+        activity_windows.rebuild(ids)
+        self.assertEqual(maintained, buckets())
+        self.assertEqual(activity_windows.totals_for_customers(ids), totals)
+
+        # Each window sums the raw rows from the start of its first bucket
+        for name, start in activity_windows.window_starts().items():
+            for customer in self.customers:
+                rows = Transaction.objects.filter(customer=customer, timestamp__gte=start)
+                with self.subTest(window=name, customer=customer.id):
+                    self.assertEqual(totals[customer.id][name],
+                                     (rows.count(), sum((t.amount for t in rows), Decimal('0'))))
+
+
+class FeatureStoreLeakageTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.start = timezone.now() - timedelta(days=3)
+        self.early = make_transactions(self.customer, [100, 200, 300], start=self.start)
+
+    def features(self, transactions):
+        rows = TransactionFeatures.objects.in_bulk([t.id for t in transactions])
+        return [rows[t.id] for t in transactions]
+
+    def test_rows_only_see_earlier_transactions(self):
+        before = [(row.history_length, row.total_amount, row.count_24h)
+                  for row in self.features(self.early)]
+        self.assertEqual(before, [(1, 100, 1), (2, 300, 2), (3, 600, 3)])
+
+        # Later activity never rewrites what earlier transactions saw
+        late = make_transactions(self.customer, [1000, 2000], start=self.start + timedelta(hours=30))
+        after = [(row.history_length, row.total_amount, row.count_24h)
+                 for row in self.features(self.early)]
+        self.assertEqual(after, before)
+        self.assertEqual([(row.history_length, row.count_24h, row.amount_24h)
+                          for row in self.features(late)], [(4, 1, 1000), (5, 2, 3000)])
+
+    def assess(self, score, at):
+        assessment = RiskAssessment.objects.create(
+            customer=self.customer, risk_factors={}, overall_score=score,
+            recommendations='', assessment_type='periodic',
+        )
+        RiskAssessment.objects.filter(id=assessment.id).update(assessment_date=at)
+
+    def test_customer_risk_score_is_the_assessment_before_the_transaction(self):
+        Customer.objects.filter(id=self.customer.id).update(risk_score=0.7)
+        self.assess(0.9, self.start + timedelta(hours=4))
+        self.assess(0.4, self.start + timedelta(hours=6))
+        late = make_transactions(self.customer, [50, 60, 70], start=self.start + timedelta(hours=5))
+        self.assertEqual({row.customer_risk_score for row in self.features(self.early)}, {0.0})
+        # The assessment at exactly 6h is not yet in effect for the 6h transaction
+        self.assertEqual([row.customer_risk_score for row in self.features(late)], [0.9, 0.9, 0.4])
+
+    def test_training_frame_has_no_future_rows(self):
+        make_transactions(self.customer, [400], start=self.start + timedelta(days=1))
+        frame = feature_store.training_frame(
+            Transaction.objects.filter(timestamp__lt=self.start + timedelta(hours=12))
+        )
+        self.assertEqual(list(frame['transaction_id']), [t.id for t in self.early])
+        self.assertEqual(frame['amount_30d'].tolist(), [100, 300, 600])
+
+    def test_snapshot_ignores_transactions_after_as_of(self):
+        snapshot = feature_store.snapshot([self.customer.id], self.start + timedelta(minutes=90))
+        self.assertEqual(snapshot[self.customer.id]['history_length'], 2)
+        self.assertEqual(snapshot[self.customer.id]['count_24h'], 2)
+
+    def test_snapshot_and_record_follow_as_of_after_backdated_inserts(self):
+        # A backdated transaction gets a higher id than later-dated ones
+        backdated = Transaction.objects.create(
+            customer=self.customer, amount=Decimal(1000), transaction_type='transfer',
+            timestamp=self.start - timedelta(hours=1),
+        )
+        feature_store.rebuild([self.customer.id])
+        snapshot = feature_store.snapshot([self.customer.id], self.start + timedelta(hours=3))
+        self.assertEqual(snapshot[self.customer.id]['history_length'], 4)
+        self.assertEqual(snapshot[self.customer.id]['last_transaction_at'], self.early[-1].timestamp)
+        self.assertEqual(self.features([backdated])[0].history_length, 1)
+
+        [late] = self.features(make_transactions(self.customer, [50], start=self.start + timedelta(hours=5)))
+        self.assertEqual((late.history_length, late.total_amount), (5, 1650))
+
+    def test_rebuild_replays_the_same_rows(self):
+        Customer.objects.filter(id=self.customer.id).update(risk_score=0.7)
+        self.assess(0.6, self.start + timedelta(hours=10))
+        make_transactions(self.customer, [5, 7000], start=self.start + timedelta(hours=20),
+                          destination_country='FR')
+        recorded = feature_store.training_frame()
+        feature_store.rebuild()
+        rebuilt = feature_store.training_frame()
+        columns = ['transaction_id', *FEATURE_COLUMNS]
+        self.assertEqual(recorded[columns].fillna(-1).values.tolist(),
+                         rebuilt[columns].fillna(-1).values.tolist())
+
+
+def fit_detector(seed=0, rows=300):
+    detector = TransactionAnomalyDetector()
+    detector.isolation_forest.set_params(n_estimators=20)
+    features = np.random.default_rng(seed).lognormal(size=(rows, len(detector.FEATURE_NAMES)))
+    return detector.fit(features)
+
+
+class ModelRegistryTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.artifacts = Path(directory.name)
+        settings_override = override_settings(ML_ARTIFACTS_DIR=self.artifacts)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.registry = ModelRegistry(poll_seconds=0)
+
+    def train(self, status=ModelVersion.PRODUCTION, seed=0):
+        detector = fit_detector(seed)
+        return register(ANOMALY_DETECTOR, detector, detector.save(), status=status)
+
+    def test_promotion_retires_the_previous_version(self):
+        first = self.train()
+        second = self.train(seed=1)
+        statuses = dict(ModelVersion.objects.values_list('version', 'status'))
+        self.assertEqual(statuses, {first.version: ModelVersion.RETIRED,
+                                    second.version: ModelVersion.PRODUCTION})
+        self.assertEqual(self.registry.production(ANOMALY_DETECTOR).version, second.version)
+
+    def test_shadow_rollout(self):
+        production = self.train()
+        shadow = self.train(ModelVersion.SHADOW, seed=1)
+        self.assertEqual(self.registry.production(ANOMALY_DETECTOR).version, production.version)
+        self.assertEqual(self.registry.shadow(ANOMALY_DETECTOR).version, shadow.version)
+
+        promote(ANOMALY_DETECTOR, shadow.version)
+        self.assertEqual(self.registry.production(ANOMALY_DETECTOR).version, shadow.version)
+        self.assertIsNone(self.registry.shadow(ANOMALY_DETECTOR))
+
+    def test_fallback_never_serves_a_tracked_artifact(self):
+        production = self.train()
+        shadow = self.train(ModelVersion.SHADOW, seed=1)
+        retire(ANOMALY_DETECTOR, production.version)
+
+        with self.assertLogs('core.registry', 'WARNING'):
+            served = self.registry.production(ANOMALY_DETECTOR)
+        self.assertFalse(served.is_fitted)
+        self.assertEqual(self.registry.shadow(ANOMALY_DETECTOR).version, shadow.version)
+
+    def test_fallback_serves_an_untracked_artifact(self):
+        legacy = fit_detector()
+        legacy.save()
+        self.train(ModelVersion.CANDIDATE, seed=1)
+        self.assertEqual(self.registry.production(ANOMALY_DETECTOR).version, legacy.version)
+
+    def test_unreadable_registry_serves_an_uncached_fallback(self):
+        fit_detector().save()
+        with mock.patch.object(ModelVersion.objects, 'filter', side_effect=OperationalError('no such table')):
+            with self.assertLogs('core.registry', 'WARNING'):
+                self.assertFalse(self.registry.production(ANOMALY_DETECTOR).is_fitted)
+        # Picked up once the registry can be read
+        self.assertTrue(self.registry.production(ANOMALY_DETECTOR).is_fitted)
+
+    def preload(self, graph_error=None):
+        with mock.patch('core.registry.model_registry', self.registry), \
+                mock.patch('core.registry.connections'), \
+                mock.patch('core.registry.transaction_graph') as graph:
+            graph.current.side_effect = graph_error
+            preload_models()
+        return graph
+
+    @override_settings(MODEL_PRELOAD=True, TRANSACTION_GRAPH_PRELOAD=False)
+    def test_preload_leaves_the_graph_to_first_use(self):
+        self.assertFalse(self.preload().current.called)
+        with self.settings(TRANSACTION_GRAPH_PRELOAD=True):
+            self.assertTrue(self.preload().current.called)
+
+    @override_settings(MODEL_PRELOAD=True, TRANSACTION_GRAPH_PRELOAD=True)
+    def test_preload_is_best_effort(self):
+        with self.assertLogs('core.registry', 'WARNING') as logs:
+            self.preload(graph_error=OperationalError('no such table'))
+        self.assertIn('loaded on first use', logs.output[-1])
+
+    def test_versions_trained_in_the_same_second_do_not_collide(self):
+        with mock.patch('core.ml_models.datetime') as clock:
+            clock.now.return_value = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+            first = self.train(ModelVersion.CANDIDATE)
+            second = self.train(ModelVersion.CANDIDATE, seed=1)
+        self.assertNotEqual(first.version, second.version)
+        self.assertNotEqual(first.artifact, second.artifact)
+        self.assertEqual(TransactionAnomalyDetector.load(first.artifact).version, first.version)
+
+    def test_saving_never_overwrites_an_artifact(self):
+        detector = fit_detector()
+        detector.save()
+        with self.assertRaises(FileExistsError):
+            detector.save()
+
+    def test_risk_scorer_versions_are_registered_and_served(self):
+        scorer = RiskScorer()
+        first = register(RISK_SCORER, scorer, scorer.save(), status=ModelVersion.PRODUCTION)
+        second = register(RISK_SCORER, scorer, scorer.save(), status=ModelVersion.PRODUCTION)
+        self.assertNotEqual(first.version, second.version)
+        self.assertEqual(self.registry.production(RISK_SCORER).version, second.version)
+
+
+class FlatForestTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.detector = fit_detector(rows=2000)
+        forest = cls.detector.isolation_forest
+        rng = np.random.default_rng(1)
+        # Rows sitting exactly on split thresholds as well as ordinary and extreme ones
+        thresholds = np.concatenate([tree.tree_.threshold[tree.tree_.feature >= 0]
+                                     for tree in forest.estimators_])
+        columns = len(cls.detector.FEATURE_NAMES)
+        cls.rows = np.vstack([
+            cls.detector.scaler.transform(rng.lognormal(size=(500, columns))),
+            rng.normal(scale=10, size=(100, columns)),
+            np.repeat(thresholds[:, None], columns, axis=1),
+        ])
+
+    def test_scores_match_isolation_forest(self):
+        expected = -self.detector.isolation_forest.score_samples(self.rows)
+        np.testing.assert_allclose(self.detector.forest.anomaly_scores(self.rows), expected,
+                                   rtol=0, atol=1e-12)
+
+    def test_flags_match_isolation_forest(self):
+        flags = self.detector.forest.anomaly_scores(self.rows) > self.detector.forest.threshold_score
+        np.testing.assert_array_equal(flags, self.detector.isolation_forest.predict(self.rows) == -1)
+
+    def test_saved_forest_is_memory_mapped_and_scores_the_same(self):
+        with tempfile.TemporaryDirectory() as directory:
+            loaded = TransactionAnomalyDetector.load(self.detector.save(directory))
+            # Views of the memory-mapped artifact, not private copies
+            self.assertTrue(all(isinstance(getattr(loaded.forest, name).base, np.memmap)
+                                for name in FlatForest.ARRAYS))
+            self.assertFalse(loaded.forest.children.flags.writeable)
+            np.testing.assert_array_equal(loaded.forest.anomaly_scores(self.rows),
+                                          self.detector.forest.anomaly_scores(self.rows))
+            del loaded
+
+    def test_legacy_artifact_is_flattened_on_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'anomaly_detector-legacy.joblib'
+            joblib.dump({
+                'version': 'legacy',
+                'feature_names': self.detector.FEATURE_NAMES,
+                'scaler': self.detector.scaler,
+                'isolation_forest': self.detector.isolation_forest,
+            }, path)
+            loaded = TransactionAnomalyDetector.load(path)
+        np.testing.assert_array_equal(loaded.forest.anomaly_scores(self.rows),
+                                      self.detector.forest.anomaly_scores(self.rows))
+
+
+def raw_compliance_alerts(transactions, now):
+    """The checks RegulatoryReporting made before the activity buckets.
+
+    CTR above 10,000 on the amount, SAR above 5,000 on a sum of the
+    customer's raw transaction rows since exactly ``now - 7 days``.
+    """
+    alerts = set()
+    for transaction in transactions:
+        if float(transaction.amount) > 10000:
+            alerts.add((transaction.id, ReportType.CTR.value))
+        recent = Transaction.objects.filter(customer_id=transaction.customer_id,
+                                            timestamp__gte=now - timedelta(days=7))
+        if sum(float(t.amount) for t in recent) > 5000:
+            alerts.add((transaction.id, ReportType.SAR.value))
+    return alerts
+
+
+class RegulatoryReportingTests(TestCase):
+    # Half past the hour, so the 7-day window starts inside an hourly bucket
+    now = datetime(2026, 3, 10, 12, 30, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        clock = mock.patch('django.utils.timezone.now', return_value=self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        window_start = self.now - timedelta(days=7)
+        day = timedelta(days=1)
+        self.inside = make_transactions(make_customer('inside'), [3000, 2500],
+                                        start=window_start + timedelta(minutes=10), step=6 * day)
+        self.on_the_boundary = make_transactions(make_customer('boundary'), [5100], start=window_start)
+        # 12:20, a week ago: before the window but inside its first hourly bucket
+        self.same_hour = make_transactions(make_customer('same_hour'), [5200, 100],
+                                           start=window_start - timedelta(minutes=10), step=6 * day)
+        # 11:50, a week ago: in the bucket before the window
+        self.hour_before = make_transactions(make_customer('hour_before'), [6000, 100],
+                                             start=window_start - timedelta(minutes=40), step=6 * day)
+        self.large = make_transactions(make_customer('large'), [10001], start=self.now - day)
+
+    def alerts(self, transactions):
+        return {
+            (row['id'], alert.alert_type)
+            for row, alerts in RegulatoryReporting().evaluate_transactions(transactions, chunk_size=3)
+            for alert in alerts
+        }
+
+    def test_matches_the_raw_seven_day_sum_to_within_an_hour(self):
+        transactions = Transaction.objects.all()
+        raw = raw_compliance_alerts(transactions, self.now)
+        bucketed = self.alerts(transactions)
+        # Buckets start at the hour containing now - 7 days, so the window
+        # may also count up to an hour of older activity: alerts are a
+        # superset of the raw check's, differing only for customers with
+        # activity in that hour
+        self.assertLessEqual(raw, bucketed)
+        self.assertEqual(bucketed - raw, {(t.id, ReportType.SAR.value) for t in self.same_hour})
+        for transaction in (*self.inside, *self.on_the_boundary, *self.large):
+            self.assertIn((transaction.id, ReportType.SAR.value), raw)
+        self.assertIn((self.large[0].id, ReportType.CTR.value), raw)
+        self.assertFalse({alert for alert in bucketed if alert[0] in {t.id for t in self.hour_before}})
+
+    def test_batch_and_single_evaluation_agree(self):
+        reporting = RegulatoryReporting()
+        single = {
+            (transaction.id, alert.alert_type)
+            for transaction in Transaction.objects.all()
+            for alert in reporting.evaluate_transaction(transaction)
+        }
+        self.assertEqual(single, self.alerts(Transaction.objects.all()))
+
+
+def hard_coded_alerts(transaction):
+    """RegulatoryReporting.evaluate_transaction as it was before COMPLIANCE_RULES."""
+    alerts = []
+    if float(transaction.amount) > 10000:
+        alerts.append((ReportType.CTR.value, 'HIGH',
+                       f'Transaction amount (£{transaction.amount}) exceeds CTR threshold'))
+    if activity_windows.totals(transaction.customer_id, ['7d'])['7d'].amount > 5000:
+        alerts.append((ReportType.SAR.value, 'MEDIUM',
+                       'Multiple transactions potentially indicating structuring'))
+    return alerts
+
+
+class RulePlanTests(TestCase):
+    def test_default_rules_match_the_hard_coded_checks(self):
+        rng = np.random.default_rng(5)
+        for i in range(8):
+            amounts = rng.choice([50, 900, 2400, 4999, 5001, 9999, 10000, 10001, 25000], size=4).tolist()
+            make_transactions(make_customer(f'customer{i}'), amounts,
+                              step=timedelta(hours=int(rng.integers(1, 72))))
+        reporting = RegulatoryReporting()
+        expected, batch = {}, {}
+        for transaction in Transaction.objects.all():
+            old = hard_coded_alerts(transaction)
+            new = [(alert.alert_type, alert.severity, alert.description)
+                   for alert in reporting.evaluate_transaction(transaction)]
+            self.assertEqual(new, old)
+            if old:
+                expected[transaction.id] = old
+        for row, alerts in reporting.evaluate_transactions(Transaction.objects.all(), chunk_size=5):
+            batch[row['id']] = [(alert.alert_type, alert.severity, alert.description) for alert in alerts]
+        self.assertEqual(batch, expected)
+        # Both rules fire somewhere, and not everywhere
+        fired = {alert[0] for alerts in expected.values() for alert in alerts}
+        self.assertEqual(fired, {ReportType.CTR.value, ReportType.SAR.value})
+        self.assertLess(len(expected), Transaction.objects.count())
+
+    def test_rules_share_columns_and_conditions(self):
+        plan = RulePlan.compile([
+            {'name': 'large_transfer', 'conditions': {'amount__gte': 5000, 'transaction_type': 'transfer'}},
+            {'name': 'large_abroad', 'conditions': {'amount__gte': 5000,
+                                                    'destination_country__not_in': ['GB']}},
+            {'name': 'busy_day', 'conditions': {'count_24h__gt': 2, 'sum_7d__gt': 100}},
+        ])
+        self.assertEqual(len(plan.conditions), 5)
+        self.assertEqual(plan.fields, ('amount', 'destination_country', 'transaction_type'))
+        self.assertEqual(plan.aggregates, ('count_24h', 'sum_7d'))
+        self.assertEqual(plan.windows, ('24h', '7d'))
+
+        customer = make_customer()
+        make_transactions(customer, [6000], destination_country='GB')
+        make_transactions(customer, [7000], transaction_type='deposit', destination_country='FR')
+        rows = list(Transaction.objects.order_by('timestamp').values(*ROW_FIELDS))
+        fired, _ = plan.evaluate(rows)
+        np.testing.assert_array_equal(fired, [[True, False, False], [False, True, False]])
+        make_transactions(customer, [10])
+        rows = list(Transaction.objects.order_by('timestamp').values(*ROW_FIELDS))
+        self.assertEqual([[rule.name for rule, _ in alerts] for _, alerts in plan.fired(rows)],
+                         [['large_transfer', 'busy_day'], ['large_abroad', 'busy_day'], ['busy_day']])
+        self.assertEqual(plan.stats['busy_day'].alerts, 3)
+
+    def test_bad_rules_are_rejected_when_compiled(self):
+        bad = {
+            'no name': [{'conditions': {'amount__gt': 1}}],
+            'duplicate name': [{'name': 'a', 'conditions': {'amount__gt': 1}},
+                               {'name': 'a', 'conditions': {'amount__lt': 1}}],
+            'no conditions': [{'name': 'a', 'conditions': {}}],
+            'unknown operator': [{'name': 'a', 'conditions': {'amount__between': 1}}],
+            'unknown column': [{'name': 'a', 'conditions': {'balance__gt': 1}}],
+            'unknown window': [{'name': 'a', 'conditions': {'sum_5d__gt': 1}}],
+            'in without a list': [{'name': 'a', 'conditions': {'source_country__in': 'GB'}}],
+            'non-numeric threshold': [{'name': 'a', 'conditions': {'amount__gt': 'lots'}}],
+            'non-numeric list': [{'name': 'a', 'conditions': {'count_24h__in': [1, None]}}],
+            'unknown description field': [{'name': 'a', 'description': '{balance} is high',
+                                           'conditions': {'amount__gt': 1}}],
+        }
+        for case, rules in bad.items():
+            with self.subTest(case), self.assertRaises(ImproperlyConfigured):
+                RulePlan.compile(rules)
+        with self.assertRaisesMessage(ImproperlyConfigured, 'unknown report type'):
+            RegulatoryReporting([{'name': 'a', 'report': 'XYZ', 'conditions': {'amount__gt': 1}}])
+
+
+def per_row_patterns(transactions, now):
+    """RiskAssessmentRules.evaluate_transaction_patterns as it was before the NumPy columns."""
+    if not transactions:
+        return {'overall_risk': 0.5}
+    risk_factors = {'velocity': 0.0, 'amount_variance': 0.0, 'frequency': 0.0}
+    timestamps = [t['timestamp'] for t in transactions]
+    if len(timestamps) > 1:
+        time_diffs = [(timestamps[i] - timestamps[i - 1]).total_seconds() for i in range(1, len(timestamps))]
+        risk_factors['velocity'] = min(1.0, 3600 / max(sum(time_diffs) / len(time_diffs), 1))
+    amounts = [t['amount'] for t in transactions]
+    if len(amounts) > 1:
+        mean_amount = sum(amounts) / len(amounts)
+        variance = sum((x - mean_amount) ** 2 for x in amounts) / len(amounts)
+        risk_factors['amount_variance'] = min(1.0, variance / (mean_amount ** 2))
+    recent_count = sum(1 for t in timestamps if now - t <= timedelta(days=7))
+    risk_factors['frequency'] = min(1.0, recent_count / 50)
+    risk_factors['overall_risk'] = (0.4 * risk_factors['velocity'] + 0.3 * risk_factors['amount_variance']
+                                    + 0.3 * risk_factors['frequency'])
+    return risk_factors
+
+
+class PatternEvaluationTests(TestCase):
+    now = datetime(2026, 3, 10, 12, 30, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        # Empty and one-transaction histories, then longer ones straddling the 7-day window
+        self.histories = [[], [{'amount': 250.0, 'timestamp': self.now - timedelta(days=1)}]]
+        for count in (2, 5, 60, 3):
+            gaps = np.sort(rng.uniform(0, 14 * 86400, count))[::-1]
+            self.histories.append([
+                {'amount': float(amount), 'timestamp': self.now - timedelta(seconds=float(gap))}
+                for amount, gap in zip(rng.lognormal(6, 1.5, count).round(2), gaps)
+            ])
+        self.histories.append([{'amount': 100.0, 'timestamp': self.now - timedelta(days=7)}] * 2)
+
+    def assertFactorsEqual(self, factors, expected):
+        self.assertLessEqual(set(expected), set(factors))
+        for name, value in expected.items():
+            self.assertAlmostEqual(factors[name], value, places=9, msg=name)
+
+    def test_single_customer_matches_the_per_row_rules(self):
+        for history in self.histories:
+            factors = RiskAssessmentRules.evaluate_pattern_arrays(
+                [t['amount'] for t in history], [t['timestamp'] for t in history], now=self.now
+            )
+            self.assertFactorsEqual(factors, per_row_patterns(history, self.now))
+
+    def test_batch_matches_the_per_row_rules(self):
+        rows = [(customer_id, t['amount'], t['timestamp'])
+                for customer_id, history in enumerate(self.histories) for t in history]
+        customer_ids, amounts, timestamps, offsets = RiskAssessmentRules.pattern_columns(rows)
+        # Customers without rows are absent from the columns
+        self.assertEqual(list(customer_ids), [i for i, history in enumerate(self.histories) if history])
+        factors = RiskAssessmentRules.evaluate_pattern_batch(amounts, timestamps, offsets, now=self.now)
+        for i, customer_id in enumerate(customer_ids):
+            self.assertFactorsEqual({name: values[i] for name, values in factors.items()},
+                                    per_row_patterns(self.histories[customer_id], self.now))
+
+    def test_batch_segments_can_be_empty(self):
+        offsets = np.cumsum([0, *(len(history) for history in self.histories)])
+        history = [t for history in self.histories for t in history]
+        factors = RiskAssessmentRules.evaluate_pattern_batch(
+            [t['amount'] for t in history],
+            RiskAssessmentRules.to_datetime64([t['timestamp'] for t in history]),
+            offsets, now=self.now,
+        )
+        for i, history in enumerate(self.histories):
+            self.assertFactorsEqual({name: values[i] for name, values in factors.items()},
+                                    per_row_patterns(history, self.now))
+        self.assertEqual([factors[name][0] for name in RiskAssessmentRules.PATTERN_FACTORS],
+                         [0.0, 0.0, 0.0, 0.5])
+
+
+class StubDetector:
+    """Scores a row as the sum of its features; holds batcher batches until released."""
+    FEATURE_NAMES = TransactionAnomalyDetector.FEATURE_NAMES
+
+    def __init__(self, threshold=0.0):
+        self.threshold = threshold
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def score_batch(self, features):
+        if threading.current_thread().name == 'anomaly-microbatcher':
+            self.batches.append(len(features))
+            self.release.wait()
+        scores = features.sum(axis=1)
+        return scores, scores > self.threshold
+
+
+class MicroBatcherTests(TestCase):
+    def setUp(self):
+        self.detector = StubDetector()
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, 'timed out')
+            time.sleep(0.001)
+
+    def test_concurrent_callers_get_their_own_rows_in_bounded_batches(self):
+        batcher = MicroBatcher(self.detector, max_batch_rows=8, max_wait_ms=50, timeout=10)
+        calls = [np.full((i % 3 + 1, 2), i, dtype=float) for i in range(40)]
+        results = [None] * len(calls)
+        queued = sum(len(features) for features in calls)
+
+        def call(i):
+            results[i] = batcher.score_batch(calls[i])
+
+        # Hold the first batch until every call is queued behind it
+        self.detector.release.clear()
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(len(calls))]
+        for thread in threads:
+            thread.start()
+        self.wait_for(lambda: sum(self.detector.batches) + sum(
+            len(request.features) for request in [*batcher._queue.queue, batcher._carried] if request
+        ) == queued)
+        self.detector.release.set()
+        for thread in threads:
+            thread.join()
+
+        for i, (scores, flags) in enumerate(results):
+            self.assertEqual(scores.tolist(), [2.0 * i] * len(calls[i]))
+            self.assertEqual(flags.tolist(), [i > 0] * len(calls[i]))
+        self.assertEqual(sum(self.detector.batches), queued)
+        self.assertLessEqual(max(self.detector.batches), 8)
+        self.assertGreater(len(self.detector.batches), queued // 8)
+
+        metrics = batcher.metrics.snapshot()
+        self.assertEqual((metrics['batches'], metrics['requests'], metrics['rows'], metrics['timeouts']),
+                         (len(self.detector.batches), len(calls), queued, 0))
+        self.assertEqual(metrics['max_batch_rows'], max(self.detector.batches))
+        self.assertAlmostEqual(metrics['mean_batch_rows'], queued / len(self.detector.batches))
+
+    def test_timed_out_caller_scores_inline_and_its_result_is_discarded(self):
+        batcher = MicroBatcher(self.detector, max_batch_rows=8, max_wait_ms=0, timeout=0.05)
+        requests = []
+        with mock.patch('core.inference._Request', side_effect=lambda features: requests.append(
+            _Request(features)) or requests[-1]):
+            self.detector.release.clear()
+            with self.assertLogs('core.inference', 'WARNING'):
+                scores, _ = batcher.score_batch([[1.0, 2.0]])
+            # Abandoned before the batcher took it off the queue: never scored
+            with self.assertLogs('core.inference', 'WARNING'):
+                batcher.score_batch([[5.0, 5.0]])
+        self.assertEqual(scores.tolist(), [3.0])
+        self.detector.release.set()
+        self.wait_for(lambda: batcher.metrics.batches == 1)
+
+        self.assertEqual(self.detector.batches, [1])
+        for request in requests:
+            self.assertTrue(request.abandoned)
+            self.assertIsNone(request.result)
+            self.assertFalse(request.done.is_set())
+        self.assertEqual(batcher.metrics.snapshot()['timeouts'], 2)
+        # The batcher carries on with later callers
+        self.assertEqual(batcher.score_batch([[4.0, 4.0]])[0].tolist(), [8.0])
+
+    def test_batching_is_off_by_default(self):
+        with mock.patch('core.inference.get_anomaly_detector', return_value=self.detector):
+            self.assertIs(get_anomaly_scorer(), self.detector)
+
+
+class ImportTransactionsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(ML_ARTIFACTS_DIR=self.directory / 'models',
+                                              EXPORT_DIR=self.directory / 'exports')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        now = timezone.now()
+        self.alice = make_customer('alice')
+        self.bob = make_customer('bob')
+        self.existing = make_transactions(self.alice, [300, 400], start=now - timedelta(hours=2))
+        rows = [
+            ('alice', '100.00', 'deposit', now - timedelta(days=3), 'backdated'),
+            ('bob', '50.00', 'transfer', now - timedelta(hours=5), 'first'),
+            ('bob', '10.555', 'transfer', now - timedelta(hours=5), 'too-precise'),
+            ('carol', '20.00', 'deposit', now - timedelta(hours=5), 'unknown'),
+            ('bob', '70.00', 'payment', now - timedelta(hours=4), 'second'),
+            ('bob', '-5.00', 'transfer', now - timedelta(hours=4), 'negative'),
+            ('bob', '5.00', 'wire', now - timedelta(hours=4), 'bad-type'),
+        ]
+        self.path = self.directory / 'transactions.csv'
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['customer', 'amount', 'transaction_type', 'timestamp', 'reference'])
+            writer.writerows((*row[:3], row[3].isoformat(), row[4]) for row in rows)
+
+    def run_import(self, *args):
+        rejects = self.directory / 'rejects.csv'
+        call_command('import_transactions', str(self.path), '--customer-key', 'username',
+                     '--batch-size', '3', '--rejects', str(rejects), *args, stdout=StringIO())
+        with open(rejects, newline='') as f:
+            return [(row['row'], row['reference']) for row in csv.DictReader(f)]
+
+    def imported(self):
+        return {t.reference: t for t in Transaction.objects.exclude(reference=None)}
+
+    def test_rejects_keep_their_file_row_numbers(self):
+        self.assertEqual(self.run_import(), [
+            ('3', 'too-precise'), ('4', 'unknown'), ('6', 'negative'), ('7', 'bad-type'),
+        ])
+        self.assertEqual(set(self.imported()), {'backdated', 'first', 'second'})
+
+    def test_backdated_rows_replay_the_customers_features(self):
+        self.run_import()
+        imported = self.imported()
+        alice = TransactionFeatures.objects.filter(customer=self.alice).order_by('as_of')
+        self.assertEqual(
+            [(row.transaction_id, row.history_length, row.total_amount) for row in alice],
+            [(imported['backdated'].id, 1, 100), (self.existing[0].id, 2, 400), (self.existing[1].id, 3, 800)],
+        )
+        bob = TransactionFeatures.objects.filter(customer=self.bob).order_by('as_of')
+        self.assertEqual([(row.history_length, row.total_amount) for row in bob], [(1, 50), (2, 120)])
+
+        # Every imported row is scored, the backdated one after its features were replayed
+        for transaction in imported.values():
+            self.assertEqual(transaction.screening_status, 'cleared')
+        self.assertFalse(ScoringJob.objects.exists())
+
+    def test_deferred_scoring_queues_every_imported_row(self):
+        self.run_import('--defer-scoring')
+        imported = self.imported()
+        self.assertEqual(set(ScoringJob.objects.values_list('transaction_id', flat=True)),
+                         {t.id for t in imported.values()})
+        self.assertEqual({t.screening_status for t in imported.values()}, {'pending'})
+        self.assertEqual(TransactionFeatures.objects.get(transaction=imported['backdated']).history_length, 1)
+
+        process_jobs(claim_jobs('worker', 10))
+        self.assertEqual({t.screening_status for t in self.imported().values()}, {'cleared'})
+
+
+class TransactionValidationTests(TestCase):
+    def test_batch_errors_are_reported_by_index(self):
+        valid, errors = validate_transactions([
+            {'amount': '10.00', 'transaction_type': ' Deposit ', 'customer_id': 1},
+            {'amount': '1.234', 'transaction_type': 'wire', 'customer_id': 2},
+            {'amount': '0', 'transaction_type': 'transfer', 'customer': 3},
+            {'amount': '25.50', 'transaction_type': 'payment', 'customer': '4', 'description': 'rent'},
+            {'amount': '-3', 'transaction_type': 'transfer', 'customer_id': 5},
+        ])
+        self.assertEqual([(index, row.transaction_type, row.customer_id) for index, row in valid],
+                         [(0, 'deposit', 1), (3, 'payment', 4)])
+        self.assertEqual(valid[1][1].amount, Decimal('25.50'))
+        self.assertEqual(sorted(errors), [1, 2, 4])
+        self.assertEqual(errors[2], {'amount': [AMOUNT_NOT_POSITIVE]})
+        self.assertEqual(errors[4], {'amount': [AMOUNT_NOT_POSITIVE]})
+
+    def test_schema_constraints(self):
+        def errors(**fields):
+            row = {'amount': '10.00', 'transaction_type': 'transfer', 'customer_id': 1, **fields}
+            return validate_transactions([row])[1].get(0, {})
+
+        self.assertEqual(errors(), {})
+        self.assertEqual(errors(transaction_type='wire'), {'transaction_type': [INVALID_TRANSACTION_TYPE]})
+        self.assertEqual(errors(transaction_type='transfers'), {'transaction_type': [INVALID_TRANSACTION_TYPE]})
+        self.assertEqual(list(errors(amount='1.234')), ['amount'])
+        self.assertEqual(errors(amount='1.230'), {})
+        self.assertEqual(errors(amount='0'), {'amount': [AMOUNT_NOT_POSITIVE]})
+        self.assertEqual(errors(amount='-0.01'), {'amount': [AMOUNT_NOT_POSITIVE]})
+        self.assertEqual(errors(amount='1000000'), {'amount': [AMOUNT_NEEDS_EDD]})
+        self.assertEqual(list(errors(customer_id=0)), ['customer_id'])
+        self.assertEqual(list(errors(amount='ten')), ['amount'])
+
+    def test_batch_adapter_keeps_failing_rows_in_place(self):
+        rows = TRANSACTION_BATCH.validate_python([
+            {'amount': '5', 'transaction_type': 'deposit', 'customer_id': 1},
+            {'amount': '5', 'transaction_type': 'deposit'},
+        ])
+        self.assertEqual(rows[0].amount, Decimal('5'))
+        self.assertEqual(error_details(rows[1]), {'customer_id': ['Field required']})
+
+
+class ScreeningTestCase(TestCase):
+    lists = {
+        'version': 'test-1',
+        'jurisdictions': {
+            'XS': {'category': 'sanctioned', 'reason': 'Sanctioned country'},
+            'XH': {'category': 'high_risk', 'reason': 'High-risk jurisdiction'},
+        },
+        'watchlist': [],
+    }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.lists_path = Path(directory.name) / 'lists.json'
+        # Cleanups run last first: the shared lists go back to the real file
+        self.addCleanup(screening_lists.reload)
+        settings_override = override_settings(SCREENING_LISTS_PATH=self.lists_path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        poll = mock.patch.object(screening_lists, 'poll_seconds', 0)
+        poll.start()
+        self.addCleanup(poll.stop)
+        self.write_lists(self.lists)
+
+    def write_lists(self, data):
+        self.lists_path.write_text(json.dumps(data))
+        return screening_lists.reload()
+
+
+class JurisdictionScreeningTests(ScreeningTestCase):
+    def test_sanctioned_countries_block_and_high_risk_ones_flag(self):
+        index = screening_lists.current()
+        self.assertEqual(index.version, 'test-1')
+        self.assertEqual(screening_status(index.screen_transaction('GB', 'xs')), 'blocked')
+        self.assertEqual(screening_status(index.screen_transaction('XH', 'XS')), 'blocked')
+        self.assertEqual(screening_status(index.screen_transaction('XH', 'GB')), 'flagged')
+        self.assertEqual(screening_status(index.screen_transaction('GB', 'FR')), 'cleared')
+        self.assertEqual(screening_status([], suspicious=True), 'flagged')
+
+    def test_scoring_blocks_transactions_to_sanctioned_countries(self):
+        customer = make_customer()
+        blocked, flagged, cleared = make_transactions(customer, [100, 100, 100])
+        for transaction, country in ((blocked, 'XS'), (flagged, 'XH'), (cleared, 'FR')):
+            transaction.destination_country = country
+            transaction.save(update_fields=['destination_country'])
+        score_transactions(Transaction.objects.select_related('customer').order_by('id'),
+                           detector=StubDetector(threshold=np.inf))
+
+        statuses = dict(Transaction.objects.values_list('id', 'screening_status'))
+        self.assertEqual([statuses[t.id] for t in (blocked, flagged, cleared)],
+                         ['blocked', 'flagged', 'cleared'])
+        hit = ScreeningHit.objects.get(transaction=blocked)
+        self.assertEqual((hit.field, hit.value, hit.category, hit.list_version),
+                         ('destination_country', 'XS', 'sanctioned', 'test-1'))
+
+    def test_customers_in_listed_countries_are_escalated_when_saved(self):
+        sanctioned = make_customer('sanctioned', country_code='XS')
+        high_risk = make_customer('high_risk', country_code='XH')
+        self.assertEqual(Customer.objects.get(id=sanctioned.id).compliance_status, 'non_compliant')
+        self.assertEqual(Customer.objects.get(id=high_risk.id).compliance_status, 'review_required')
+        self.assertEqual(make_customer('domestic').compliance_status, 'pending')
+
+    def test_rescreen_applies_new_lists_to_the_book_once(self):
+        customer = make_customer(country_code='FR')
+        make_transactions(customer, [100, 200], destination_country='FR')
+        score_transactions(Transaction.objects.select_related('customer').order_by('id'),
+                           detector=StubDetector(threshold=np.inf))
+        index = self.write_lists({**self.lists, 'version': 'test-2', 'jurisdictions': {
+            **self.lists['jurisdictions'], 'FR': {'category': 'sanctioned', 'reason': 'Newly sanctioned'},
+        }})
+
+        counts = rescreen_book(index)
+        self.assertEqual((counts['customers'], counts['customer_hits'], counts['transactions'],
+                          counts['transaction_hits'], counts['transactions_blocked']), (1, 1, 2, 2, 2))
+        self.assertEqual(set(Transaction.objects.values_list('screening_status', flat=True)), {'blocked'})
+        self.assertEqual(Customer.objects.get(id=customer.id).compliance_status, 'non_compliant')
+        self.assertEqual(ScreeningHit.objects.filter(list_version='test-2').count(), 3)
+
+        # A rerun finds the same hits but records and changes nothing
+        counts = rescreen_book(index)
+        self.assertEqual((counts['transaction_hits'], counts['transactions_blocked']), (2, 0))
+        self.assertEqual(ScreeningHit.objects.filter(list_version='test-2').count(), 3)
+
+
+class WatchlistScreeningTests(ScreeningTestCase):
+    lists = {
+        **ScreeningTestCase.lists,
+        'watchlist': [
+            {'id': 'WL-1', 'name': 'Viktor Petrov', 'category': 'sanctioned', 'country': 'XS'},
+            {'id': 'WL-2', 'name': 'Maria Gonzalez Ruiz', 'category': 'pep'},
+            {'id': 'WL-3', 'name': 'Victor Petrova', 'category': 'pep'},
+            {'id': 'WL-4', 'name': 'Li Na', 'category': 'pep'},
+        ],
+    }
+
+    def test_name_index_finds_exactly_the_names_above_the_threshold(self):
+        rng = np.random.default_rng(3)
+        letters = np.array(list('abcdefghijklmnopqrstuvwxyz  '))
+        names = [''.join(rng.choice(letters, rng.integers(2, 18))).strip() or 'x' for _ in range(400)]
+        # Spelling variants of a few names, so some queries have several close matches
+        names += [name[:-1] + 'e' for name in names[:40]] + [name + 'a' for name in names[:40]]
+        entries = [WatchlistEntry(f'E{i}', name, 'pep', None) for i, name in enumerate(names)]
+        index = NameIndex(entries)
+
+        def dice(a, b):
+            a, b = name_grams(a), name_grams(b)
+            return 2 * len(a & b) / (len(a) + len(b))
+
+        for query in [*names[:60], 'maria gonzalez', 'zz', 'a']:
+            for threshold in (0.5, 0.7, 0.9):
+                expected = {entry.id: dice(query, entry.name) for entry in entries
+                            if dice(query, entry.name) >= threshold}
+                matches = index.match(query, threshold)
+                self.assertEqual({entry.id for entry, _ in matches}, set(expected))
+                for entry, score in matches:
+                    self.assertAlmostEqual(score, expected[entry.id])
+                # Best first, ties by id
+                self.assertEqual(matches, sorted(matches, key=lambda match: (-match[1], match[0].id)))
+                candidates = {index.entries[i].id for i in index.candidates(name_grams(query), threshold)}
+                self.assertLessEqual(set(expected), candidates)
+
+    def test_variants_of_watchlist_names_are_ranked_by_similarity(self):
+        index = screening_lists.current()
+        self.assertEqual([(entry.id, score) for entry, score in index.watchlist_matches('PETROV, viktor')],
+                         [('WL-1', 1.0)])
+        self.assertEqual([entry.id for entry, _ in index.watchlist_matches('Viktor Petrova', 0.6)],
+                         ['WL-1', 'WL-3'])
+        self.assertEqual([entry.id for entry, _ in index.watchlist_matches('María González-Ruiz')], ['WL-2'])
+        self.assertEqual([entry.id for entry, _ in index.watchlist_matches('Na Li')], ['WL-4'])
+        self.assertEqual(index.watchlist_matches('Alice Smith'), [])
+
+    def test_new_name_matches_open_one_triggered_assessment(self):
+        customer = make_customer()
+        index = screening_lists.current()
+        hits = index.screen_customer('GB', 'Maria Gonzales Ruiz')
+        new = apply_customer_hits({customer.id: hits}, index)
+        self.assertEqual(list(new), [customer.id])
+        assessment = RiskAssessment.objects.get(customer=customer)
+        self.assertEqual(assessment.assessment_type, 'triggered')
+        self.assertEqual(assessment.overall_score, hits[0].score)
+        self.assertEqual(assessment.risk_factors['watchlist_matches'][0]['name'], 'Maria Gonzalez Ruiz')
+        self.assertEqual(Customer.objects.get(id=customer.id).compliance_status, 'review_required')
+
+        # The same hits under the same list version are not recorded again
+        self.assertEqual(apply_customer_hits({customer.id: hits}, index), {})
+        self.assertEqual(RiskAssessment.objects.filter(customer=customer).count(), 1)
+
+    def test_rescreen_opens_reviews_for_new_watchlist_entries(self):
+        customer = make_customer()
+        User.objects.filter(id=customer.user_id).update(first_name='Amara', last_name='Okafor')
+        index = self.write_lists({**self.lists, 'version': 'test-2', 'watchlist': [
+            *self.lists['watchlist'], {'id': 'WL-5', 'name': 'Amara Okafor', 'category': 'sanctioned'},
+        ]})
+        counts = rescreen_book(index)
+        self.assertEqual((counts['customer_hits'], counts['watchlist_reviews']), (1, 1))
+        self.assertEqual(RiskAssessment.objects.get(customer=customer).assessment_type, 'triggered')
+        self.assertEqual(Customer.objects.get(id=customer.id).compliance_status, 'non_compliant')
+        self.assertEqual(rescreen_book(index)['watchlist_reviews'], 0)
+
+    def test_renaming_the_user_rescreens_the_customer(self):
+        customer = make_customer()
+        user = customer.user
+        self.assertFalse(ScreeningHit.objects.exists())
+        user.first_name, user.last_name = 'Viktor', 'Petrov'
+        user.save()
+        hit = ScreeningHit.objects.get(customer=customer, field='name')
+        self.assertEqual((hit.value, hit.category), ('Viktor Petrov', 'sanctioned'))
+        self.assertEqual(RiskAssessment.objects.get(customer=customer).assessment_type, 'triggered')
+        self.assertEqual(Customer.objects.get(id=customer.id).compliance_status, 'non_compliant')
+
+        with mock.patch('core.signals.screen_customer') as screen:
+            user.save(update_fields=['last_login'])
+        self.assertFalse(screen.called)
+
+
+def edge(id, customer_id, amount, at, country, transaction_type='transfer'):
+    """An :data:`~core.graph.EDGE_FIELDS` row: deposits come from ``country``, the rest go to it."""
+    inbound = transaction_type == 'deposit'
+    return (id, customer_id, amount, at, transaction_type,
+            country if inbound else 'GB', 'GB' if inbound else country)
+
+
+@override_settings(TRANSACTION_GRAPH_WINDOW_HOURS=72, TRANSACTION_GRAPH_MAX_CYCLE_LENGTH=4,
+                   TRANSACTION_GRAPH_FAN_LIMIT=5, TRANSACTION_GRAPH_PASS_THROUGH_RATIO=0.9,
+                   TRANSACTION_GRAPH_PASS_THROUGH_MIN_AMOUNT=1000, TRANSACTION_GRAPH_CYCLE_MIN_AMOUNT=1000,
+                   TRANSACTION_GRAPH_CYCLE_AMOUNT_RATIO=0.8)
+class TransactionGraphTests(TestCase):
+    start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+
+    def at(self, hours):
+        return self.start + timedelta(hours=hours)
+
+    def signals(self, edges, queries, **kwargs):
+        graph = FlowGraph([Segment(*edge_columns(edges))], domestic_countries=['GB'])
+        return graph.signals(queries, **kwargs)
+
+    def test_round_trip_closes_a_cycle_only_for_matching_amounts(self):
+        cases = {
+            # Received from France, sent back the same money
+            'matching': ([edge(1, 1, 5000, self.at(0), 'FR', 'deposit')], 4500, 2),
+            'different amount': ([edge(1, 1, 5000, self.at(0), 'FR', 'deposit')], 1500, 0),
+            'below the minimum': ([edge(1, 1, 900, self.at(0), 'FR', 'deposit')], 900, 0),
+            'other country': ([edge(1, 1, 5000, self.at(0), 'DE', 'deposit')], 5000, 0),
+            # Arrived after the money left
+            'out of order': ([edge(1, 1, 5000, self.at(6), 'FR', 'deposit')], 5000, 0),
+        }
+        for case, (edges, amount, length) in cases.items():
+            with self.subTest(case):
+                closing = edge(2, 1, amount, self.at(5), 'FR')
+                self.assertEqual(self.signals(edges + [closing], [closing])['cycle_length'][0], length)
+        # Domestic round trips are not candidates
+        edges = [edge(1, 1, 5000, self.at(0), 'GB', 'deposit'), edge(2, 1, 5000, self.at(5), 'GB')]
+        self.assertEqual(self.signals(edges, edges[1:])['cycle_length'][0], 0)
+
+    def test_cycle_through_another_customer(self):
+        edges = [
+            edge(1, 1, 5000, self.at(0), 'FR'),
+            edge(2, 2, 4800, self.at(1), 'FR', 'deposit'),
+            edge(3, 2, 4700, self.at(2), 'DE'),
+        ]
+        closing = edge(4, 1, 4600, self.at(3), 'DE', 'deposit')
+        self.assertEqual(self.signals(edges + [closing], [closing])['cycle_length'][0], 4)
+        self.assertEqual(self.signals(edges + [closing], [closing], max_cycle_length=3)['cycle_length'][0], 0)
+        # One leg carrying a different amount breaks the chain
+        broken = [*edges[:2], edge(3, 2, 1000, self.at(2), 'DE')]
+        self.assertEqual(self.signals(broken + [closing], [closing])['cycle_length'][0], 0)
+        # So does a leg out of time order
+        reordered = [*edges[:2], edge(3, 2, 4700, self.at(0.5), 'DE')]
+        self.assertEqual(self.signals(reordered + [closing], [closing])['cycle_length'][0], 0)
+
+    def test_fan_counts_distinct_foreign_countries(self):
+        countries = ['FR', 'DE', 'IT', 'ES', 'NL', 'FR', 'GB']
+        edges = [edge(i, 1, 100, self.at(i), country) for i, country in enumerate(countries)]
+        edges += [edge(10 + i, 2, 100, self.at(i), country, 'deposit') for i, country in enumerate(countries[:3])]
+        queries = [edge(20, 1, 100, self.at(10), 'PT'), edge(21, 2, 100, self.at(10), 'PT')]
+        signals = self.signals(edges, queries)
+        self.assertEqual(signals['fan_out'].tolist(), [5, 0])
+        self.assertEqual(signals['fan_in'].tolist(), [0, 3])
+        self.assertEqual(graph_risk(signals).tolist(), [PATTERN_RISK['fan'], 0.0])
+
+    def test_pass_through_compares_outflow_with_inflow(self):
+        edges = [edge(1, 1, 6000, self.at(0), 'FR', 'deposit'), edge(2, 1, 4000, self.at(1), 'DE', 'deposit'),
+                 edge(3, 1, 9500, self.at(2), 'IT')]
+        signals = self.signals(edges, edges)
+        # Only outgoing transactions are judged, on the window up to and including them
+        self.assertEqual(signals['pass_through'].tolist(), [0.0, 0.0, 0.95])
+        self.assertEqual(graph_risk(signals)[2], PATTERN_RISK['pass_through'])
+        small = [edge(1, 1, 600, self.at(0), 'FR', 'deposit'), edge(2, 1, 590, self.at(1), 'IT')]
+        self.assertEqual(self.signals(small, small)['pass_through'].tolist(), [0.0, 0.0])
+
+    def test_window_includes_its_first_second_and_nothing_before(self):
+        query = edge(9, 1, 5000, self.at(72), 'IT')
+        inside = [edge(1, 1, 5000, self.at(0), 'FR', 'deposit'), edge(2, 1, 100, self.at(0), 'FR')]
+        signals = self.signals(inside + [query], [query])
+        self.assertEqual((signals['fan_in'][0], signals['fan_out'][0]), (1, 2))
+        self.assertEqual(signals['pass_through'][0], 5000 / 5100)
+        late = self.start - timedelta(seconds=1)
+        outside = [edge(1, 1, 5000, late, 'FR', 'deposit'), edge(2, 1, 100, late, 'FR')]
+        signals = self.signals(outside + [query], [query])
+        self.assertEqual((signals['fan_in'][0], signals['fan_out'][0]), (0, 1))
+        self.assertEqual(signals['pass_through'][0], 0.0)
+
+        # Cycles are closed by earlier transactions only
+        closing = edge(2, 1, 5000, self.at(0), 'FR')
+        self.assertEqual(self.signals([inside[0], closing], [closing])['cycle_length'][0], 0)
+
+    def test_incremental_adds_match_a_full_load(self):
+        now = timezone.now()
+        customers = [make_customer(f'customer{i}') for i in range(3)]
+        rng = np.random.default_rng(2)
+        countries = ['GB', 'FR', 'DE', 'IT']
+        transactions = [
+            Transaction.objects.create(
+                customer=customers[rng.integers(3)], amount=Decimal(int(rng.integers(500, 6000))),
+                transaction_type=str(rng.choice(['deposit', 'transfer'])),
+                source_country=str(rng.choice(countries)), destination_country=str(rng.choice(countries)),
+                timestamp=now - timedelta(hours=int(rng.integers(1, 100))),
+            ) for _ in range(60)
+        ]
+        full = TransactionGraph(poll_seconds=3600).current()
+
+        Transaction.objects.filter(id__in=[t.id for t in transactions[20:]]).delete()
+        graph = TransactionGraph(poll_seconds=3600, fold_fraction=2, min_recent=8)
+        graph.current()
+        for i in range(20, 60, 7):
+            graph.add(transactions[i:i + 7])
+            # Adding the same rows again, or rows already loaded, changes nothing
+            graph.add(transactions[i - 3:i + 7])
+        incremental = graph.add(transactions)
+        self.assertEqual(len(incremental), len(full))
+        self.assertEqual(len(incremental), 60)
+        expected, actual = full.signals(transactions), incremental.signals(transactions)
+        for name in expected:
+            np.testing.assert_array_equal(actual[name], expected[name])
+
+
+class KeysetListTests(TestCase):
+    def setUp(self):
+        self.customer = make_customer()
+        self.other = make_customer('bob')
+        now = timezone.now()
+        # Runs of rows sharing a timestamp, split across pages
+        self.transactions = [
+            Transaction.objects.create(customer=customer, amount=100, transaction_type='deposit',
+                                       timestamp=now - timedelta(minutes=minute))
+            for customer, minute in zip([self.customer, self.other] * 6,
+                                        (1, 1, 1, 1, 2, 3, 3, 3, 3, 3, 4, 5))
+        ]
+        self.factory = RequestFactory()
+
+    def page(self, query):
+        return _transaction_page(self.factory.get(f'/transactions/rows/?{query}'))
+
+    def walk(self, query):
+        ids = []
+        while query is not None:
+            page = self.page(query)
+            ids += [row.id for row in page['rows']]
+            query = page['next_query']
+        return ids
+
+    def test_pages_follow_timestamp_then_id_across_duplicates(self):
+        ordered = sorted(self.transactions, key=lambda t: (t.timestamp, t.id))
+        for sort, expected in (('timestamp', ordered), ('-timestamp', ordered[::-1])):
+            for page_size in (1, 2, 3, 4, 7):
+                with self.subTest(sort=sort, page_size=page_size):
+                    self.assertEqual(self.walk(f'sort={sort}&page_size={page_size}'), [t.id for t in expected])
+
+    def test_tampered_cursor_restarts_from_the_first_page(self):
+        first = self.page('page_size=3')
+        second = self.page(first['next_query'])
+        self.assertNotEqual([row.id for row in second['rows']], [row.id for row in first['rows']])
+        params = QueryDict(first['next_query'], mutable=True)
+        cursor = params['after']
+        for tampered in (cursor[:-1] + ('A' if cursor[-1] != 'A' else 'B'), cursor + 'x', 'garbage'):
+            with self.subTest(cursor=tampered):
+                params['after'] = tampered
+                self.assertEqual([row.id for row in self.page(params.urlencode())['rows']],
+                                 [row.id for row in first['rows']])
+
+    def test_customer_filter_ignores_values_that_are_not_ascii_digits(self):
+        mine = [t.id for t in self.transactions if t.customer_id == self.customer.id]
+        self.assertEqual(sorted(self.walk(f'customer={self.customer.id}')), sorted(mine))
+        for value in ('²', '١', 'x', '-1'):
+            with self.subTest(customer=value):
+                page = self.page(f'customer={value}&page_size=100')
+                self.assertEqual(len(page['rows']), len(self.transactions))
+                self.assertEqual(page['filters'], {})
+
+        self.client.force_login(User.objects.create_user('officer'))
+        response = self.client.get('/transactions/rows/', {'customer': '²', 'page_size': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('after=', response.json()['next'])
@@ -1,29 +1,102 @@
 """Validation utilities for AML service."""
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from typing import Dict, List, Optional
-from pydantic import BaseModel, Field, validator
+from pydantic import (AliasChoices, BaseModel, ConfigDict, Field, StringConstraints, TypeAdapter,
+                      ValidationError, WrapValidator)
+from typing_extensions import Annotated
 import re
 
+import numpy as np
+import pandas as pd
+
+TRANSACTION_TYPES = frozenset({'transfer', 'deposit', 'withdrawal', 'payment'})
+EDD_AMOUNT_THRESHOLD = 1_000_000  # Amounts at or above need enhanced due diligence
+
+AMOUNT_NOT_POSITIVE = 'Transaction amount must be positive'
+AMOUNT_NEEDS_EDD = 'Transactions over 1M require enhanced due diligence'
+INVALID_TRANSACTION_TYPE = f'Transaction type must be one of: {set(TRANSACTION_TYPES)}'
+
 class TransactionData(BaseModel):
-    amount: float
-    transaction_type: str
-    customer_id: int
+    # Every rule is a schema constraint, so validation runs entirely in
+    # pydantic-core; RULE_MESSAGES restores the AML wording of the errors
+    model_config = ConfigDict(str_strip_whitespace=True)
+    
+    amount: Decimal = Field(gt=0, lt=EDD_AMOUNT_THRESHOLD, max_digits=15, decimal_places=2)
+    transaction_type: Annotated[str, StringConstraints(
+        to_lower=True, max_length=50, pattern=f'(?i)^(?:{"|".join(sorted(TRANSACTION_TYPES))})$'
+    )]
+    customer_id: int = Field(gt=0, validation_alias=AliasChoices('customer_id', 'customer'))
     description: Optional[str] = None
+
+RULE_MESSAGES = {
+    ('amount', 'greater_than'): AMOUNT_NOT_POSITIVE,
+    ('amount', 'less_than'): AMOUNT_NEEDS_EDD,
+    ('transaction_type', 'string_pattern_mismatch'): INVALID_TRANSACTION_TYPE,
+}
+
+def _keep_row_errors(value, handler):
+    # A failing row yields its error in place, so the rest of the batch survives
+    try:
+        return handler(value)
+    except ValidationError as e:
+        return e
+
+# Built once at import: the list schema is compiled by pydantic-core, so a
+# whole batch is validated in one call instead of one model call per row
+TRANSACTION_BATCH = TypeAdapter(List[Annotated[TransactionData, WrapValidator(_keep_row_errors)]])
+
+def error_details(exc: ValidationError) -> Dict[str, List[str]]:
+    """Return the errors of one row as DRF-style ``{field: [message]}``."""
+    details = {}
+    for error in exc.errors(include_url=False):
+        field = '.'.join(str(part) for part in error['loc']) or 'non_field_errors'
+        details.setdefault(field, []).append(RULE_MESSAGES.get((field, error['type']), error['msg']))
+    return details
+
+def validate_transactions(rows: List[Dict]):
+    """
+    Validate a batch of raw transaction rows with one compiled call.
     
-    @validator('amount')
-    def validate_amount(cls, v):
-        if v <= 0:
-            raise ValueError('Transaction amount must be positive')
-        if v >= 1_000_000:
-            raise ValueError('Transactions over 1M require enhanced due diligence')
-        return v
+    Returns ``(valid, errors)``: ``(index, TransactionData)`` pairs for the
+    rows that pass, in input order, and ``{index: {field: [message]}}`` for
+    those that do not.
+    """
+    valid = []
+    errors = {}
+    for index, row in enumerate(TRANSACTION_BATCH.validate_python(rows)):
+        if isinstance(row, ValidationError):
+            errors[index] = error_details(row)
+        else:
+            valid.append((index, row))
+    return valid, errors
+
+def validate_transaction_frame(frame: pd.DataFrame):
+    """
+    Apply the ``TransactionData`` amount and type rules to a frame of rows at once.
     
-    @validator('transaction_type')
-    def validate_transaction_type(cls, v):
-        valid_types = {'transfer', 'deposit', 'withdrawal', 'payment'}
-        if v.lower() not in valid_types:
-            raise ValueError(f'Transaction type must be one of: {valid_types}')
-        return v.lower()
+    ``frame`` has raw ``amount`` and ``transaction_type`` columns. Returns
+    ``(amounts, transaction_types, errors)``: the parsed amounts, the
+    normalised types and, per row, the first rule it breaks ('' if none).
+    """
+    amounts = pd.to_numeric(frame['amount'], errors='coerce')
+    transaction_types = frame['transaction_type'].astype(str).str.strip().str.lower()
+    errors = np.select(
+        [
+            amounts.isna(),
+            amounts <= 0,
+            amounts >= EDD_AMOUNT_THRESHOLD,
+            ~transaction_types.isin(TRANSACTION_TYPES),
+        ],
+        [
+            'Transaction amount must be a number',
+            AMOUNT_NOT_POSITIVE,
+            AMOUNT_NEEDS_EDD,
+            INVALID_TRANSACTION_TYPE,
+        ],
+        default='',
+    )
+    return amounts, transaction_types, pd.Series(errors, index=frame.index)
 
 class DocumentVerification:
     """Document verification system for KYC/AML compliance."""
@@ -68,48 +141,125 @@ class DocumentVerification:
 class RiskAssessmentRules:
     """Rules engine for risk assessment."""
     
+    PATTERN_FACTORS = ('velocity', 'amount_variance', 'frequency', 'overall_risk')
+    FREQUENCY_WINDOW = timedelta(days=7)
+    FREQUENCY_CAP = 50  # Transactions per week scored as maximum frequency risk
+    
     @staticmethod
     def evaluate_transaction_patterns(transactions: List[Dict]) -> Dict[str, float]:
         """
         Evaluate transaction patterns for risk indicators.
         Returns dict of risk factors and their scores.
         """
-        if not transactions:
-            return {'overall_risk': 0.5}  # Default medium risk
+        return RiskAssessmentRules.evaluate_pattern_arrays(
+            [t['amount'] for t in transactions],
+            [t['timestamp'] for t in transactions]
+        )
+    
+    @staticmethod
+    def generate_recommendations(risk_factors: Dict[str, float]) -> str:
+        """Turn transaction pattern risk factors into reviewer recommendations."""
+        recommendations = []
+        
+        if risk_factors.get('velocity', 0.0) > 0.7:
+            recommendations.append('High transaction velocity detected. Consider implementing cooling-off periods.')
+        if risk_factors.get('amount_variance', 0.0) > 0.7:
+            recommendations.append('Unusual transaction amount patterns detected. Review for potential structuring.')
+        if risk_factors.get('frequency', 0.0) > 0.7:
+            recommendations.append('High-frequency trading patterns detected. Enhanced due diligence recommended.')
             
-        risk_factors = {
-            'velocity': 0.0,  # Transaction velocity risk
-            'amount_variance': 0.0,  # Unusual amount patterns
-            'frequency': 0.0,  # High-frequency trading risk
-            'overall_risk': 0.0
-        }
+        return '\n'.join(recommendations) if recommendations else 'No specific recommendations at this time.'
+    
+    @classmethod
+    def evaluate_pattern_arrays(cls, amounts, timestamps, now: Optional[datetime] = None) -> Dict[str, float]:
+        """
+        Evaluate the transaction patterns of one customer from column arrays.
         
-        # Calculate transaction velocity
-        timestamps = [t['timestamp'] for t in transactions]
-        if len(timestamps) > 1:
-            time_diffs = [(timestamps[i] - timestamps[i-1]).total_seconds() 
-                         for i in range(1, len(timestamps))]
-            avg_velocity = sum(time_diffs) / len(time_diffs)
-            risk_factors['velocity'] = min(1.0, 3600 / max(avg_velocity, 1))
+        ``amounts`` and ``timestamps`` are parallel sequences (for example
+        from ``values_list('amount', 'timestamp')``) in transaction order.
+        Returns the same factors as :meth:`evaluate_transaction_patterns`.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        if not len(amounts):
+            return {'overall_risk': 0.5}  # Default medium risk
+        factors = cls.evaluate_pattern_batch(
+            amounts, cls.to_datetime64(timestamps), np.array([0, len(amounts)]), now=now
+        )
+        return {name: float(values[0]) for name, values in factors.items()}
+    
+    @classmethod
+    def evaluate_pattern_batch(cls, amounts, timestamps, offsets, now: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+        """
+        Evaluate the transaction patterns of many customers in one pass.
         
-        # Calculate amount variance risk
-        amounts = [t['amount'] for t in transactions]
-        if len(amounts) > 1:
-            mean_amount = sum(amounts) / len(amounts)
-            variance = sum((x - mean_amount) ** 2 for x in amounts) / len(amounts)
-            risk_factors['amount_variance'] = min(1.0, variance / (mean_amount ** 2))
+        Transactions are laid out as segmented columns: ``amounts`` and
+        ``timestamps`` (``datetime64``, UTC) hold every customer's rows back to
+        back, and customer ``i`` owns rows ``offsets[i]:offsets[i + 1]``.
+        Returns one array per factor, indexed by customer. A customer with no
+        transactions gets the default overall risk of 0.5 and zero factors.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        micros = np.asarray(timestamps).astype('datetime64[us]').astype(np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        counts = np.diff(offsets)
+        segment = np.repeat(np.arange(len(counts)), counts)
+        nonempty = counts > 0
+        multiple = counts > 1
         
-        # Calculate frequency risk
-        time_window = timedelta(days=7)
-        recent_count = sum(1 for t in timestamps 
-                         if datetime.now() - t <= time_window)
-        risk_factors['frequency'] = min(1.0, recent_count / 50)  # Cap at 50 transactions/week
+        # Transaction velocity: the mean gap between consecutive transactions
+        # telescopes to (last - first) / (n - 1)
+        velocity = np.zeros(len(counts))
+        first, last = offsets[:-1][multiple], offsets[1:][multiple] - 1
+        avg_gap = (micros[last] - micros[first]) / 1e6 / (counts[multiple] - 1)
+        velocity[multiple] = np.minimum(1.0, 3600 / np.maximum(avg_gap, 1))
         
-        # Calculate overall risk score
-        risk_factors['overall_risk'] = (
-            0.4 * risk_factors['velocity'] +
-            0.3 * risk_factors['amount_variance'] +
-            0.3 * risk_factors['frequency']
+        # Amount variance relative to the squared mean amount
+        amount_variance = np.zeros(len(counts))
+        mean = np.zeros(len(counts))
+        np.divide(np.bincount(segment, weights=amounts, minlength=len(counts)), counts,
+                  out=mean, where=nonempty)
+        deviation = amounts - mean[segment]
+        variance = np.bincount(segment, weights=deviation * deviation, minlength=len(counts))
+        amount_variance[multiple] = np.minimum(
+            1.0, variance[multiple] / counts[multiple] / mean[multiple] ** 2
         )
         
-        return risk_factors
+        # Transactions within the frequency window
+        now = cls.to_datetime64([now or datetime.now(timezone.utc)])[0]
+        window_start = (now - np.timedelta64(cls.FREQUENCY_WINDOW)).astype('datetime64[us]').astype(np.int64)
+        recent = np.bincount(segment, weights=micros >= window_start, minlength=len(counts))
+        frequency = np.minimum(1.0, recent / cls.FREQUENCY_CAP)
+        
+        overall_risk = 0.4 * velocity + 0.3 * amount_variance + 0.3 * frequency
+        overall_risk[~nonempty] = 0.5
+        return {
+            'velocity': velocity,
+            'amount_variance': amount_variance,
+            'frequency': frequency,
+            'overall_risk': overall_risk
+        }
+    
+    @staticmethod
+    def pattern_columns(rows):
+        """
+        Build segmented columns from ``(customer_id, amount, timestamp)`` rows.
+        
+        Rows must be grouped by customer, e.g.
+        ``values_list('customer_id', 'amount', 'timestamp').order_by('customer_id', 'timestamp', 'id')``.
+        Returns ``(customer_ids, amounts, timestamps, offsets)`` ready for
+        :meth:`evaluate_pattern_batch`.
+        """
+        frame = pd.DataFrame.from_records(rows, columns=['customer_id', 'amount', 'timestamp'])
+        customer_ids = frame['customer_id'].to_numpy(dtype=np.int64)
+        starts = np.flatnonzero(np.diff(customer_ids, prepend=customer_ids[:1] - 1))
+        return (
+            customer_ids[starts],
+            frame['amount'].to_numpy(dtype=float),
+            RiskAssessmentRules.to_datetime64(frame['timestamp']),
+            np.append(starts, len(frame))
+        )
+    
+    @staticmethod
+    def to_datetime64(timestamps) -> np.ndarray:
+        """Convert datetimes to a ``datetime64[us]`` UTC array; naive values are taken as UTC."""
+        return pd.to_datetime(pd.Series(timestamps), utc=True).dt.tz_localize(None).to_numpy('datetime64[us]')
@@ -6,105 +6,57 @@ from django.utils import timezone
 from datetime import timedelta
 from django.http import JsonResponse
 from django.core.exceptions import PermissionDenied
+from .dashboard import get_dashboard_metrics
 from .models import Customer, Transaction, RiskAssessment, VerificationDocument
 
 @login_required
 def dashboard(request):
-    """Main dashboard view showing AML compliance metrics and recent activity."""
-    now = timezone.now()
-    thirty_days_ago = now - timedelta(days=30)
+    """Main dashboard view showing AML compliance metrics and recent activity.
     
-    # Risk metrics
-    high_risk_count = Customer.objects.filter(risk_score__gte=0.7).count()
-    suspicious_transactions = Transaction.objects.filter(
-        timestamp__gte=thirty_days_ago,
-        is_suspicious=True
-    ).count()
-    pending_verifications = VerificationDocument.objects.filter(
-        verification_status='pending'
-    ).count()
-    
-    # Risk distribution
-    total_customers = Customer.objects.count()
-    risk_distribution = {
-        'low': Customer.objects.filter(risk_score__lt=0.3).count(),
-        'medium': Customer.objects.filter(risk_score__gte=0.3, risk_score__lt=0.7).count(),
-        'high': high_risk_count
-    }
-    
-    # Transaction trend data (last 7 days)
-    transaction_data = Transaction.objects.filter(
-        timestamp__gte=now - timedelta(days=7)
-    ).values('timestamp__date').annotate(
-        volume=Count('id')
-    ).order_by('timestamp__date')
-    
-    transaction_dates = [str(data['timestamp__date']) for data in transaction_data]
-    transaction_volumes = [data['volume'] for data in transaction_data]
-    
-    # Recent activity
-    recent_activities = []
-    
-    # Add recent transactions
-    recent_transactions = Transaction.objects.filter(
-        timestamp__gte=thirty_days_ago
-    ).order_by('-timestamp')[:5]
-    for trans in recent_transactions:
-        status = 'flagged' if trans.is_suspicious else 'cleared'
-        recent_activities.append({
-            'timestamp': trans.timestamp,
-            'type': 'Transaction',
-            'details': f'{trans.transaction_type} of £{trans.amount}',
-            'status': status
-        })
-    
-    # Add recent verifications
-    recent_verifications = VerificationDocument.objects.filter(
-        upload_date__gte=thirty_days_ago
-    ).order_by('-upload_date')[:5]
-    for doc in recent_verifications:
-        recent_activities.append({
-            'timestamp': doc.upload_date,
-            'type': 'Document Verification',
-            'details': f'{doc.document_type} for {doc.customer.user.username}',
-            'status': doc.verification_status
-        })
-    
-    # Add recent risk assessments
-    recent_assessments = RiskAssessment.objects.filter(
-        assessment_date__gte=thirty_days_ago
-    ).order_by('-assessment_date')[:5]
-    for assessment in recent_assessments:
-        status = 'high' if assessment.overall_score >= 0.7 else 'medium' if assessment.overall_score >= 0.3 else 'low'
-        recent_activities.append({
-            'timestamp': assessment.assessment_date,
-            'type': 'Risk Assessment',
-            'details': f'Score: {assessment.overall_score:.2f}',
-            'status': status
-        })
-    
-    # Sort all activities by timestamp
-    recent_activities.sort(key=lambda x: x['timestamp'], reverse=True)
-    recent_activities = recent_activities[:10]
-    
-    context = {
-        'high_risk_count': high_risk_count,
-        'suspicious_transactions_count': suspicious_transactions,
-        'pending_verifications_count': pending_verifications,
-        'risk_distribution': risk_distribution,
-        'transaction_dates': transaction_dates,
-        'transaction_volumes': transaction_volumes,
-        'recent_activities': recent_activities,
-        'last_update': now
-    }
-    
-    return render(request, 'dashboard.html', context)
+    Metrics come from the cached dashboard service, which is refreshed after
+    transactions, documents or assessments are written.
+    """
+    return render(request, 'dashboard.html', get_dashboard_metrics())
 
 from django.contrib import messages
+from django.core.paginator import Paginator
 from django.db import DatabaseError
 from django.db.models import OuterRef, Subquery, Count, Case, When, F, FloatField, Q
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.dateparse import parse_date
+from django.core import signing
+from django.template.loader import render_to_string
+from django.urls import reverse
+from datetime import datetime, time, timedelta
+from .keyset import keyset_filter
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Sort keys accepted by customer_list, mapped to their ORM ordering
+CUSTOMER_SORT_FIELDS = {
+    'risk_score': 'risk_score',
+    '-risk_score': '-risk_score',
+    'name': 'user__username',
+    '-name': '-user__username',
+    'created': 'created_at',
+    '-created': '-created_at',
+    'assessed': F('latest_assessment_date').asc(nulls_first=True),
+    '-assessed': F('latest_assessment_date').desc(nulls_last=True),
+}
+
+RISK_LEVEL_FILTERS = {
+    'low': Q(risk_score__lt=0.3),
+    'medium': Q(risk_score__gte=0.3, risk_score__lt=0.7),
+    'high': Q(risk_score__gte=0.7),
+}
+
+def _page_size(request):
+    """Return the requested page size, bounded to MAX_PAGE_SIZE."""
+    try:
+        return max(1, min(int(request.GET.get('page_size', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return DEFAULT_PAGE_SIZE
 
 @login_required
 def customer_list(request):
@@ -116,6 +68,8 @@ def customer_list(request):
     
     Features:
     - Efficient database querying with select_related and subqueries
+    - Server-side pagination, sorting and risk/search filtering, with the
+      latest assessment of every customer on a page fetched in one query
     - Risk distribution calculation for FCA compliance
     - CDD (Customer Due Diligence) completion tracking
     - Error handling for database operations
@@ -123,7 +77,12 @@ def customer_list(request):
     """
     try:
         # Get customers with related user data in a single query
-        customers = Customer.objects.select_related('user').order_by('-risk_score')
+        sort = request.GET.get('sort', '-risk_score')
+        if sort not in CUSTOMER_SORT_FIELDS:
+            sort = '-risk_score'
+        customers = Customer.objects.select_related('user').order_by(
+            CUSTOMER_SORT_FIELDS[sort], '-id' if sort.startswith('-') else 'id'
+        )
         
         # Get latest valid risk assessment for each customer
         three_months_ago = timezone.now() - timedelta(days=90)
@@ -135,6 +94,9 @@ def customer_list(request):
         
         # Annotate customers with latest assessment date and expired assessment flag
         customers = customers.annotate(
+            latest_assessment_id=Subquery(
+                latest_assessments.values('id')[:1]
+            ),
             latest_assessment_date=Subquery(
                 latest_assessments.values('assessment_date')[:1]
             ),
@@ -206,30 +168,42 @@ def customer_list(request):
             cdd_complete_percentage = 0
             reassessment_percentage = 0
         
-        # Prepare customer data with risk assessments
-        customer_data = []
-        for customer in customers:
-            try:
-                latest_assessment = None
-                if customer.latest_assessment_date:
-                    latest_assessment = RiskAssessment.objects.filter(
-                        customer=customer,
-                        assessment_date=customer.latest_assessment_date
-                    ).first()
-                
-                customer_data.append({
-                    'customer': customer,
-                    'latest_assessment': latest_assessment,
-                    'needs_reassessment': customer.needs_reassessment
-                })
-            except DatabaseError as e:
-                messages.warning(
-                    request,
-                    f'Error retrieving risk assessment for {customer.user.get_full_name()}: {str(e)}'
-                )
+        # Server-side filtering only narrows the listed page, not the metrics above
+        risk_filter = request.GET.get('risk')
+        if risk_filter in RISK_LEVEL_FILTERS:
+            customers = customers.filter(RISK_LEVEL_FILTERS[risk_filter])
+        search = request.GET.get('q', '').strip()
+        if search:
+            customers = customers.filter(
+                Q(user__username__icontains=search) |
+                Q(user__first_name__icontains=search) |
+                Q(user__last_name__icontains=search) |
+                Q(user__email__icontains=search)
+            )
+        
+        paginator = Paginator(customers, _page_size(request))
+        page_obj = paginator.get_page(request.GET.get('page'))
+        
+        # Fetch the latest assessment of every customer on the page in one query
+        latest_assessments_by_id = RiskAssessment.objects.in_bulk([
+            customer.latest_assessment_id for customer in page_obj
+            if customer.latest_assessment_id
+        ])
+        customer_data = [
+            {
+                'customer': customer,
+                'latest_assessment': latest_assessments_by_id.get(customer.latest_assessment_id),
+                'needs_reassessment': customer.needs_reassessment
+            }
+            for customer in page_obj
+        ]
         
         context = {
             'customer_data': customer_data,
+            'page_obj': page_obj,
+            'sort': sort,
+            'risk_filter': risk_filter if risk_filter in RISK_LEVEL_FILTERS else 'all',
+            'search': search,
             'total_customers': total_count,
             'customer_growth': round(customer_growth, 1),
             'high_risk_count': risk_counts['high_risk'],
@@ -265,26 +239,194 @@ def customer_list(request):
             'error': True
         })
 
+# Filters for the keyset-paginated lists: query parameter -> Q builder.
+# Builders return None for values they do not recognise, which are ignored.
+def _choice_filter(field, choices):
+    return lambda value: Q(**{field: value}) if value in dict(choices) else None
+
+def _customer_filter(value):
+    return Q(customer_id=int(value)) if value.isascii() and value.isdigit() else None
+
+def _date_filter(lookup, end_of_day=False):
+    def build(value):
+        day = parse_date(value) if value else None
+        if day is None:
+            return None
+        if end_of_day:
+            day += timedelta(days=1)
+        return Q(**{lookup: timezone.make_aware(datetime.combine(day, time.min))})
+    return build
+
+def _field_choices(model, field):
+    return model._meta.get_field(field).choices
+
+TRANSACTION_FILTERS = {
+    'customer': _customer_filter,
+    'q': lambda value: Q(customer__user__username__icontains=value),
+    'risk': RISK_LEVEL_FILTERS.get,
+    'status': _choice_filter('screening_status', _field_choices(Transaction, 'screening_status')),
+    'type': _choice_filter('transaction_type', _field_choices(Transaction, 'transaction_type')),
+    'suspicious': lambda value: Q(is_suspicious=value == '1') if value in ('0', '1') else None,
+    'start': _date_filter('timestamp__gte'),
+    'end': _date_filter('timestamp__lt', end_of_day=True),
+}
+
+DOCUMENT_FILTERS = {
+    'customer': _customer_filter,
+    'q': lambda value: Q(customer__user__username__icontains=value),
+    'status': _choice_filter('verification_status',
+                             _field_choices(VerificationDocument, 'verification_status')),
+    'type': _choice_filter('document_type', _field_choices(VerificationDocument, 'document_type')),
+    'expired': lambda value: Q(expiry_date__lt=timezone.now()) if value == '1' else None,
+}
+
+ASSESSMENT_RISK_FILTERS = {
+    'low': Q(overall_score__lt=0.3),
+    'medium': Q(overall_score__gte=0.3, overall_score__lt=0.7),
+    'high': Q(overall_score__gte=0.7),
+}
+
+ASSESSMENT_FILTERS = {
+    'customer': _customer_filter,
+    'q': lambda value: Q(customer__user__username__icontains=value),
+    'risk': ASSESSMENT_RISK_FILTERS.get,
+    'type': _choice_filter('assessment_type', _field_choices(RiskAssessment, 'assessment_type')),
+    'overdue': lambda value: Q(next_review_date__lt=timezone.now()) if value == '1' else None,
+}
+
+# Sort keys accepted by the keyset-paginated lists: key -> (field, descending).
+# Pages are ordered by (field, id), so ties are broken by primary key. Only
+# indexed fields are offered; sorting a large table on anything else scans it.
+TRANSACTION_SORTS = {
+    '-timestamp': ('timestamp', True),
+    'timestamp': ('timestamp', False),
+}
+
+DOCUMENT_SORTS = {
+    '-uploaded': ('upload_date', True),
+    'uploaded': ('upload_date', False),
+}
+
+ASSESSMENT_SORTS = {
+    '-assessed': ('assessment_date', True),
+    'assessed': ('assessment_date', False),
+}
+
+LIST_CURSOR_SALT = 'core.views.list_cursor'
+
+def _cursor_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _keyset_list(request, queryset, filters, sorts):
+    """Return one page of ``queryset`` for a lazily loaded HTML list.
+    
+    Applies the recognised filters from the query string, orders by the
+    requested sort and seeks past the ``after`` cursor, so each page costs
+    one bounded query however deep it is and nothing is counted. The
+    returned context has the page ``rows``, the active ``sort`` and
+    ``filters``, and ``next_query``: the query string of the following
+    page, or ``None`` on the last one.
+    """
+    active = {}
+    for name, build in filters.items():
+        value = request.GET.get(name, '').strip()
+        condition = build(value) if value else None
+        if condition is not None:
+            queryset = queryset.filter(condition)
+            active[name] = value
+    
+    sort = request.GET.get('sort')
+    if sort not in sorts:
+        sort = next(iter(sorts))
+    field, descending = sorts[sort]
+    fields = (field, 'id')
+    queryset = queryset.order_by(*[f'-{name}' if descending else name for name in fields])
+    
+    after = request.GET.get('after')
+    if after:
+        try:
+            queryset = queryset.filter(
+                keyset_filter(fields, signing.loads(after, salt=LIST_CURSOR_SALT), descending)
+            )
+        except signing.BadSignature:
+            pass  # A stale or tampered cursor restarts from the first page
+    
+    page_size = _page_size(request)
+    rows = list(queryset[:page_size + 1])
+    next_query = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        params = request.GET.copy()
+        params['after'] = signing.dumps(
+            [_cursor_value(getattr(rows[-1], name)) for name in fields], salt=LIST_CURSOR_SALT
+        )
+        next_query = params.urlencode()
+    
+    return {
+        'rows': rows,
+        'sort': sort,
+        'filters': active,
+        'next_query': next_query,
+        'now': timezone.now()
+    }
+
+def _list_rows_response(request, rows_template, rows_url_name, context):
+    """Render the rows of a list page as a JSON fragment for infinite scroll."""
+    next_query = context['next_query']
+    return JsonResponse({
+        'html': render_to_string(rows_template, context, request=request),
+        'next': f"{reverse(rows_url_name)}?{next_query}" if next_query else None
+    })
+
+def _transaction_page(request):
+    transactions = Transaction.objects.select_related('customer__user')
+    return _keyset_list(request, transactions, TRANSACTION_FILTERS, TRANSACTION_SORTS)
+
 @login_required
 def transaction_list(request):
-    """View for listing all transactions with ML-based risk analysis."""
-    transactions = Transaction.objects.all().order_by('-timestamp')
-    return render(request, 'transactions.html', {'transactions': transactions})
+    """View for listing transactions with ML-based risk analysis.
+    
+    Shows the first page of the filtered, sorted list; further pages are
+    fetched from ``transaction_rows`` as the user scrolls.
+    """
+    return render(request, 'transactions.html', _transaction_page(request))
+
+@login_required
+def transaction_rows(request):
+    """JSON fragment with the next page of transaction rows."""
+    return _list_rows_response(
+        request, 'partials/transaction_rows.html', 'transaction_rows', _transaction_page(request)
+    )
+
+def _document_page(request):
+    documents = VerificationDocument.objects.select_related('customer__user')
+    return _keyset_list(request, documents, DOCUMENT_FILTERS, DOCUMENT_SORTS)
 
 @login_required
 def document_list(request):
-    """View for listing all verification documents."""
-    documents = VerificationDocument.objects.all().order_by('-upload_date')
-    return render(request, 'documents.html', {
-        'documents': documents,
-        'now': timezone.now()
-    })
+    """View for listing verification documents, loaded a page at a time."""
+    return render(request, 'documents.html', _document_page(request))
+
+@login_required
+def document_rows(request):
+    """JSON fragment with the next page of document rows."""
+    return _list_rows_response(
+        request, 'partials/document_rows.html', 'document_rows', _document_page(request)
+    )
+
+def _assessment_page(request):
+    assessments = RiskAssessment.objects.select_related('customer__user')
+    return _keyset_list(request, assessments, ASSESSMENT_FILTERS, ASSESSMENT_SORTS)
 
 @login_required
 def risk_assessment_list(request):
-    """View for listing all risk assessments."""
-    assessments = RiskAssessment.objects.all().order_by('-assessment_date')
-    return render(request, 'risk_assessments.html', {
-        'assessments': assessments,
-        'now': timezone.now()
-    })
+    """View for listing risk assessments, loaded a page at a time."""
+    return render(request, 'risk_assessments.html', _assessment_page(request))
+
+@login_required
+def risk_assessment_rows(request):
+    """JSON fragment with the next page of risk assessment rows."""
+    return _list_rows_response(
+        request, 'partials/risk_assessment_rows.html', 'risk_assessment_rows',
+        _assessment_page(request)
+    )